@@ -14,18 +14,36 @@ CTBREC server functionality that is exposed includes:
 Tested with ctbrec-server version 4.7.4, and Python version 3.9
 """
 
+import asyncio
+import codecs
+import copy
 import json
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from enum import Enum
-from typing import Union, Mapping, Optional
+from functools import lru_cache
+from typing import Union, Mapping, Optional, Iterable, Iterator
+from collections.abc import Mapping as MappingABC
+import os
+import random
+import threading
+import time
 import uuid
 import re
+import sys
 import hmac
 import hashlib
+import ssl
 import warnings
 
 from urllib3.exceptions import InsecureRequestWarning
 import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 
 class CtbRecRequestFailed(Exception):
@@ -48,9 +66,728 @@ class CtbRecAlreadyExists(Exception):
     pass
 
 
-class CtbRec:
+class CtbRecInvalidSetting(Exception):
+    """ Exception to be raised if a setting value doesn't match the type of the setting on the server """
+    pass
+
+
+class CtbRecUnavailable(CtbRecRequestFailed):
+    """ Exception to be raised if the ctbrec server can't be reached, times out or keeps returning server errors """
+    pass
+
+
+class CtbRecCircuitOpen(CtbRecUnavailable):
+    """ Exception to be raised without contacting the server while the circuit breaker is open """
+    pass
+
+
+class JsonCodec:
+    """ Encodes request bodies and decodes responses with the json module's default, spaced, formatting """
+    name = 'json'
+
+    @staticmethod
+    def dumps(data) -> bytes:
+        return json.dumps(data, default=json_default).encode('utf-8')
+
+    @staticmethod
+    def loads(content: bytes):
+        return json.loads(content.decode('utf-8'))
+
+
+class CompactJsonCodec(JsonCodec):
+    """ Encodes request bodies without spaces and decodes responses straight from bytes """
+    name = 'compact'
+
+    @staticmethod
+    def dumps(data) -> bytes:
+        return json.dumps(data, separators=(',', ':'), default=json_default).encode('utf-8')
+
+    @staticmethod
+    def loads(content: bytes):
+        return json.loads(content)
+
+
+class OrjsonCodec(JsonCodec):
+    """ Encodes and decodes with orjson, which is several times faster than the json module """
+    name = 'orjson'
+
+    @staticmethod
+    def dumps(data) -> bytes:
+        return orjson.dumps(data, default=json_default)
+
+    @staticmethod
+    def loads(content: bytes):
+        return orjson.loads(content)
+
+
+# available codecs by name. 'json' sends requests exactly as earlier versions did, the faster ones are opt-in
+JSON_CODECS = {c.name: c for c in (JsonCodec, CompactJsonCodec, OrjsonCodec) if c is not OrjsonCodec or orjson}
+DEFAULT_CODEC = 'json'
+
+
+@lru_cache(maxsize=65536)
+def url_key(url: str) -> Optional[tuple[str, str]]:
     """
-    Simple Python interface to the awesome ctbrec-server
+    Get the normalised (top level domain, model name) key of a model url, as used by CtbRec.url_match
+
+    Args:
+        url: model url
+    Returns:
+        tuple of (domain, name), or None if the url is not recognised
+    """
+    match = re.findall(CtbRec.regex['domain_name'], url.strip().rstrip('/'))
+    return (match[0][1], match[0][3]) if match else None
+
+
+def model_url_key(url: str) -> Union[tuple[str, str], str]:
+    """
+    Get the key used to compare model urls in model groups: the url_key of a recognised url, otherwise the url without
+    surrounding whitespace or a trailing slash
+    """
+    return url_key(url) or url.strip().rstrip('/')
+
+
+@lru_cache(maxsize=1024)
+def model_site(model_type: str) -> str:
+    """
+    Get the ctbrec site code from a ctbrec model class name, eg. 'Chaturbate' from
+    'ctbrec.sites.chaturbate.ChaturbateModel'
+    """
+    return sys.intern(re.findall(CtbRec.regex['model_type'], model_type)[0])
+
+
+def json_default(obj):
+    """ Convert records to dicts when encoding json, for the `default` argument of json.dumps """
+    if isinstance(obj, Record):
+        return obj.to_dict()
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+class Record(MappingABC):
+    """
+    Compact read-only copy of a dict from the server. The values are kept in a tuple and the keys in a layout shared
+    by all records with the same keys, so a record needs a fraction of the memory of the dict. Nested dicts become
+    records and lists become tuples, and short strings that repeat between records are interned.
+
+    Records can be read like dicts and are encoded as the original dicts when sent to the server. to_dict() returns
+    the original dict.
+    """
+    __slots__ = ('layout', 'values')
+
+    # shared layouts, keyed by the tuple of keys: the key index, the positions of the values that are interned and
+    # the positions where a dict or list has been seen
+    layouts = {}
+    # keys whose string values are interned
+    interned = frozenset(['type', 'name', 'displayName', 'url', 'status', 'recordUntilSubsequentAction', 'id',
+                          'description', 'preview', 'selectedResolution', 'postProcessing'])
+
+    def __init__(self, data: Mapping, shared: Optional[dict] = None):
+        """
+        Args:
+            data: the dict to copy
+            shared: optional dict kept between records created together, in which subclasses can keep nested records
+                    that repeat between them. Default is None.
+        """
+        keys = tuple(data)
+        layout = self.layouts.get(keys)
+        if layout is None:
+            layout = self.layouts.setdefault(keys, ({sys.intern(k): i for i, k in enumerate(keys)},
+                                                    tuple(i for i, k in enumerate(keys) if k in self.interned), ()))
+        self.layout, interned, containers = layout
+        # the values are copied in one go and only those that need converting are visited, as this runs for every
+        # record of a list
+        values = list(data.values())
+        for i in interned:
+            if type(values[i]) is str:
+                values[i] = sys.intern(values[i])
+        for i in containers:
+            values[i] = self.nested(keys[i], values[i], shared)
+        types = set(map(type, values))
+        if dict in types or list in types:
+            # remember where this layout has dicts or lists, so later records go straight to them
+            found = tuple(i for i, v in enumerate(values) if type(v) is dict or type(v) is list)
+            self.layouts[keys] = (self.layout, interned, containers + found)
+            for i in found:
+                values[i] = self.nested(keys[i], values[i], shared)
+        self.values = tuple(values)
+
+    def nested(self, key: str, value, shared: Optional[dict]):
+        """ Convert a dict or list under `key` to its compact form """
+        if type(value) is dict:
+            return Record(value, shared)
+        return self.compact(value, key in self.interned)
+
+    @classmethod
+    def compact(cls, value, intern: bool = False):
+        """ Convert a value to its compact form """
+        if isinstance(value, str):
+            return sys.intern(value) if intern else value
+        if isinstance(value, dict):
+            return Record(value)
+        if isinstance(value, list):
+            return tuple([cls.compact(v, intern) for v in value])
+        return value
+
+    @classmethod
+    def expand(cls, value):
+        """ Convert a compact value back to its original form """
+        if isinstance(value, Record):
+            return value.to_dict()
+        if isinstance(value, tuple):
+            return [cls.expand(v) for v in value]
+        return value
+
+    def to_dict(self) -> dict:
+        """ The dict this record was created from """
+        return {k: self.expand(v) for k, v in zip(self.layout, self.values)}
+
+    def __getitem__(self, key):
+        return self.values[self.layout[key]]
+
+    def __iter__(self) -> Iterator:
+        return iter(self.layout)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def __contains__(self, key) -> bool:
+        return key in self.layout
+
+    def __eq__(self, other) -> bool:
+        # records of the same layout, as when comparing two fetches of a list, compare their values directly
+        if type(other) is type(self) and other.layout is self.layout:
+            return self.values == other.values
+        if isinstance(other, Record):
+            return (self.layout is other.layout and self.values == other.values) or self.to_dict() == other.to_dict()
+        if isinstance(other, MappingABC):
+            return self.to_dict() == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({self.to_dict()!r})'
+
+
+class Model(Record):
+    """
+    Record of a model dict, with its site code, Site:Name id and normalised url key worked out once
+    """
+    __slots__ = ('site', 'id', 'key')
+
+    def __init__(self, data: Mapping):
+        super().__init__(data)
+        self.site = model_site(data['type'])
+        self.id = sys.intern(self.site + ':' + data['name'])
+        self.key = url_key(data['url'])
+
+
+class Recording(Record):
+    """
+    Record of a recording dict, with its recording_key worked out once and its model as a Model record
+    """
+    __slots__ = ('key',)
+
+    def __init__(self, data: Mapping, models: Optional[dict] = None):
+        """
+        Args:
+            data: the recording dict to copy
+            models: optional dict shared between recordings, so that recordings of the same model share one Model
+                    record while the model is unchanged
+        """
+        super().__init__(data, models)
+        self.key = sys.intern(data.get('id') or data['metaDataFile'])
+
+    def nested(self, key: str, value, shared: Optional[dict]):
+        if key != 'model' or type(value) is not dict:
+            return super().nested(key, value, shared)
+        if shared is None:
+            return Model(value)
+        # comparing the decoded dicts is much quicker than building a record to compare
+        seen = shared.get((value.get('type'), value.get('name')))
+        if seen is None or seen[0] != value:
+            seen = shared[value.get('type'), value.get('name')] = (value, Model(value))
+        return seen[1]
+
+
+class ModelIndex:
+    """
+    Lookup tables for a list of models fetched from the server, keyed by Site:Name, by exact url and by
+    normalised url key
+    """
+
+    def __init__(self, models: Mapping[str, dict], generation: int = 0):
+        """
+        Args:
+            models: dict of models keyed by Site:Name, as returned by CtbRec.get_models
+            generation: the client's model cache generation when the models were requested
+        """
+        self.fetched = time.monotonic()
+        self.generation = generation
+        self.by_id = dict(models)
+        self.by_url = {}
+        self.by_key = {}
+        for m in models.values():
+            url = m['url'].strip().rstrip('/')
+            self.by_url.setdefault(url, m)
+            key = m.key if isinstance(m, Model) else url_key(url)
+            if key is not None:
+                self.by_key.setdefault(key, m)
+
+    def age(self) -> float:
+        """ Seconds since the models were fetched """
+        return time.monotonic() - self.fetched
+
+
+def recording_key(recording: dict) -> str:
+    """ Get the key identifying a recording, its id or its metadata file if it has no id """
+    if isinstance(recording, Recording):
+        return recording.key
+    return recording.get('id') or recording['metaDataFile']
+
+
+def diff_recordings(previous: Mapping[str, dict], current: list[dict]) -> dict:
+    """
+    Compare two versions of the server's recording list
+
+    Args:
+        previous: dict of the earlier recordings keyed by recording_key
+        current: list of the current recordings
+    Returns:
+        dict with keys 'added' and 'removed' (lists of recordings only in current or previous), 'changed' (list of
+        current recordings that differ from the previous version in any way) and 'status_changed' (the subset of
+        'changed' whose status differs)
+    """
+    added, changed, status_changed = [], [], []
+    keys = set()
+    for r in current:
+        key = recording_key(r)
+        keys.add(key)
+        p = previous.get(key)
+        if p is None:
+            added.append(r)
+        elif p != r:
+            changed.append(r)
+            if p['status'] != r['status']:
+                status_changed.append(r)
+    removed = [r for k, r in previous.items() if k not in keys]
+    return {'added': added, 'removed': removed, 'changed': changed, 'status_changed': status_changed}
+
+
+class RecordingCache:
+    """
+    Local copy of the server's recording list keyed by recording_key, optionally persisted to a json file so that
+    it is shared between processes
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        """
+        Args:
+            path: optional file the cache is loaded from and saved to
+        """
+        self.path = path
+        self.fetched = None
+        self.recordings = {}
+        self.delta = None
+        self.lock = threading.Lock()
+        if path:
+            self.load()
+
+    def load(self):
+        """ Load the cache file, leaving the cache empty if it doesn't exist or can't be read """
+        try:
+            with open(self.path, 'rb') as f:
+                state = json.load(f)
+            self.recordings = {recording_key(r): r for r in state['recordings']}
+            self.fetched = state['fetched']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def save(self):
+        """ Write the cache file, replacing the previous one atomically """
+        if not self.path:
+            return
+        tmp = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'fetched': self.fetched, 'recordings': list(self.recordings.values())}, f,
+                      separators=(',', ':'), default=json_default)
+        os.replace(tmp, self.path)
+
+    def age(self) -> float:
+        """ Seconds since the recordings were fetched, infinite if they never have been """
+        return float('inf') if self.fetched is None else time.time() - self.fetched
+
+    def update(self, recordings: list[dict]) -> dict:
+        """
+        Replace the cached recordings with a freshly fetched list
+
+        Returns:
+            the delta from the previous list, see diff_recordings
+        """
+        self.delta = diff_recordings(self.recordings, recordings)
+        self.recordings = {recording_key(r): r for r in recordings}
+        self.fetched = time.time()
+        self.save()
+        return self.delta
+
+    @staticmethod
+    def copy(recordings: Iterable[dict]) -> list[dict]:
+        """ Copy recordings handed out from the cache, so that callers changing them don't change the cache.
+        Recording records are read-only and are not copied. """
+        return [r if isinstance(r, Record) else dict(r) for r in recordings]
+
+    def invalidate(self):
+        """ Mark the cached recordings as stale after a recording has been changed on the server """
+        self.fetched = None
+
+    def discard(self, *recordings: dict):
+        """ Remove recordings that have been deleted from the server """
+        with self.lock:
+            if [r for r in recordings if self.recordings.pop(recording_key(r), None) is not None]:
+                self.save()
+
+
+class JsonArrayStream:
+    """
+    Incremental parser for a json object read from a stream of byte chunks, yielding the elements of one of its array
+    members one at a time so that only the current element is held in memory. The object's other members are
+    collected in envelope.
+    """
+    whitespace = ' \t\n\r'
+
+    def __init__(self, chunks: Iterable[bytes], key: str):
+        """
+        Args:
+            chunks: the utf-8 encoded json text, in chunks of any size
+            key: name of the array member whose elements are yielded
+        """
+        self.chunks = codecs.iterdecode(chunks, 'utf-8')
+        self.key = key
+        self.envelope = {}
+        self.found = False
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def fill(self) -> bool:
+        """ Append the next chunk to the buffer, dropping the consumed text. Returns False at the end of the stream """
+        if not self.eof:
+            for chunk in self.chunks:
+                if chunk:
+                    self.buf = self.buf[self.pos:] + chunk
+                    self.pos = 0
+                    return True
+            self.eof = True
+        return False
+
+    def peek(self) -> str:
+        """ Skip whitespace and return the next character without consuming it, or '' at the end of the stream """
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in self.whitespace:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, chars: str) -> str:
+        """ Consume the next non-whitespace character, which must be one of chars """
+        c = self.peek()
+        if not c or c not in chars:
+            raise ValueError(f'Expected one of {chars!r} at {self.pos} but got {c!r}')
+        self.pos += 1
+        return c
+
+    def value(self):
+        """ Decode the next json value, reading more of the stream until it is complete """
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+                continue
+            # a number at the end of the buffer may continue in the next chunk
+            if end == len(self.buf) and self.fill():
+                continue
+            self.pos = end
+            return value
+
+    def __iter__(self) -> Iterator:
+        self.expect('{')
+        if self.peek() == '}':
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            if key == self.key:
+                self.found = True
+                self.expect('[')
+                if self.peek() == ']':
+                    self.pos += 1
+                else:
+                    while True:
+                        yield self.value()
+                        if self.expect(',]') == ']':
+                            break
+            else:
+                self.envelope[key] = self.value()
+            if self.expect(',}') == '}':
+                return
+
+
+class ServerState:
+    """
+    Models, online models, recordings and drive space fetched from the server together, from which the summary,
+    model status, online set and counts are derived in a single pass over each list
+    """
+
+    def __init__(self, models: Mapping[str, dict], online: Mapping[str, dict], recordings: list[dict],
+                 space: dict, model_id):
+        """
+        Args:
+            models: dict of all models, as returned by CtbRec.get_models()
+            online: dict of online models, as returned by CtbRec.get_models(online=True)
+            recordings: list of recordings, as returned by CtbRec.get_recordings()
+            space: drive space statistics, as returned by CtbRec.get_space()
+            model_id: function returning the Site:ModelName id of a model dict
+        """
+        self.fetched = time.monotonic()
+        self.models = models
+        self.online = online
+        self.recordings = recordings
+        self.space = space
+        self.recording = set()
+        self.status_counts = {}
+        for r in recordings:
+            status = r['status']
+            self.status_counts[status] = self.status_counts.get(status, 0) + 1
+            if status == 'RECORDING':
+                self.recording.add(model_id(r['model']))
+        self.paused = set()
+        self.bookmarked = set()
+        for k, m in models.items():
+            if m['suspended']:
+                self.paused.add(k)
+            if m['bookmarked']:
+                self.bookmarked.add(k)
+
+    def age(self) -> float:
+        """ Seconds since the state was fetched """
+        return time.monotonic() - self.fetched
+
+    def model_status(self) -> Mapping[str, str]:
+        """ Status code for all models, see CtbRec.get_model_status """
+        result = dict.fromkeys(self.models.keys(), 'offline')
+        result.update(dict.fromkeys(self.online.keys(), 'online'))
+        result.update(dict.fromkeys(self.recording, 'recording'))
+        result.update(dict.fromkeys(self.bookmarked, 'later'))
+        result.update(dict.fromkeys(self.paused, 'paused'))
+        return result
+
+    def summary(self) -> dict:
+        """ Summary of server activity, see CtbRec.get_summary """
+        space = self.space
+        return {"total_models": len(self.models), "models_recording": self.status_counts.get('RECORDING', 0),
+                "models_online": len(self.online), "models_paused": len(self.paused),
+                "models_bookmarked": len(self.bookmarked), "total_recordings": len(self.recordings),
+                "post_processing": self.status_counts.get('POST_PROCESSING', 0),
+                "space_used": f"{round((space['spaceTotal']-space['spaceFree'])/1e9,3)} GB",
+                "space_free": f"{round(space['spaceFree']/1e9,3)} GB"}
+
+
+class CircuitBreaker:
+    """
+    Fails requests fast after the server has been unavailable for several requests in a row. Once `reset_timeout`
+    seconds have passed one trial request is let through, which closes the breaker again if it succeeds.
+    """
+
+    def __init__(self, threshold: int = 5, reset_timeout: float = 30.0):
+        """
+        Args:
+            threshold: number of consecutive failed requests that opens the breaker, 0 to never open it
+            reset_timeout: seconds the breaker stays open before a trial request is allowed
+        """
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened = None
+        self.trial = False
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """ Check whether a request may be sent """
+        with self.lock:
+            if self.opened is None:
+                return True
+            if not self.trial and time.monotonic() - self.opened >= self.reset_timeout:
+                self.trial = True
+                return True
+            return False
+
+    def success(self):
+        """ Record a request that reached the server """
+        with self.lock:
+            self.failures = 0
+            self.opened = None
+            self.trial = False
+
+    def failure(self):
+        """ Record a request that failed because the server was unavailable """
+        with self.lock:
+            self.failures += 1
+            if self.trial or (self.threshold and self.failures >= self.threshold):
+                self.opened = time.monotonic()
+            self.trial = False
+
+    @property
+    def state(self) -> str:
+        """ 'closed', 'open' or 'half-open' """
+        with self.lock:
+            if self.opened is None:
+                return 'closed'
+            return 'half-open' if self.trial or time.monotonic() - self.opened >= self.reset_timeout else 'open'
+
+
+class RequestMetrics:
+    """
+    Per-action statistics of the requests sent by a CtbRec client: a latency histogram, bytes sent and received,
+    time spent signing requests and parsing responses, and error counts by kind. Pass an instance as the `metrics`
+    argument of CtbRec. Any object with a compatible observe() method can be used instead to collect the
+    measurements elsewhere.
+
+    Error kinds are 'encode' (the request couldn't be serialised), 'network' (the server couldn't be reached, timed
+    out or returned a server error), 'unavailable' (not sent because the circuit breaker is open), 'http' (another
+    status than 200), 'parse' (the response isn't valid json) and 'failed'
+    (the server reported the request failed).
+    """
+
+    # upper bounds of the latency histogram buckets, in seconds
+    buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self, textfile: Optional[str] = None, labels: Optional[Mapping[str, str]] = None,
+                 write_interval: float = 10.0, on_request=None):
+        """
+        Args:
+            textfile: optional file the metrics are written to in the Prometheus text format, for the node_exporter
+                      textfile collector. Default is None.
+            labels: optional labels added to every exported metric, eg. {'script': 'reclaim'}. Default is None.
+            write_interval: minimum number of seconds between writes of the textfile while requests are observed.
+                      Call write() to write it immediately. Default is 10.
+            on_request: optional function called with each observation as a dict. Default is None.
+        """
+        self.textfile = textfile
+        self.labels = dict(labels or {})
+        self.write_interval = write_interval
+        self.on_request = on_request
+        self.lock = threading.Lock()
+        self.written = None
+        self.reset()
+
+    @classmethod
+    def from_env(cls, script: str) -> Optional['RequestMetrics']:
+        """ Metrics for a script, written to <METRICS_DIR>/<script>.prom, or None if METRICS_DIR isn't set """
+        folder = os.environ.get('METRICS_DIR')
+        if not folder:
+            return None
+        return cls(os.path.join(folder, script + '.prom'), labels={'script': script})
+
+    def reset(self):
+        """ Clear all statistics """
+        with self.lock:
+            self.actions = {}
+
+    def observe(self, action: str, latency: float, sign: float = 0.0, parse: float = 0.0, sent: int = 0,
+                received: int = 0, error: Optional[str] = None):
+        """
+        Record one request
+
+        Args:
+            action: the /rec action, or the request path for other requests
+            latency: seconds from starting to sign the request until its response was parsed
+            sign: seconds spent serialising and signing the request
+            parse: seconds spent parsing the response
+            sent: number of request body bytes
+            received: number of response body bytes
+            error: kind of error if the request failed, else None
+        """
+        with self.lock:
+            a = self.actions.get(action)
+            if a is None:
+                a = self.actions[action] = {'count': 0, 'latency': 0.0, 'buckets': [0] * (len(self.buckets) + 1),
+                                            'sign': 0.0, 'parse': 0.0, 'sent': 0, 'received': 0, 'errors': {}}
+            a['count'] += 1
+            a['latency'] += latency
+            a['buckets'][next((i for i, b in enumerate(self.buckets) if latency <= b), len(self.buckets))] += 1
+            a['sign'] += sign
+            a['parse'] += parse
+            a['sent'] += sent
+            a['received'] += received
+            if error:
+                a['errors'][error] = a['errors'].get(error, 0) + 1
+            write = self.textfile and (self.written is None or
+                                       time.monotonic() - self.written >= self.write_interval)
+            if write:
+                self.written = time.monotonic()
+        if self.on_request is not None:
+            self.on_request({'action': action, 'latency': latency, 'sign': sign, 'parse': parse, 'sent': sent,
+                             'received': received, 'error': error})
+        if write:
+            self.write()
+
+    def snapshot(self) -> dict:
+        """ Copy of the statistics, keyed by action """
+        with self.lock:
+            return copy.deepcopy(self.actions)
+
+    def prometheus(self) -> str:
+        """ The statistics in the Prometheus text exposition format """
+        def labels(**extra):
+            pairs = dict(self.labels, **extra)
+            return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')
+                                                   .replace('\n', '\\n')) for k, v in pairs.items()) + '}'
+
+        actions = self.snapshot()
+        lines = ['# HELP ctbrec_request_duration_seconds Time taken by ctbrec server requests, including signing '
+                 'and parsing',
+                 '# TYPE ctbrec_request_duration_seconds histogram']
+        for action, a in sorted(actions.items()):
+            total = 0
+            for bound, n in zip(self.buckets + ('+Inf',), a['buckets']):
+                total += n
+                lines.append(f'ctbrec_request_duration_seconds_bucket{labels(action=action, le=bound)} {total}')
+            lines.append(f"ctbrec_request_duration_seconds_sum{labels(action=action)} {a['latency']}")
+            lines.append(f"ctbrec_request_duration_seconds_count{labels(action=action)} {a['count']}")
+        for name, key, text in (('ctbrec_request_sign_seconds_total', 'sign', 'Time spent signing requests'),
+                                ('ctbrec_response_parse_seconds_total', 'parse', 'Time spent parsing responses'),
+                                ('ctbrec_request_sent_bytes_total', 'sent', 'Request body bytes sent'),
+                                ('ctbrec_response_received_bytes_total', 'received', 'Response body bytes received')):
+            lines += [f'# HELP {name} {text}', f'# TYPE {name} counter']
+            lines += [f'{name}{labels(action=action)} {a[key]}' for action, a in sorted(actions.items())]
+        lines += ['# HELP ctbrec_request_errors_total Failed requests by kind of error',
+                  '# TYPE ctbrec_request_errors_total counter']
+        for action, a in sorted(actions.items()):
+            lines += [f'ctbrec_request_errors_total{labels(action=action, kind=kind)} {n}'
+                      for kind, n in sorted(a['errors'].items())]
+        return '\n'.join(lines) + '\n'
+
+    def write(self):
+        """ Write the textfile now, replacing the previous one atomically """
+        if not self.textfile:
+            return
+        tmp = f'{self.textfile}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            f.write(self.prometheus())
+        os.replace(tmp, self.textfile)
+
+
+class CtbRecBase:
+    """
+    Everything CtbRec and AsyncCtbRec share that doesn't send requests: the caches, model matching, working out
+    plans and changes from fetched lists, setting validation, request signing and encoding, and the retry and
+    metrics bookkeeping of the transport. Each client sends the requests these work out in its own way.
     """
 
     # basic regular expressions for model strings/urls
@@ -61,13 +798,576 @@ class CtbRec:
         'model_type': re.compile(r'ctbrec\.sites\.[\w]+\.([\w]+)Model')
     }
 
+    # requests that can safely be sent again if they fail, as they don't change anything on the server. GET requests
+    # are always retried.
+    idempotent_actions = frozenset(['list', 'listOnline', 'recordings', 'space', 'listModelGroups'])
+
+    # model properties that can be set along with a model
+    model_props = ('priority', 'bookmarked', 'suspended', 'recordUntil', 'recordUntilSubsequentAction')
+
+    # python types accepted for each ctbrec setting type
+    setting_types = {'INTEGER': int, 'LONG': int, 'DOUBLE': (int, float), 'BOOLEAN': bool, 'STRING': str}
+
     class ModelType(Enum):
         """ used for identifying model input type """
         url = 1
         site_name = 2
         model_dict = 3
 
-    def __init__(self, server_url: str, username: str = None, password: str = None, verify: Union[bool, str] = False):
+    def __init__(self, server_url: str, models_max_age: float = 10.0, pool_size: int = 10,
+                 recordings_cache_file: Optional[str] = None, recordings_max_age: float = 0.0,
+                 state_max_age: float = 0.0, settings_max_age: float = 0.0, metrics: Optional[RequestMetrics] = None,
+                 timeout: Union[float, tuple[float, float], None] = (5.0, 60.0), retries: int = 3,
+                 backoff: float = 0.5, breaker_threshold: int = 5, breaker_reset: float = 30.0,
+                 codec: str = DEFAULT_CODEC, typed: bool = False):
+        """ Set up the caches and options of a client, see CtbRec for the arguments """
+        self.server_url = server_url.strip("/")
+        self.models_max_age = models_max_age
+        self.pool_size = pool_size
+        self._model_index = None
+        self._model_generation = 0
+        self.recordings_max_age = recordings_max_age
+        self.recording_cache = RecordingCache(recordings_cache_file)
+        self.state_max_age = state_max_age
+        self._server_state = None
+        self._settings = None
+        self._settings_fetched = None
+        self.settings_max_age = settings_max_age
+        self._pending_settings = {}
+        self.settings_version = 0
+        self.metrics = metrics
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_reset)
+        self.codec = JSON_CODECS[codec]
+        self.typed = typed
+        self.hmac_key = b''
+        # copy of the initial server config, either taken when connecting or on first access
+        self._initial_config = None
+        self._initial_models = None
+        self._initial_model_groups = None
+
+    # ----------------------------------------- models and model groups -----------------------------------------------
+    def models_by_id(self, models: list[dict]) -> dict:
+        """ A fetched model list keyed by Site:ModelName, as Model records if the client is typed """
+        if self.typed:
+            return {m.id: m for m in map(Model, models)}
+        return {self.model_id(m): m for m in models}
+
+    def stale_model_index(self, index: Optional[ModelIndex]) -> bool:
+        """ Whether a model index is too old, or was requested before the model cache was last invalidated """
+        return index is None or index.generation != self._model_generation or index.age() > self.models_max_age
+
+    def invalidate_model_cache(self):
+        """ Discard the cached model index so that the next model lookup fetches the model list from the server """
+        self._model_generation += 1
+
+    def match_added(self, index: ModelIndex, started: list[tuple[dict, tuple]], props: dict) -> list[tuple[dict, dict]]:
+        """
+        Look for the models sent by add_models_batch in the model list fetched afterwards, marking the results of
+        those found as added
+
+        Args:
+            index: the model index fetched after the models were sent
+            started: (result, (model input type, model)) of each model that was sent
+            props: the parsed properties given for all models
+        Returns:
+            (result, model dict) of the models found that still need their properties set
+        """
+        to_update = []
+        for r, (mt, model) in started:
+            m = self.match_model(index, model, mt)
+            if m is None:
+                r['result'] = 'not_found'
+                r['reason'] = 'Requested model could not be found on server.'
+            elif props and mt != self.ModelType.model_dict:
+                to_update.append((r, dict(m, **{k: v for k, v in props.items() if k in m})))
+            else:
+                r['result'] = 'added'
+                r['server_model'] = dict(m)
+        invalid_keys = {k for _, m in to_update for k in props if k not in m}
+        if invalid_keys:
+            warnings.warn(f'Invalid properties {",".join(invalid_keys)} will be ignored.')
+        return to_update
+
+    def match_updated(self, index: ModelIndex, updated: list[tuple[dict, dict]]):
+        """ Look for the models whose properties add_models_batch set in the model list fetched afterwards, marking
+        the results of those found as added """
+        for r, m in updated:
+            m = self.match_model(index, m, self.ModelType.model_dict)
+            if m is None:
+                r['result'] = 'not_found'
+                r['reason'] = 'Requested model could not be found on server.'
+            else:
+                r['result'] = 'added'
+                r['server_model'] = dict(m)
+
+    def updated_model(self, model: dict, props: dict) -> Optional[dict]:
+        """ A model dict with the properties it has changed, warning about those it doesn't have, or None if none
+        of them can be changed """
+        invalid_keys = [k for k in props if k not in model]
+        if invalid_keys:
+            warnings.warn(f'Invalid properties {",".join(invalid_keys)} will be ignored.')
+        p = {k: v for k, v in props.items() if k in model}
+        return dict(model, **p) if model and p else None
+
+    def match_removals(self, index: ModelIndex, models: list[Union[str, dict]]) -> list[dict]:
+        """ The results of remove_models_batch before any model is removed, with the server model of each input
+        model that was found """
+        results = [{'model': m, 'result': 'failed', 'reason': None, 'server_model': None} for m in models]
+        for r in results:
+            try:
+                r['server_model'] = self.match_model(index, r['model'], self.parse_model_type(r['model']))
+            except CtbRecInvalidModelDefinition as error:
+                r['reason'] = str(error)
+                continue
+            if r['server_model'] is None:
+                r['result'] = 'not_found'
+                r['reason'] = 'Requested model could not be found on server.'
+        return results
+
+    def check_removed(self, index: ModelIndex, stopped: list[dict]):
+        """ Mark the results of the models remove_models_batch stopped as removed if they are gone from the model
+        list fetched afterwards """
+        for r in stopped:
+            if self.model_id(r['server_model']) in index.by_id:
+                r['reason'] = 'Model is still on the server after being removed.'
+            else:
+                r['result'] = 'removed'
+
+    def plan_from_index(self, index: ModelIndex, desired: list[Union[str, dict]],
+                        remove_missing: bool = False) -> list[dict]:
+        """ The plan of plan_models, worked out from a freshly fetched model index """
+        plan = []
+        matched = set()
+        for item in desired:
+            model = item.get('model', item) if isinstance(item, dict) else item
+            props = self.parse_model_props({k: v for k, v in item.items() if k in self.model_props}
+                                           if isinstance(item, dict) and 'model' in item else {})
+            entry = {'model': model, 'props': props, 'action': 'add', 'server_model': None, 'changes': {},
+                     'reason': None}
+            plan.append(entry)
+            try:
+                m = self.match_model(index, model, self.parse_model_type(model))
+            except CtbRecInvalidModelDefinition as error:
+                entry.update(action='invalid', reason=str(error))
+                continue
+            if m is None:
+                continue
+            key = self.model_id(m)
+            entry['server_model'] = m
+            if key in matched:
+                entry.update(action='duplicate', reason=f'{key} is already in the desired state')
+                continue
+            matched.add(key)
+            wanted = dict(props, **{k: model[k] for k in self.model_props if k in model}) \
+                if isinstance(model, dict) else props
+            entry['changes'] = {k: (m.get(k), v) for k, v in wanted.items() if m.get(k) != v}
+            entry['action'] = 'update' if entry['changes'] else 'unchanged'
+        if remove_missing:
+            plan += [{'model': m['url'], 'props': {}, 'action': 'remove', 'server_model': m, 'changes': {},
+                      'reason': None} for key, m in index.by_id.items() if key not in matched]
+        return plan
+
+    def plan_request(self, entry: dict) -> tuple[Optional[ModelType], dict, dict]:
+        """
+        The request applying a plan entry
+
+        Returns:
+            tuple of the model input type and model to look for on the server afterwards, and the request data
+        Raises:
+            CtbRecInvalidModelDefinition
+        """
+        if entry['action'] == 'add':
+            mt, data = self.start_request(entry['model'], entry['props'])
+            return mt, data['model'] if mt == self.ModelType.model_dict else entry['model'], data
+        if entry['action'] == 'update':
+            model = dict(entry['server_model'], **{k: v for k, (_, v) in entry['changes'].items()})
+            return self.ModelType.model_dict, model, {'action': 'start', 'model': model}
+        return None, entry['server_model'], {'action': 'stop', 'model': entry['server_model']}
+
+    def check_plan(self, index: ModelIndex, sent: list[tuple[dict, tuple]]) -> list[tuple[dict, dict]]:
+        """
+        Check the plan entries apply_model_plan sent against the model list fetched afterwards, updating their
+        results
+
+        Args:
+            index: the model index fetched after the requests were sent
+            sent: (result, (model input type, model)) of each entry whose request was sent
+        Returns:
+            (result, model dict) of the added models that still need their properties set
+        """
+        to_update = []
+        for r, (mt, model) in sent:
+            if r['action'] == 'remove':
+                if self.model_id(model) in index.by_id:
+                    r['reason'] = 'Model is still on the server after being removed.'
+                else:
+                    r.update(result='ok', server_model=None)
+                continue
+            m = self.match_model(index, model, mt)
+            if m is None:
+                r.update(result='not_found', reason='Requested model could not be found on server.')
+            elif r['action'] == 'update' and any(m.get(k) != v for k, (_, v) in r['changes'].items()):
+                r.update(reason='Model properties were not updated on the server.', server_model=dict(m))
+            elif r['action'] == 'add' and r['props'] and any(m.get(k) != v for k, v in r['props'].items()):
+                to_update.append((r, dict(m, **{k: v for k, v in r['props'].items() if k in m})))
+            else:
+                r.update(result='ok', server_model=dict(m))
+        return to_update
+
+    @staticmethod
+    def group_with_models(group: dict, model_list: list[Union[dict, str]]) -> Optional[dict]:
+        """ A model group with models added, leaving out those already in it compared by model_url_key, or None if
+        there is nothing to add """
+        present = {model_url_key(u) for u in group['modelUrls']}
+        added = []
+        for m in model_list:
+            url = m if isinstance(m, str) else m['url']
+            if model_url_key(url) not in present:
+                present.add(model_url_key(url))
+                added.append(url)
+        return dict(group, modelUrls=group['modelUrls'] + added) if added else None
+
+    @staticmethod
+    def group_without_models(group: dict, model_list: list[Union[dict, str]]) -> Optional[dict]:
+        """ A model group with models removed, comparing urls by model_url_key, or None if none of them are in it """
+        ml = {model_url_key(m if isinstance(m, str) else m['url']) for m in model_list}
+        urls = [u for u in group['modelUrls'] if model_url_key(u) not in ml]
+        return dict(group, modelUrls=urls) if len(urls) != len(group['modelUrls']) else None
+
+    @staticmethod
+    def new_model_group(name: str, model_list: list) -> dict:
+        """ A group dict for a new model group, with each model url once """
+        ml = {m if isinstance(m, str) else m['url'] for m in model_list}  # use set to reduce to unique urls
+        return {"name": name, 'modelUrls': list(ml), 'id': uuid.uuid4().__str__()}
+
+    @staticmethod
+    def group_report(groups: Mapping[str, dict], desired: Mapping[str, list[Union[dict, str]]],
+                     delete_missing: bool = False, dry_run: bool = False) -> list[dict]:
+        """ The report of sync_model_groups before anything is written, worked out from the groups on the server """
+        report = []
+        for name, model_list in desired.items():
+            wanted = {}
+            for m in model_list:
+                url = m if isinstance(m, str) else m['url']
+                wanted.setdefault(model_url_key(url), url)
+            group = groups.get(name)
+            if group is None:
+                report.append({'name': name, 'action': 'created', 'added': list(wanted.values()), 'removed': [],
+                               'group': {'name': name, 'modelUrls': list(wanted.values()), 'id': str(uuid.uuid4())}})
+                continue
+            kept = {}
+            removed = []
+            for url in group['modelUrls']:
+                key = model_url_key(url)
+                if key in wanted and key not in kept:
+                    kept[key] = url
+                else:
+                    removed.append(url)
+            added = [url for key, url in wanted.items() if key not in kept]
+            report.append({'name': name, 'action': 'updated' if added or removed else 'unchanged', 'added': added,
+                           'removed': removed, 'group': dict(group, modelUrls=list(kept.values()) + added)})
+        if delete_missing:
+            report += [{'name': name, 'action': 'deleted', 'added': [], 'removed': list(group['modelUrls']),
+                        'group': group} for name, group in groups.items() if name not in desired]
+        for r in report:
+            r['result'] = 'dry_run' if dry_run and r['action'] != 'unchanged' else 'ok'
+            r['reason'] = None
+        return report
+
+    # ----------------------------------------------- recordings -------------------------------------------------------
+    def recording_records(self, recordings: list[dict]) -> list[dict]:
+        """ A fetched recording list, as Recording records sharing their model records if the client is typed """
+        if not self.typed:
+            return recordings
+        models = {}
+        return [Recording(r, models) for r in recordings]
+
+    # ------------------------------------------------ settings --------------------------------------------------------
+    def settings_fetched(self, settings: list):
+        """ Refresh the local copy of the settings from a fetched list. The caller holds the settings lock. """
+        self._settings = {s['key']: s for s in copy.deepcopy(settings)}
+        self._settings_fetched = time.monotonic()
+        self.settings_version += 1
+        if self._initial_config is None:
+            self._initial_config = copy.deepcopy(settings)
+
+    def settings_written(self, settings: list):
+        """ Replace the local copy of the settings with a list that was written to the server, dropping any staged
+        changes. The caller holds the settings lock. """
+        self._settings = {s['key']: s for s in copy.deepcopy(settings)}
+        self._settings_fetched = time.monotonic()
+        self._pending_settings.clear()
+        self.settings_version += 1
+
+    def stage_checked(self, settings: dict):
+        """ Validate setting changes against the local copy of the settings, which must have been fetched, and stage
+        them. The caller holds the settings lock.
+
+        Raises:
+            CtbRecInvalidSetting if a value doesn't match the type of its setting, in which case nothing is staged
+        """
+        changes = {}
+        for k, v in settings.items():
+            if k not in self._settings:
+                warnings.warn(f'{k} is not a valid settings key and will be ignored')
+            elif not self.valid_setting_value(self._settings[k], v):
+                raise CtbRecInvalidSetting(f'{v!r} is not a valid value for {k} of type '
+                                           f'{self._settings[k].get("type", type(self._settings[k]["value"]))}')
+            else:
+                changes[k] = v
+        self._pending_settings.update(copy.deepcopy(changes))
+
+    def stale_settings(self, max_age: Optional[float]) -> bool:
+        """ Whether commit_settings has to fetch the settings before writing the staged changes """
+        max_age = self.settings_max_age if max_age is None else max_age
+        return self._settings is None or bool(self._pending_settings and
+                                              time.monotonic() - self._settings_fetched > max_age)
+
+    def settings_to_commit(self) -> Optional[list]:
+        """ The settings list to write for the staged changes, after dropping those for keys the server no longer
+        has and values it already has, or None if nothing has changed. The caller holds the settings lock. """
+        pending = self._pending_settings
+        for k in list(pending):
+            if k not in self._settings:
+                warnings.warn(f'{k} is no longer a settings key on the server and will be ignored')
+                del pending[k]
+            elif self._settings[k]['value'] == pending[k]:
+                del pending[k]
+        if not pending:
+            return None
+        return [dict(s, value=pending[k]) if k in pending else s for k, s in self._settings.items()]
+
+    def settings_committed(self) -> list:
+        """ Apply the staged changes, once written, to the local copy of the settings and return a copy of it. The
+        caller holds the settings lock. """
+        for k, v in self._pending_settings.items():
+            self._settings[k]['value'] = v
+        self._pending_settings.clear()
+        self._settings_fetched = time.monotonic()
+        self.settings_version += 1
+        return copy.deepcopy(list(self._settings.values()))
+
+    # ------------------------------------------- internal methods -----------------------------------------------------
+    def type_to_site(self, model_type: str) -> str:
+        """
+        Get ctbrec site code from ctbrec site class name
+
+        Args:
+            model_type: str containing ctbrec model type code
+        """
+        return model_site(model_type)
+
+    def parse_model_props(self, props: dict) -> dict:
+        """
+        Process model properties. At the moment this only adjusts 'recordUntil' if it is specified as a datetime or
+        in hours.
+
+        Args:
+            props: dict containing model properties
+        Returns:
+            model dict after converting recordUntil to a timestamp
+        """
+        p = props
+        if p and 'recordUntil' in p:
+            record_until = p['recordUntil']
+            if isinstance(record_until, datetime):
+                p['recordUntil'] = round(record_until.timestamp()*1000)
+            elif isinstance(record_until, int) and record_until < 10000:   # assume it is specified in hours
+                p['recordUntil'] = round(datetime.now().timestamp()*1000 + record_until*3600000)
+        return p
+
+    def start_request(self, model: Union[str, dict], props: dict = None) -> tuple[ModelType, dict]:
+        """
+        Build the request data for adding a model to the server
+
+        Args:
+            model: one of [url[str], Site:Name[str], ModelDict[dict]]
+            props: optional dict of already parsed model properties, only merged into ModelDict models
+        Returns:
+            tuple of the model input type and the request data
+        Raises:
+            CtbRecInvalidModelDefinition
+        """
+        mt = self.parse_model_type(model)
+        if mt == self.ModelType.model_dict:
+            model = self.parse_model_props(dict(model))
+            if props:
+                model.update(props)
+            return mt, {'action': 'start', 'model': model}
+        elif mt == self.ModelType.site_name:
+            return mt, {'action': 'startByName', 'model': {"type": None, "name": "", "url": model}}
+        return mt, {'action': 'startByUrl', 'model': {"type": None, "name": "", "url": model}}
+
+    def match_model(self, index: ModelIndex, model: Union[str, dict], mt: ModelType) -> Optional[dict]:
+        """
+        Match a model input against a model index
+
+        Args:
+            index: the model index to search
+            model: one of [url[str], Site:Name[str], ModelDict[dict]]
+            mt: the model input type, as returned by parse_model_type
+        Returns:
+            the matching indexed model dict, or None if there is no match
+        """
+        if mt == self.ModelType.model_dict:
+            match = index.by_id.get(self.model_id(model))
+            return match if match is not None and match['type'] == model['type'] else None
+        elif mt == self.ModelType.url:
+            match = index.by_url.get(model.strip().rstrip('/'))
+            return match if match is not None else index.by_key.get(url_key(model))
+        return index.by_id.get(model)
+
+    @classmethod
+    def valid_setting_value(cls, setting: dict, value) -> bool:
+        """
+        Check that a value has the type expected by a setting, using the setting's type if it is known or else the
+        type of its current value
+
+        Args:
+            setting: ctbrec setting dict
+            value: the proposed new value
+        """
+        expected = cls.setting_types.get(setting.get('type'))
+        if expected is None:
+            current = setting.get('value')
+            if current is None or value is None:
+                return True
+            expected = (int, float) if isinstance(current, float) else type(current)
+        if isinstance(value, bool) and expected is not bool:
+            return False
+        return value is None or isinstance(value, expected)
+
+    def model_id(self, model: dict) -> str:
+        """
+        Get model id from model dict. Id is Site:ModelName
+
+        Args:
+            model: ctbrec model dict
+        """
+        if isinstance(model, Model):
+            return model.id
+        return model_site(model['type']) + ':' + model['name']
+
+    def url_match(self, url1: str, url2: str) -> bool:
+        """ Check if two urls match, either exact match or by top level domain and name
+
+        This makes the assumption that model name is the last string in the url, which seems to be the case at the
+        moment, may not always be true in the future
+        """
+        u1 = url1.strip().rstrip('/')
+        u2 = url2.strip().rstrip('/')
+        if u1 == u2:
+            return True
+        u1k = url_key(u1)
+        return u1k is not None and u1k == url_key(u2)
+
+    def parse_model_type(self, model: Union[str, dict]) -> ModelType:
+        """ Determine model request type from model input """
+        if isinstance(model, MappingABC) and all(k in model for k in ['type', 'name', 'url']):
+            return self.ModelType.model_dict
+        elif isinstance(model, str) and re.match(self.regex['url'], model):
+            return self.ModelType.url
+        elif isinstance(model, str) and re.match(self.regex['site_name'], model):
+            return self.ModelType.site_name
+        raise CtbRecInvalidModelDefinition("Model must be one of [url[str], Site:Name[str], ModelDict[dict]]")
+
+    def sign(self, body: bytes) -> str:
+        """ Get the CTBREC-HMAC signature for a request body
+
+        Args:
+            body: the exact bytes sent to the server
+        """
+        return hmac.new(self.hmac_key, body, hashlib.sha256).hexdigest()
+
+    def set_hmac_key(self, status: int, content: bytes):
+        """ Keep the key requests are signed with, from the response to /secured/hmac. Servers without
+        authentication don't send one. """
+        if status == 200 and len(content) > 0:
+            self.hmac_key = self.codec.loads(content)['hmac'].encode('utf-8')
+        else:
+            self.hmac_key = b''
+
+    def request_retries(self, action: str, body: Optional[bytes]) -> int:
+        """ Number of times a request is retried after a network error, timeout or server error, 0 for requests
+        that change something on the server """
+        return self.retries if body is None or action in self.idempotent_actions else 0
+
+    def retry_delay(self, attempt: int) -> float:
+        """ Seconds to wait before a retry, doubled for each retry with random jitter """
+        return random.uniform(0, self.backoff * 2 ** (attempt - 1))
+
+    def encode_request(self, data: Optional[Union[dict, list]], stats: dict,
+                       start: float) -> tuple[Optional[bytes], dict]:
+        """ Encode and sign the data of a request, recording the time taken and the size in stats
+
+        Args:
+            data: payload to send to server, or None for a GET request
+            stats: the request's metrics, see record_request
+            start: time.perf_counter() when the request was started
+        Returns:
+            the request body, None for a GET request, and the request headers
+        """
+        body = b'' if data is None else self.codec.dumps(data)
+        headers = {'CTBREC-HMAC': self.sign(body)}
+        stats['sign'], stats['sent'] = time.perf_counter() - start, len(body)
+        stats['error'] = 'network'
+        return None if data is None else body, headers
+
+    def decode_response(self, status: int, reason: str, content: bytes, stats: dict) -> Union[dict, list]:
+        """ Decode the response to a request, recording the time taken and any error in stats
+
+        Raises:
+            CtbRecRequestFailed for an HTTP error, an invalid response or a request the server reports as failed
+        """
+        if status != 200:
+            stats['error'] = 'http'
+            raise CtbRecRequestFailed(f'HTTP error: {status} : {reason} : {content.decode("utf-8", "replace")}')
+        stats['error'] = 'parse'
+        parsed = time.perf_counter()
+        result_json = self.codec.loads(content)
+        stats['parse'] = time.perf_counter() - parsed
+        if isinstance(result_json, dict) and result_json['status'] != "success":
+            stats['error'] = 'failed'
+            raise CtbRecRequestFailed(f"Request failed: {result_json['msg']}")
+        stats['error'] = None
+        return result_json
+
+    def record_request(self, action: str, start: float, sign: float = 0.0, parse: float = 0.0, sent: int = 0,
+                       received: int = 0, error: Optional[str] = None, idle: float = 0.0):
+        """ Report a request to the metrics object, if there is one
+
+        Args:
+            action: the /rec action, or the request path for other requests
+            start: time.perf_counter() when the request was started
+            idle: seconds since start that weren't spent on the request, eg. waiting for the caller of a stream
+            see RequestMetrics.observe for the other arguments
+        """
+        if self.metrics is not None:
+            self.metrics.observe(action, time.perf_counter() - start - idle, sign, parse, sent, received, error)
+
+    @staticmethod
+    def request_action(url: str, data: Optional[Union[dict, list]]) -> str:
+        """ Name of a request for metrics, the /rec action or else the path, with ':post' added for POST requests """
+        if isinstance(data, dict) and 'action' in data:
+            return data['action']
+        return url.strip('/') + ('' if data is None else ':post')
+
+
+class CtbRec(CtbRecBase):
+    """
+    Simple Python interface to the awesome ctbrec-server
+    """
+
+    def __init__(self, server_url: str, username: str = None, password: str = None, verify: Union[bool, str] = False,
+                 snapshot: bool = True, models_max_age: float = 10.0, pool_size: int = 10,
+                 recordings_cache_file: Optional[str] = None, recordings_max_age: float = 0.0,
+                 state_max_age: float = 0.0, settings_max_age: float = 0.0, metrics: Optional[RequestMetrics] = None,
+                 timeout: Union[float, tuple[float, float], None] = (5.0, 60.0), retries: int = 3,
+                 backoff: float = 0.5, breaker_threshold: int = 5, breaker_reset: float = 30.0,
+                 codec: str = DEFAULT_CODEC, typed: bool = False):
         """
         Initialise server connection
 
@@ -76,26 +1376,114 @@ class CtbRec:
             username: optional ctbrec server username  Default is None
             password: optional ctbrec server password  Default is None
             verify: Passed through to requests.Session for server ssl certificate handling. Default is False.
+            snapshot: if True then keep a copy of the initial server settings, models and model groups on connection.
+                      If False the copy is only fetched on first access of initial_config, initial_models or
+                      initial_model_groups, or by calling take_snapshot(). Default is True.
+            models_max_age: number of seconds a fetched model list is used for model lookups before it is fetched
+                      again. Models changed through this client are always refetched. Default is 10.
+            pool_size: maximum number of connections kept open to the server. A CtbRec instance can be shared between
+                      threads, set this to at least the number of threads using it. Default is 10.
+            recordings_cache_file: optional json file used to keep the last fetched recording list between runs, so
+                      that other processes can reuse it and get_recordings_delta() reports changes since the last run.
+                      Default is None.
+            recordings_max_age: number of seconds a fetched recording list is reused by get_recordings() before it
+                      is fetched again. Default is 0.
+            state_max_age: number of seconds the server state used by get_summary() and get_model_status() is
+                      reused before it is fetched again. Default is 0.
+            settings_max_age: number of seconds the local copy of the settings is trusted by commit_settings().
+                      An older copy is fetched again before staged changes are written, so that settings changed
+                      elsewhere, eg. in the web interface, aren't overwritten. Default is 0.
+            metrics: optional RequestMetrics, or compatible object, that every request is reported to. Default is
+                      None.
+            timeout: seconds to wait for the server, either one value or a (connect, read) tuple. The read timeout
+                      applies to each read rather than the whole response. None waits forever. Default is (5, 60).
+            retries: number of times a request that only reads from the server is retried after a network error,
+                      timeout or server error. Requests that change something on the server are never retried.
+                      Default is 3.
+            backoff: base delay in seconds between retries, doubled for each retry with random jitter. Default is 0.5.
+            breaker_threshold: number of consecutive requests failing with a network error, timeout or server error
+                      after which requests fail immediately with CtbRecCircuitOpen, 0 to disable. Default is 5.
+            breaker_reset: seconds after which a request is let through again once the breaker is open. Default is
+                      30.
+            codec: name of the JSON_CODECS entry used to encode requests and decode responses. 'compact' sends
+                      requests without spaces and decodes responses straight from bytes, 'orjson' is faster still
+                      if orjson is installed. Default is 'json', which formats requests like earlier versions did.
+            typed: if True then models and recordings are returned as read-only Model and Recording records, which
+                      can be read like dicts and have their ids and keys worked out once. This is a memory option:
+                      records kept around, eg. in the recording cache, use about a quarter of the memory of dicts,
+                      but building them makes fetching the lists slower. Default is False.
+        Raises:
+            CtbRecUnavailable
         """
+        super().__init__(server_url, models_max_age=models_max_age, pool_size=pool_size,
+                         recordings_cache_file=recordings_cache_file, recordings_max_age=recordings_max_age,
+                         state_max_age=state_max_age, settings_max_age=settings_max_age, metrics=metrics,
+                         timeout=timeout, retries=retries, backoff=backoff, breaker_threshold=breaker_threshold,
+                         breaker_reset=breaker_reset, codec=codec, typed=typed)
         # ignore insecure request warnings when tls is being used
         warnings.simplefilter(action='ignore', category=InsecureRequestWarning)
         # initialise connection parameters
-        self.server_url = server_url.strip("/")
         self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
         if username is not None or password is not None:
             self.session.auth = (username, password)
         self.session.verify = verify
+        # requests asks for gzip compressed responses and decompresses them, so servers that support it send less
         self.session.headers.update({'X-Requested-With': 'XMLHttpRequest'})
+        self._model_lock = threading.Lock()
+        self._state_lock = threading.Lock()
+        self._settings_lock = threading.RLock()
         # get hmac key
-        hmac_req = self.session.get(self.server_url+'/secured/hmac')
-        if hmac_req.status_code == 200 and len(hmac_req.text) > 0:
-            self.hmac_key = json.loads(hmac_req.text)['hmac'].encode('utf-8')
-        else:
-            self.hmac_key = b''
-        # keep copy of initial server config
-        self.initial_config = self.get_settings()
-        self.initial_models = self.get_models()
-        self.initial_model_groups = self.get_model_groups()
+        start = time.perf_counter()
+        try:
+            hmac_req = self.transport('hmac', '/secured/hmac')
+        except CtbRecUnavailable as error:
+            self.record_request('hmac', start, error='unavailable' if isinstance(error, CtbRecCircuitOpen)
+                                else 'network')
+            raise
+        self.set_hmac_key(hmac_req.status_code, hmac_req.content)
+        self.record_request('hmac', start, received=self.received_bytes(hmac_req),
+                            error=None if hmac_req.status_code == 200 else 'http')
+        if snapshot:
+            self.take_snapshot()
+
+    @property
+    def initial_config(self) -> list:
+        """ Server settings as they were when the snapshot was taken """
+        if self._initial_config is None:
+            self.get_settings()
+        return self._initial_config
+
+    @property
+    def initial_models(self) -> Mapping[str, dict]:
+        """ Models on the server as they were when the snapshot was taken """
+        if self._initial_models is None:
+            self._initial_models = self.get_models()
+        return self._initial_models
+
+    @property
+    def initial_model_groups(self) -> Mapping[str, dict]:
+        """ Model groups on the server as they were when the snapshot was taken """
+        if self._initial_model_groups is None:
+            self._initial_model_groups = self.get_model_groups()
+        return self._initial_model_groups
+
+    def take_snapshot(self) -> dict:
+        """
+        Take a copy of the current server settings, models and model groups, replacing any earlier snapshot.
+
+        Returns:
+            dict with keys 'config', 'models' and 'model_groups'
+        Raises:
+            CtbRecRequestFailed
+        """
+        self._initial_config = self.get_settings()
+        self._initial_models = self.get_models()
+        self._initial_model_groups = self.get_model_groups()
+        return {'config': self._initial_config, 'models': self._initial_models,
+                'model_groups': self._initial_model_groups}
 
     # ----------------------------------------- model methods ---------------------------------------------------------
     def get_models(self, online: bool = False) -> Mapping[str, dict]:
@@ -109,27 +1497,42 @@ class CtbRec:
         Raises:
             CtbRecRequestFailed
         """
+        # a list requested before a model changed is stale even if it arrives after the change
+        generation = self._model_generation
         ml = self.send_request(url='/rec', data={'action': 'listOnline' if online else 'list'})['models']
-        return {self.model_id(m): m for m in ml}
+        models = self.models_by_id(ml)
+        if not online:
+            self._model_index = ModelIndex(models, generation)
+        return models
 
-    def get_model_status(self) -> Mapping[str, str]:
+    def iter_models(self, online: bool = False) -> Iterator[dict]:
+        """
+        Iterate over the models on the server, parsing them one at a time from the response so that the full list
+        is never held in memory
+
+        Args:
+            online: if True then only retrieve online models else return all models. Default is False.
+        Returns:
+            iterator of model dicts, or Model records if the client is typed
+        Raises:
+            CtbRecRequestFailed
+        """
+        models = self.stream_request(url='/rec', data={'action': 'listOnline' if online else 'list'}, key='models')
+        return map(Model, models) if self.typed else models
+
+    def get_model_status(self, max_age: Optional[float] = None) -> Mapping[str, str]:
         """
         Get status code for all models
 
+        Args:
+            max_age: reuse the last fetched server state if it is no older than this many seconds. Default is
+                     state_max_age.
         Returns: dict with status for each Site:Model. Status can be one of
                     ["recording", "online", "offline", "paused", "later"]
         Raises:
             CtbRecRequestFailed
         """
-        m = self.get_models()
-        o = self.get_models(online=True)
-        r = self.get_recordings()
-        result = dict.fromkeys(m.keys(), 'offline')
-        result.update(dict.fromkeys(o.keys(), 'online'))
-        result.update(dict.fromkeys({self.model_id(i['model']) for i in r if i['status'] == 'RECORDING'}, 'recording'))
-        result.update(dict.fromkeys({k for k, v in m.items() if v['bookmarked']}, 'later'))
-        result.update(dict.fromkeys({k for k, v in m.items() if v['suspended']}, 'paused'))
-        return result
+        return self.get_server_state(max_age).model_status()
 
     def add_model(self, model: Union[str, dict], props: dict = None) -> dict:
         """
@@ -151,20 +1554,12 @@ class CtbRec:
             props = self.parse_model_props(props)
 
         # determine model specification type
-        mt = self.parse_model_type(model)
+        mt, data = self.start_request(model, props)
         if mt == self.ModelType.model_dict:
-            model = self.parse_model_props(model)
-            if props:
-                model.update(props)
-            data = {'action': 'start', 'model': model}
-        elif mt == self.ModelType.site_name:
-            data = {'action': 'startByName', 'model': {"type": None, "name": "", "url": model}}
-        elif mt == self.ModelType.url:
-            data = {'action': 'startByUrl', 'model': {"type": None, "name": "", "url": model}}
-        else:
-            data = {}  # should never reach here because parse_model_type will raise an exception
+            model = data['model']
         # query the server
         self.send_request("/rec", data=data)
+        self.invalidate_model_cache()
         # retrieve model back from server
         m = self.find_model(model)
         # update model dict with optional additional properties
@@ -172,11 +1567,36 @@ class CtbRec:
             m = self.update_model(m, props)
         return m
 
-    def add_models(self, models: list[Union[str, dict]], props: dict = None) -> list:
+    def add_models(self, models: list[Union[str, dict]], props: dict = None, max_workers: int = 8) -> list:
+        """
+        Add a list of models to the server, catching any exceptions
+
+        Args:
+            models: a list of model definitions - one of [url[str], Site:Name[str], ModelDict[dict]]
+            props: optional dict of one or more model definition items that will be applied to all models.
+                        These can include;
+                       'priority' (int), 'bookmarked' (bool), 'suspended' (bool),
+                       'recordUntil' (int|datetime), 'recordUntilSubsequentAction' (str).
+            max_workers: maximum number of concurrent requests to the server. Default is 8.
+        Returns:
+            A list of any models successfully added
         """
-        suspended=False, later=False, stop_action = 'PAUSE',
+        models_added = []
+        for r in self.add_models_batch(models, props, max_workers):
+            if r['result'] == 'added':
+                models_added.append(r['server_model'])
+            elif r['result'] == 'not_found':
+                warnings.warn(f'{r["model"]} added but could not be matched on server')
+            else:
+                warnings.warn(f'Unable to add {r["model"]} to server: {r["reason"]}')
+        return models_added
 
-        Add a list of models to the server, catching any exceptions
+    def add_models_batch(self, models: list[Union[str, dict]], props: dict = None,
+                         max_workers: int = 8) -> list[dict]:
+        """
+        Add a list of models to the server using concurrent requests, then verify them with a single fetch of the
+        model list. Models that need props applied after being added get one more request each and the model list
+        is fetched once more.
 
         Args:
             models: a list of model definitions - one of [url[str], Site:Name[str], ModelDict[dict]]
@@ -184,18 +1604,48 @@ class CtbRec:
                         These can include;
                        'priority' (int), 'bookmarked' (bool), 'suspended' (bool),
                        'recordUntil' (int|datetime), 'recordUntilSubsequentAction' (str).
+            max_workers: maximum number of concurrent requests to the server. Default is 8.
         Returns:
-            A list of any models successfully added
+            list with one result dict per input model, in input order. Each result has keys 'model' (the input
+            model), 'result' (one of 'added', 'not_found', 'failed'), 'reason' (str or None) and 'server_model'
+            (the model dict from the server or None)
+        Raises:
+            CtbRecRequestFailed if the model list can't be fetched from the server
         """
-        models_added = []
-        for m in models:
+        if props:
+            props = self.parse_model_props(dict(props))
+        results = [{'model': m, 'result': 'failed', 'reason': None, 'server_model': None} for m in models]
+
+        def start(r):
             try:
-                models_added.append(self.add_model(m, props))
+                mt, data = self.start_request(r['model'], props)
+                self.send_request('/rec', data=data)
+                return mt, data['model'] if mt == self.ModelType.model_dict else r['model']
             except (CtbRecRequestFailed, CtbRecInvalidModelDefinition) as error:
-                warnings.warn(f'Unable to add {m} to server: {error}')
-            except CtbRecNotFound:
-                warnings.warn(f'{m} added but could not be matched on server')
-        return models_added
+                r['reason'] = str(error)
+                return None
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            started = [(r, s) for r, s in zip(results, pool.map(start, results)) if s is not None]
+        self.invalidate_model_cache()
+        to_update = self.match_added(self.get_model_index(), started, props)
+        if not to_update:
+            return results
+
+        def update(item):
+            r, m = item
+            try:
+                self.send_request('/rec', data={'action': 'start', 'model': m})
+                return m
+            except CtbRecRequestFailed as error:
+                r['reason'] = f'Added but failed to update properties: {error}'
+                return None
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            updated = [(r, m) for (r, _), m in zip(to_update, pool.map(update, to_update)) if m is not None]
+        self.invalidate_model_cache()
+        self.match_updated(self.get_model_index(), updated)
+        return results
 
     def update_model(self, model: Union[str, dict], props: dict) -> dict:
         """ Update properties for an existing model on the server
@@ -214,14 +1664,10 @@ class CtbRec:
         """
         props = self.parse_model_props(props)
         mt = self.parse_model_type(model)
-        m = model if mt == self.ModelType.model_dict else self.find_model(model)
-        invalid_keys = [k for k in props if k not in m]
-        if invalid_keys:
-            warnings.warn(f'Invalid properties {",".join(invalid_keys)} will be ignored.')
-        p = {k: v for k, v in props.items() if k in m}
-        if m and p:
-            m.update(p)
+        m = self.updated_model(model if mt == self.ModelType.model_dict else self.find_model(model), props)
+        if m is not None:
             self.send_request("/rec", data={"action": "start", "model": m})
+            self.invalidate_model_cache()
             return self.find_model(m)
         warnings.warn("Failed to update model properties")
         return dict()
@@ -237,27 +1683,128 @@ class CtbRec:
             CtbRecRequestFailed
         """
         self.send_request(url='/rec', data={"action": "stop", "model":  self.find_model(model)})
+        self.invalidate_model_cache()
 
-    def remove_models(self, models: list[Union[str, dict]]) -> list[Union[str, dict]]:
+    def remove_models(self, models: list[Union[str, dict]], max_workers: int = 8) -> list[Union[str, dict]]:
         """ Delete a list of models from the server, catching any exceptions
 
         Args:
             models: list of models where elements must be one of [url[str], Site:Name[str], ModelDict[dict]]
+            max_workers: maximum number of concurrent requests to the server. Default is 8.
         Returns:
             a list of any input models that failed to be removed
         """
         failed = []
-        for m in models:
-            try:
-                self.remove_model(m)
-            except (CtbRecRequestFailed, CtbRecInvalidModelDefinition, CtbRecNotFound) as error:
-                failed.append(m)
-                warnings.warn(f'Unable to remove {m} from server: {error}')
+        for r in self.remove_models_batch(models, max_workers):
+            if r['result'] != 'removed':
+                failed.append(r['model'])
+                warnings.warn(f'Unable to remove {r["model"]} from server: {r["reason"]}')
         return failed
 
+    def remove_models_batch(self, models: list[Union[str, dict]], max_workers: int = 8) -> list[dict]:
+        """ Delete a list of models from the server using concurrent requests, then verify the removals with a
+        single fetch of the model list
+
+        Args:
+            models: list of models where elements must be one of [url[str], Site:Name[str], ModelDict[dict]]
+            max_workers: maximum number of concurrent requests to the server. Default is 8.
+        Returns:
+            list with one result dict per input model, in input order. Each result has keys 'model' (the input
+            model), 'result' (one of 'removed', 'not_found', 'failed'), 'reason' (str or None) and 'server_model'
+            (the model dict that was removed or None)
+        Raises:
+            CtbRecRequestFailed if the model list can't be fetched from the server
+        """
+        results = self.match_removals(self.get_model_index(), models)
+
+        def stop(r):
+            try:
+                self.send_request(url='/rec', data={"action": "stop", "model": r['server_model']})
+                return r
+            except CtbRecRequestFailed as error:
+                r['reason'] = str(error)
+                return None
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            stopped = [r for r in pool.map(stop, [r for r in results if r['server_model'] is not None]) if r]
+        self.invalidate_model_cache()
+        if stopped:
+            self.check_removed(self.get_model_index(), stopped)
+        return results
+
+    def plan_models(self, desired: list[Union[str, dict]], remove_missing: bool = False) -> list[dict]:
+        """ Work out the changes needed to make the model list on the server match a desired state, from a single
+        fetch of the model list. Models are matched the same way as by find_model.
+
+        Args:
+            desired: list of models, where elements are one of [url[str], Site:Name[str], ModelDict[dict]], or a dict
+                     with the model under the 'model' key along with any of the properties in CtbRec.model_props,
+                     eg. {'model': 'Chaturbate:name', 'priority': 60, 'recordUntil': datetime(2030, 1, 1)}
+            remove_missing: if True then models on the server that aren't in `desired` are removed. Default is False.
+        Returns:
+            list with one plan entry per desired model, in input order, followed by any models to remove. Each entry
+            has keys 'model' (the input model), 'props' (the desired properties), 'action' (one of 'add', 'update',
+            'remove', 'unchanged', 'duplicate' or 'invalid'), 'server_model' (the matching model dict on the
+            server or None), 'changes' (dict of property name to (current, desired) value) and 'reason'
+        Raises:
+            CtbRecRequestFailed if the model list can't be fetched from the server
+        """
+        self.invalidate_model_cache()
+        return self.plan_from_index(self.get_model_index(), desired, remove_missing)
+
+    def apply_model_plan(self, plan: list[dict], max_workers: int = 8) -> list[dict]:
+        """ Apply a plan from plan_models using concurrent requests, then verify it with a single fetch of the model
+        list. Models added by url or Site:Name with properties have their properties set after that fetch, as
+        their full model dict isn't known until then.
+
+        Args:
+            plan: list of plan entries, as returned by plan_models
+            max_workers: maximum number of concurrent requests to the server. Default is 8.
+        Returns:
+            list with one result dict per plan entry that needed a change, in plan order. Each result is the plan
+            entry with 'result' (one of 'ok', 'not_found', 'failed') and 'reason' updated, and 'server_model' set to
+            the model dict on the server after the change, or None if it was removed
+        Raises:
+            CtbRecRequestFailed if the model list can't be fetched from the server
+        """
+        results = [dict(e, result='failed') for e in plan if e['action'] in ('add', 'update', 'remove')]
+
+        def send(r):
+            # returns the model input type and model to look for on the server afterwards
+            try:
+                mt, model, data = self.plan_request(r)
+                self.send_request('/rec', data=data)
+                return mt, model
+            except (CtbRecRequestFailed, CtbRecInvalidModelDefinition) as error:
+                r['reason'] = str(error)
+                return None
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            sent = [(r, s) for r, s in zip(results, pool.map(send, results)) if s is not None]
+        self.invalidate_model_cache()
+        if not sent:
+            return results
+        to_update = self.check_plan(self.get_model_index(), sent)
+
+        def update(item):
+            r, m = item
+            try:
+                self.send_request('/rec', data={'action': 'start', 'model': m})
+                r.update(result='ok', server_model=m)
+            except CtbRecRequestFailed as error:
+                r['reason'] = f'Added but failed to update properties: {error}'
+
+        if to_update:
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                list(pool.map(update, to_update))
+            self.invalidate_model_cache()
+        return results
+
     def find_model(self, model: Union[str, dict]) -> dict:
         """ get an existing model on the server by matching model input
 
+        The model list is only fetched from the server if the cached copy is older than models_max_age.
+
         Args:
             model: string|dict - a ctbrec model definition
         Returns:
@@ -267,20 +1814,28 @@ class CtbRec:
             CtbRecNotFound
             CtbRecRequestFailed
         """
-        models = self.get_models()
         mt = self.parse_model_type(model)
-        if mt == self.ModelType.model_dict:
-            match = [m for m in models.values() if m['type'] == model['type'] and m['name'] == model['name']]
-        elif mt == self.ModelType.url:
-            match = [m for m in models.values() if self.url_match(m['url'], model)]
-        elif mt == self.ModelType.site_name and model in models:
-            match = [models[model]]
-        else:
-            match = []
-        if match:
-            return match[0]
+        match = self.match_model(self.get_model_index(), model, mt)
+        if match is not None:
+            return match if isinstance(match, Record) else dict(match)
         raise CtbRecNotFound("Requested model could not be found on server.")
 
+    def get_model_index(self) -> ModelIndex:
+        """ Get the model lookup index, fetching the model list from the server if the index is stale
+
+        Raises:
+            CtbRecRequestFailed
+        """
+        index = self._model_index
+        if self.stale_model_index(index):
+            # only one thread refreshes a stale index, the others wait for and then use its result
+            with self._model_lock:
+                index = self._model_index
+                if self.stale_model_index(index):
+                    self.get_models()
+                    index = self._model_index
+        return index
+
     # ----------------------------------------- model group methods ----------------------------------------------------
     def get_model_groups(self) -> Mapping[str, dict]:
         """
@@ -322,7 +1877,8 @@ class CtbRec:
 
     def add_models_to_group(self, group: Union[dict, str], model_list: list[Union[dict, str]]) -> dict:
         """
-        Add models to an existing model group.
+        Add models to an existing model group. Models already in the group, compared by model_url_key, are not added
+        again, and the group isn't saved if there is nothing to add.
 
         Args:
             group: either a group name or a group dict, specifying an existing model group that is to be updated.
@@ -335,14 +1891,16 @@ class CtbRec:
         """
         if isinstance(group, str):
             group = self.find_model_group(group)
-        ml = {m if isinstance(m, str) else m['url'] for m in model_list}
-        group['modelUrls'].extend(list(ml))
-        self.save_model_group(group)
-        return self.get_model_groups()[group['name']]
+        updated = self.group_with_models(group, model_list)
+        if updated is None:
+            return group
+        self.save_model_group(updated)
+        return self.get_model_groups()[updated['name']]
 
     def remove_models_from_group(self, group: Union[dict, str], model_list: list[Union[dict, str]]):
         """
-        Remove models from an existing model group.
+        Remove models from an existing model group, comparing urls by model_url_key. The group isn't saved if none of
+        the models are in it.
 
         Args:
             group: either a group name or a group dict, specifying an existing model group that is to be updated.
@@ -355,10 +1913,11 @@ class CtbRec:
         """
         if isinstance(group, str):
             group = self.find_model_group(group)
-        ml = {m if isinstance(m, str) else m['url'] for m in model_list}
-        group['modelUrls'] = [m for m in group['modelUrls'] if m not in ml]
-        self.save_model_group(group)
-        return self.get_model_groups()[group['name']]
+        updated = self.group_without_models(group, model_list)
+        if updated is None:
+            return group
+        self.save_model_group(updated)
+        return self.get_model_groups()[updated['name']]
 
     def create_model_group(self, name: str, model_list: list) -> dict:
         """
@@ -377,8 +1936,7 @@ class CtbRec:
         groups = self.get_model_groups()
         if name in groups:
             raise CtbRecAlreadyExists(f'Model group {name} already exists')
-        ml = {m if isinstance(m, str) else m['url'] for m in model_list}  # use set to reduce to unique urls
-        self.save_model_group({"name": name, 'modelUrls': list(ml), 'id': uuid.uuid4().__str__()})
+        self.save_model_group(self.new_model_group(name, model_list))
         return self.get_model_groups()[name]
 
     def find_model_group(self, name: str) -> dict:
@@ -397,18 +1955,101 @@ class CtbRec:
         if name in groups:
             return groups[name]
         raise CtbRecNotFound(f'Model group {name} could not be found on the server')
+
+    def sync_model_groups(self, desired: Mapping[str, list[Union[dict, str]]], delete_missing: bool = False,
+                          dry_run: bool = False, max_workers: int = 8) -> list[dict]:
+        """
+        Make the model groups on the server match a desired state. The groups are fetched once, model urls are
+        compared by model_url_key, and only groups that need to change are written, using concurrent requests.
+        Urls already in a group keep their original form and order, and duplicate urls are removed.
+
+        Args:
+            desired: dict keyed by group name of the models each group should contain, where list items can be either
+                     an url string, or a model dict
+            delete_missing: if True then groups on the server that aren't in `desired` are deleted. Default is False.
+            dry_run: if True then work out the changes without writing anything. Default is False.
+            max_workers: maximum number of concurrent requests to the server. Default is 8.
+        Returns:
+            list with one report dict per desired group, in input order, followed by any deleted groups. Each report
+            has keys 'name', 'action' (one of 'created', 'updated', 'deleted', 'unchanged'), 'added' and 'removed'
+            (lists of urls), 'group' (the group dict as written), 'result' (one of 'ok', 'failed', 'dry_run') and
+            'reason' (str or None)
+        Raises:
+            CtbRecRequestFailed if the model groups can't be fetched from the server
+        """
+        report = self.group_report(self.get_model_groups(), desired, delete_missing, dry_run)
+        if dry_run:
+            return report
+
+        def write(r):
+            try:
+                if r['action'] == 'deleted':
+                    self.delete_model_group(r['group'])
+                else:
+                    self.save_model_group(r['group'])
+            except CtbRecRequestFailed as error:
+                r['result'] = 'failed'
+                r['reason'] = str(error)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            list(pool.map(write, [r for r in report if r['action'] != 'unchanged']))
+        return report
     
     # --------------------------------------- recording methods -------------------------------------------------------
-    def get_recordings(self) -> list[dict]:
+    def get_recordings(self, max_age: Optional[float] = None) -> list[dict]:
         """
         Get a list of all recordings from the server
 
+        Args:
+            max_age: reuse the last fetched list if it is no older than this many seconds. Default is
+                     recordings_max_age.
+        Returns:
+            list of recording dicts, copies of the cached ones so they can be changed without changing the cache
+        Raises:
+            CtbRecRequestFailed
+        """
+        max_age = self.recordings_max_age if max_age is None else max_age
+        cache = self.recording_cache
+        if cache.age() > max_age:
+            with cache.lock:
+                if cache.age() > max_age:
+                    recordings = self.send_request(url='/rec', data={'action': 'recordings'})['recordings']
+                    cache.update(self.recording_records(recordings))
+        return cache.copy(cache.recordings.values())
+
+    def iter_recordings(self) -> Iterator[dict]:
+        """
+        Iterate over the recordings on the server, parsing them one at a time from the response so that the full
+        list is never held in memory. The recording cache is neither used nor updated.
+
+        Returns:
+            iterator of recording dicts, or Recording records if the client is typed
+        Raises:
+            CtbRecRequestFailed
+        """
+        recordings = self.stream_request(url='/rec', data={'action': 'recordings'}, key='recordings')
+        if not self.typed:
+            return recordings
+        models = {}
+        return (Recording(r, models) for r in recordings)
+
+    def get_recordings_delta(self, max_age: Optional[float] = None) -> dict:
+        """
+        Get the changes to the recording list between the last two fetches. With a recordings_cache_file these are
+        the changes since the list was last fetched by any client using the file.
+
+        Args:
+            max_age: reuse the last fetch if it is no older than this many seconds. Default is recordings_max_age.
         Returns:
-            list of recording dicts
+            dict with keys 'added', 'removed', 'changed' and 'status_changed', see diff_recordings
         Raises:
             CtbRecRequestFailed
         """
-        return self.send_request(url='/rec', data={'action': 'recordings'})['recordings']
+        max_age = self.recordings_max_age if max_age is None else max_age
+        if self.recording_cache.delta is None:
+            max_age = -1
+        self.get_recordings(max_age)
+        return {k: self.recording_cache.copy(v) for k, v in self.recording_cache.delta.items()}
 
     def delete_recording(self, recording: dict):
         """
@@ -418,6 +2059,7 @@ class CtbRec:
             CtbRecRequestFailed
         """
         self.send_request(url='/rec', data={'action': 'delete', 'recording': recording})
+        self.recording_cache.discard(recording)
 
     def pin_recording(self, recording: dict):
         """
@@ -427,6 +2069,7 @@ class CtbRec:
             CtbRecRequestFailed
         """
         self.send_request(url='/rec', data={'action': 'pin', 'recording': recording})
+        self.recording_cache.invalidate()
 
     def unpin_recording(self, recording: dict):
         """
@@ -436,6 +2079,7 @@ class CtbRec:
             CtbRecRequestFailed
         """
         self.send_request(url='/rec', data={'action': 'unpin', 'recording': recording})
+        self.recording_cache.invalidate()
 
     def annotate_recording(self, recording: dict, note: str):
         """
@@ -444,8 +2088,12 @@ class CtbRec:
         Raises:
             CtbRecRequestFailed
         """
-        recording['note'] = note
+        if isinstance(recording, Record):
+            recording = dict(recording, note=note)
+        else:
+            recording['note'] = note
         self.send_request(url='/rec', data={'action': 'setNote', 'recording': recording})
+        self.recording_cache.invalidate()
 
     def rerun_post_process(self, recording: dict):
         """
@@ -455,40 +2103,130 @@ class CtbRec:
             CtbRecRequestFailed
         """
         self.send_request(url='/rec', data={'action': 'rerunPostProcessing', 'recording': recording})
+        self.recording_cache.invalidate()
 
     # --------------------------------------- general server methods ---------------------------------------------------
     def get_settings(self) -> list:
-        """ Get current server settings
+        """ Get current server settings, and refresh the local copy used by update_settings
 
         Returns:
             list of current server settings
         Raises:
             CtbRecRequestFailed
         """
-        return self.send_request(url='/config')
+        settings = self.send_request(url='/config')
+        with self._settings_lock:
+            self.settings_fetched(settings)
+        return settings
+
+    def cached_settings(self) -> list:
+        """ Get the local copy of the server settings, only fetching them if there is no local copy yet
+
+        Returns:
+            list of server settings, including any changes written by this client
+        Raises:
+            CtbRecRequestFailed
+        """
+        with self._settings_lock:
+            if self._settings is None:
+                self.get_settings()
+            return copy.deepcopy(list(self._settings.values()))
 
     def update_settings(self, settings: Union[dict, list]) -> list:
         """ Update server config settings
 
         Args:
             settings: either a dict of key-value pairs where keys must be valid ctbrec setting keys and values must
-                   conform to expected type, or a list of ctbrec settings.
+                   conform to expected type, or a list of ctbrec settings. A dict is merged with any changes staged
+                   by stage_settings() and only written if something changed.
         Returns:
             list of server settings after updates have been applied
         Raises:
+            CtbRecInvalidSetting
             CtbRecRequestFailed
         """
         if isinstance(settings, dict):
-            data = {s['key']: s for s in self.get_settings()}
-            for k in settings:
-                if k not in data.keys():
-                    warnings.warn(f'{k} is not a valid settings key and will be ignored')
-                data[k]['value'] = settings[k]
-            data = list(data.values())
-        else:
-            data = settings
-        self.send_request(url='/config', data=data)
-        return self.get_settings()
+            with self._settings_lock:
+                version = self.settings_version
+                self.stage_settings(settings)
+                # settings stage_settings() has just fetched aren't fetched again
+                return self.commit_settings(None if version == self.settings_version else float('inf'))
+        # without a snapshot, keep the settings as they were before this client first changed them
+        if self._initial_config is None:
+            self.get_settings()
+        self.send_request(url='/config', data=settings)
+        with self._settings_lock:
+            self.settings_written(settings)
+        return copy.deepcopy(settings)
+
+    def stage_settings(self, settings: dict):
+        """ Validate setting changes against the local copy of the server settings and keep them for the next
+        commit_settings(). Unknown keys are ignored with a warning.
+
+        Args:
+            settings: dict of key-value pairs
+        Raises:
+            CtbRecInvalidSetting if a value doesn't match the type of its setting, in which case nothing is staged
+            CtbRecRequestFailed
+        """
+        with self._settings_lock:
+            if self._settings is None:
+                self.get_settings()
+            self.stage_checked(settings)
+
+    def commit_settings(self, max_age: Optional[float] = None) -> list:
+        """ Write all staged setting changes to the server in one request, or nothing if no setting has changed.
+
+        Unless the local copy of the settings is recent enough, the settings are fetched again first and the staged
+        changes are applied to the fresh copy, so that only the staged settings are changed on the server. Staged
+        values the server already has are dropped.
+
+        Args:
+            max_age: use the local copy of the settings if it is no older than this many seconds. Default is
+                     settings_max_age.
+        Returns:
+            list of server settings after updates have been applied
+        Raises:
+            CtbRecRequestFailed
+        """
+        with self._settings_lock:
+            if self.stale_settings(max_age):
+                self.get_settings()
+            data = self.settings_to_commit()
+            if data is None:
+                return copy.deepcopy(list(self._settings.values()))
+            self.send_request(url='/config', data=data)
+            return self.settings_committed()
+
+    def discard_settings(self):
+        """ Drop any setting changes staged by stage_settings() """
+        with self._settings_lock:
+            self._pending_settings.clear()
+
+    def snapshot_settings(self) -> list:
+        """ Get a copy of the local settings that can later be passed to restore_settings()
+
+        Raises:
+            CtbRecRequestFailed
+        """
+        return self.cached_settings()
+
+    def restore_settings(self, snapshot: list = None) -> list:
+        """ Restore server settings from a snapshot, writing only the settings that differ from the server
+
+        Args:
+            snapshot: list of settings from snapshot_settings() or get_settings(). Default is initial_config.
+        Returns:
+            list of server settings after the snapshot has been applied
+        Raises:
+            CtbRecRequestFailed
+        """
+        with self._settings_lock:
+            version = self.settings_version
+            snapshot = self.initial_config if snapshot is None else snapshot
+            self.discard_settings()
+            self.stage_settings({s['key']: s['value'] for s in snapshot})
+            return self.commit_settings(None if version == self.settings_version else float('inf'))
 
     def get_space(self) -> dict:
         """ Get drive space statistics from server
@@ -500,27 +2238,45 @@ class CtbRec:
         """
         return self.send_request(url='/rec', data={'action': 'space'})
 
-    def get_summary(self) -> dict:
+    def get_summary(self, max_age: Optional[float] = None) -> dict:
         """ Get summary of server activity
 
+        Args:
+            max_age: reuse the last fetched server state if it is no older than this many seconds. Default is
+                     state_max_age.
         Returns:
             dict of drive space statistics
         Raises:
             CtbRecRequestFailed
         """
-        models = self.get_models()
-        paused = len([m for m in models.values() if m['suspended']])
-        later = len([m for m in models.values() if m['bookmarked']])
-        online = len(self.get_models(online=True))
-        recordings = self.get_recordings()
-        recording = len([r for r in recordings if r['status'] == 'RECORDING'])
-        post_process = len([r for r in recordings if r['status'] == 'POST_PROCESSING'])
-        space = self.get_space()
-        return {"total_models": len(models), "models_recording": recording, "models_online": online,
-                "models_paused": paused, "models_bookmarked": later, "total_recordings": len(recordings),
-                "post_processing": post_process,
-                "space_used": f"{round((space['spaceTotal']-space['spaceFree'])/1e9,3)} GB",
-                "space_free": f"{round(space['spaceFree']/1e9,3)} GB"}
+        return self.get_server_state(max_age).summary()
+
+    def get_server_state(self, max_age: Optional[float] = None) -> ServerState:
+        """ Get the models, online models, recordings and drive space, fetched concurrently
+
+        Args:
+            max_age: reuse the last fetched server state if it is no older than this many seconds. Default is
+                     state_max_age.
+        Returns:
+            ServerState from which the summary and model status are derived
+        Raises:
+            CtbRecRequestFailed
+        """
+        max_age = self.state_max_age if max_age is None else max_age
+        state = self._server_state
+        if state is None or state.age() > max_age:
+            with self._state_lock:
+                state = self._server_state
+                if state is None or state.age() > max_age:
+                    with ThreadPoolExecutor(max_workers=4) as pool:
+                        models = pool.submit(self.get_models)
+                        online = pool.submit(self.get_models, online=True)
+                        recordings = pool.submit(self.get_recordings)
+                        space = pool.submit(self.get_space)
+                        state = ServerState(models.result(), online.result(), recordings.result(), space.result(),
+                                            self.model_id)
+                    self._server_state = state
+        return state
 
     def pause_recording(self):
         """ Suspend all recoding on the server
@@ -539,91 +2295,713 @@ class CtbRec:
         self.send_request(url='/rec', data={'action': 'resumeRecorder'})
 
 
-    # ------------------------------------------- internal methods -----------------------------------------------------
-    def type_to_site(self, model_type: str) -> str:
-        """
-        Get ctbrec site code from ctbrec site class name
+    def transport(self, action: str, url: str, body: Optional[bytes] = None, headers: Optional[dict] = None,
+                  stream: bool = False) -> requests.Response:
+        """ Send a request through the circuit breaker, retrying it with backoff if it is idempotent
 
         Args:
-            model_type: str containing ctbrec model type code
+            action: the /rec action, or the request path for other requests
+            url: relative url for the request, eg. '/rec'
+            body: request body to POST, or None to send a GET request
+            headers: optional request headers
+            stream: passed through to requests
+        Return:
+            the response, which may have any status below 500
+        Raises:
+            CtbRecUnavailable, CtbRecCircuitOpen
         """
-        return re.findall(self.regex['model_type'], model_type)[0]
+        retries = self.request_retries(action, body)
+        for attempt in range(retries + 1):
+            if not self.breaker.allow():
+                raise CtbRecCircuitOpen(f'Server unavailable, not sending {action} request')
+            if attempt:
+                time.sleep(self.retry_delay(attempt))
+            try:
+                if body is None:
+                    result = self.session.get(self.server_url + url, headers=headers, timeout=self.timeout,
+                                              stream=stream)
+                else:
+                    result = self.session.post(self.server_url + url, data=body, headers=headers,
+                                               timeout=self.timeout, stream=stream)
+            except requests.RequestException as error:
+                self.breaker.failure()
+                if attempt == retries:
+                    raise CtbRecUnavailable(f'Server unavailable: {error}') from error
+                continue
+            if result.status_code < 500:
+                self.breaker.success()
+                return result
+            self.breaker.failure()
+            result.close()
+            if attempt == retries:
+                raise CtbRecUnavailable(f'HTTP error: {result.status_code} : {result.reason}')
+
+    @staticmethod
+    def received_bytes(response: requests.Response) -> int:
+        """ Number of response body bytes received, before decompression if the response was compressed """
+        try:
+            return response.raw.tell() or len(response.content)
+        except (AttributeError, OSError):
+            return len(response.content)
+
+    def stream_request(self, url: str, data: dict, key: str) -> Iterator:
+        """ Send a request to the ctbrec server and iterate over the elements of one array in the result as they are
+        received
 
-    def parse_model_props(self, props: dict) -> dict:
+        Args:
+            url: string - relative url for the request, eg. '/rec'
+            data: dict - payload to send to server
+            key: string - name of the array in the result to iterate over
+        Return:
+            iterator of the array elements
+        Raises:
+            CtbRecRequestFailed, or its subclass CtbRecUnavailable if the server can't be reached
         """
-        Process model properties. At the moment this only adjusts 'recordUntil' if it is specified as a datetime or
-        in hours.
+        stats = {'sign': 0.0, 'parse': 0.0, 'sent': 0, 'received': 0, 'error': 'encode', 'idle': 0.0}
+        wait = [0.0]
+        start = time.perf_counter()
+
+        def chunks(response):
+            # time spent waiting for the network isn't parse time
+            content = response.iter_content(chunk_size=65536)
+            while True:
+                before = time.perf_counter()
+                stats['error'] = 'network'
+                try:
+                    chunk = next(content, None)
+                except requests.RequestException as error:
+                    raise CtbRecUnavailable(f'Server unavailable: {error}') from error
+                stats['error'] = 'parse'
+                wait[0] += time.perf_counter() - before
+                if chunk is None:
+                    return
+                # count the bytes received rather than decompressed, if the response was compressed
+                stats['received'] = getattr(response.raw, 'tell', lambda: 0)() or stats['received'] + len(chunk)
+                yield chunk
+
+        try:
+            body, headers = self.encode_request(data, stats, start)
+            result = self.transport(self.request_action(url, data), url, body, headers, stream=True)
+            with result:
+                if result.status_code != 200:
+                    stats['error'] = 'http'
+                    raise CtbRecRequestFailed(f'HTTP error: {result.status_code} : {result.reason} : {result.text}')
+                stream = JsonArrayStream(chunks(result), key)
+                items = iter(stream)
+                while True:
+                    before, waited = time.perf_counter(), wait[0]
+                    try:
+                        item = next(items)
+                    except StopIteration:
+                        break
+                    except ValueError as error:
+                        raise CtbRecRequestFailed(f'Invalid response: {error}')
+                    paused = time.perf_counter()
+                    stats['parse'] += paused - before - (wait[0] - waited)
+                    yield item
+                    stats['idle'] += time.perf_counter() - paused
+                if stream.envelope.get('status') != 'success':
+                    stats['error'] = 'failed'
+                    raise CtbRecRequestFailed(f"Request failed: {stream.envelope.get('msg')}")
+                if not stream.found:
+                    raise CtbRecRequestFailed(f'Invalid response: no {key} in result')
+                stats['error'] = None
+        except CtbRecCircuitOpen:
+            stats['error'] = 'unavailable'
+            raise
+        except GeneratorExit:
+            # the caller stopped iterating early
+            stats['error'] = None
+            raise
+        finally:
+            self.record_request(self.request_action(url, data), start, **stats)
+
+    def send_request(self, url: str, data: Optional[Union[dict, list]] = None) -> Union[dict, list]:
+        """ Send a request to the ctbrec server
+
+        The request signature is passed with the request rather than stored in the session, so this can be called
+        concurrently from several threads.
 
         Args:
-            props: dict containing model properties
-        Returns:
-            model dict after converting recordUntil to a timestamp
+            url: string - relative url for the request, eg. '/rec'
+            data: dict - payload to send to server. If None then GET will be used rather than POST
+        Return:
+            server result data structure
+        Raises:
+            CtbRecRequestFailed, or its subclass CtbRecUnavailable if the server can't be reached
         """
-        p = props
-        if p and 'recordUntil' in p:
-            record_until = p['recordUntil']
-            if isinstance(record_until, datetime):
-                p['recordUntil'] = round(record_until.timestamp()*1000)
-            elif isinstance(record_until, int) and record_until < 10000:   # assume it is specified in hours
-                p['recordUntil'] = round(datetime.now().timestamp()*1000 + record_until*3600000)
-        return p
+        stats = {'sign': 0.0, 'parse': 0.0, 'sent': 0, 'received': 0, 'error': 'encode'}
+        start = time.perf_counter()
+        try:
+            body, headers = self.encode_request(data, stats, start)
+            result = self.transport(self.request_action(url, data), url, body, headers)
+            stats['received'] = self.received_bytes(result)
+            return self.decode_response(result.status_code, result.reason, result.content, stats)
+        except CtbRecCircuitOpen:
+            stats['error'] = 'unavailable'
+            raise
+        finally:
+            self.record_request(self.request_action(url, data), start, **stats)
+
+
+
+class AsyncCtbRec(CtbRecBase):
+    """
+    asyncio client for the ctbrec server, with the methods of CtbRec as coroutines
 
-    def model_id(self, model: dict) -> str:
+    Requests are sent with aiohttp over a pool of keep-alive connections, and are signed, encoded, retried through the
+    circuit breaker and reported to the metrics object by the same code as CtbRec's. Requests that don't depend on
+    each other are sent concurrently, eg. the four requests of get_server_state(), and coroutines sharing a client
+    share its caches. Streaming, (iter_models() and iter_recordings()), is only available from CtbRec.
+
+    aiohttp is only needed by this class, install it with `pip install aiohttp`. Create clients with
+    `await AsyncCtbRec.connect(...)`, and close them with close() or by using them in `async with`.
+    """
+
+    def __init__(self, server_url: str, username: str = None, password: str = None, verify: Union[bool, str] = False,
+                 **kwargs):
         """
-        Get model id from model dict. Id is Site:ModelName
+        Set up a client without sending any request, use connect() to create a client ready to use. Must be called
+        from a running event loop.
 
         Args:
-            model: ctbrec model dict
+            see CtbRec, except snapshot which is an argument of connect()
+        Raises:
+            ImportError if aiohttp isn't installed
         """
-        return re.findall(self.regex['model_type'], model['type'])[0] + ':' + model['name']
-
-    def url_match(self, url1: str, url2: str) -> bool:
-        """ Check if two urls match, either exact match or by top level domain and name
+        # imported here so that scripts using CtbRec don't spend time importing aiohttp
+        try:
+            import aiohttp
+        except ImportError as error:
+            raise ImportError('AsyncCtbRec needs aiohttp, install it with pip install aiohttp') from error
+        super().__init__(server_url, **kwargs)
+        if verify is True:
+            ssl_context = None
+        elif verify:
+            ssl_context = ssl.create_default_context(cafile=verify)
+        else:
+            ssl_context = False
+        connect, read = self.timeout if isinstance(self.timeout, tuple) else (self.timeout, self.timeout)
+        # aiohttp asks for gzip compressed responses and decompresses them, like requests
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.pool_size, ssl=ssl_context),
+            auth=None if username is None and password is None else aiohttp.BasicAuth(username or '', password or ''),
+            headers={'X-Requested-With': 'XMLHttpRequest'},
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=connect, sock_read=read))
+        self.client_errors = (aiohttp.ClientError, asyncio.TimeoutError)
+        self._model_lock = asyncio.Lock()
+        self._state_lock = asyncio.Lock()
+        self._recordings_lock = asyncio.Lock()
+        self._settings_lock = asyncio.Lock()
+
+    @classmethod
+    async def connect(cls, server_url: str, username: str = None, password: str = None,
+                      verify: Union[bool, str] = False, snapshot: bool = True, **kwargs) -> 'AsyncCtbRec':
+        """
+        Initialise server connection. Arguments are the same as for CtbRec.
 
-        This makes the assumption that model name is the last string in the url, which seems to be the case at the
-        moment, may not always be true in the future
+        Raises:
+            CtbRecUnavailable
+            ImportError if aiohttp isn't installed
         """
-        u1 = url1.strip().rstrip('/')
-        u2 = url2.strip().rstrip('/')
-        if u1 == u2:
-            return True
-        u1g = re.findall(self.regex['domain_name'], u1)[0]
-        u2g = re.findall(self.regex['domain_name'], u2)[0]
-        return u1g[1] == u2g[1] and u1g[3] == u2g[3]
+        client = cls(server_url, username, password, verify, **kwargs)
+        try:
+            start = time.perf_counter()
+            try:
+                status, _, content, received = await client.transport('hmac', '/secured/hmac')
+            except CtbRecUnavailable as error:
+                client.record_request('hmac', start, error='unavailable' if isinstance(error, CtbRecCircuitOpen)
+                                      else 'network')
+                raise
+            client.set_hmac_key(status, content)
+            client.record_request('hmac', start, received=received, error=None if status == 200 else 'http')
+            if snapshot:
+                await client.take_snapshot()
+        except BaseException:
+            await client.close()
+            raise
+        return client
+
+    async def close(self):
+        """ Close the connections to the server """
+        await self.session.close()
+
+    async def __aenter__(self) -> 'AsyncCtbRec':
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def take_snapshot(self) -> dict:
+        """ See CtbRec.take_snapshot """
+        self._initial_config, self._initial_models, self._initial_model_groups = await asyncio.gather(
+            self.get_settings(), self.get_models(), self.get_model_groups())
+        return {'config': self._initial_config, 'models': self._initial_models,
+                'model_groups': self._initial_model_groups}
 
-    def parse_model_type(self, model: Union[str, dict]) -> ModelType:
-        """ Determine model request type from model input """
-        if isinstance(model, dict) and all(k in model for k in ['type', 'name', 'url']):
-            return self.ModelType.model_dict
-        elif isinstance(model, str) and re.match(self.regex['url'], model):
-            return self.ModelType.url
-        elif isinstance(model, str) and re.match(self.regex['site_name'], model):
-            return self.ModelType.site_name
-        raise CtbRecInvalidModelDefinition("Model must be one of [url[str], Site:Name[str], ModelDict[dict]]")
+    # ----------------------------------------- model methods ---------------------------------------------------------
+    async def get_models(self, online: bool = False) -> Mapping[str, dict]:
+        """ See CtbRec.get_models """
+        generation = self._model_generation
+        ml = (await self.send_request(url='/rec', data={'action': 'listOnline' if online else 'list'}))['models']
+        models = self.models_by_id(ml)
+        if not online:
+            self._model_index = ModelIndex(models, generation)
+        return models
+
+    async def get_model_status(self, max_age: Optional[float] = None) -> Mapping[str, str]:
+        """ See CtbRec.get_model_status """
+        return (await self.get_server_state(max_age)).model_status()
+
+    async def add_model(self, model: Union[str, dict], props: dict = None) -> dict:
+        """ See CtbRec.add_model """
+        if props:
+            props = self.parse_model_props(props)
+        mt, data = self.start_request(model, props)
+        if mt == self.ModelType.model_dict:
+            model = data['model']
+        await self.send_request("/rec", data=data)
+        self.invalidate_model_cache()
+        m = await self.find_model(model)
+        if props and mt != self.ModelType.model_dict:
+            m = await self.update_model(m, props)
+        return m
 
-    def send_request(self, url: str, data: Optional[Union[dict, list]] = None) -> Union[dict, list]:
-        """ Send a request to the ctbrec server
+    async def add_models(self, models: list[Union[str, dict]], props: dict = None, max_workers: int = 8) -> list:
+        """ See CtbRec.add_models """
+        models_added = []
+        for r in await self.add_models_batch(models, props, max_workers):
+            if r['result'] == 'added':
+                models_added.append(r['server_model'])
+            elif r['result'] == 'not_found':
+                warnings.warn(f'{r["model"]} added but could not be matched on server')
+            else:
+                warnings.warn(f'Unable to add {r["model"]} to server: {r["reason"]}')
+        return models_added
+
+    async def add_models_batch(self, models: list[Union[str, dict]], props: dict = None,
+                               max_workers: int = 8) -> list[dict]:
+        """ See CtbRec.add_models_batch, max_workers is the most requests sent at once """
+        if props:
+            props = self.parse_model_props(dict(props))
+        results = [{'model': m, 'result': 'failed', 'reason': None, 'server_model': None} for m in models]
+
+        async def start(r):
+            try:
+                mt, data = self.start_request(r['model'], props)
+                await self.send_request('/rec', data=data)
+                return mt, data['model'] if mt == self.ModelType.model_dict else r['model']
+            except (CtbRecRequestFailed, CtbRecInvalidModelDefinition) as error:
+                r['reason'] = str(error)
+                return None
+
+        outcomes = await self.gather_limited(start, results, max_workers)
+        started = [(r, s) for r, s in zip(results, outcomes) if s is not None]
+        self.invalidate_model_cache()
+        to_update = self.match_added(await self.get_model_index(), started, props)
+        if not to_update:
+            return results
+
+        async def update(item):
+            r, m = item
+            try:
+                await self.send_request('/rec', data={'action': 'start', 'model': m})
+                return m
+            except CtbRecRequestFailed as error:
+                r['reason'] = f'Added but failed to update properties: {error}'
+                return None
+
+        outcomes = await self.gather_limited(update, to_update, max_workers)
+        updated = [(r, m) for (r, _), m in zip(to_update, outcomes) if m is not None]
+        self.invalidate_model_cache()
+        self.match_updated(await self.get_model_index(), updated)
+        return results
+
+    async def update_model(self, model: Union[str, dict], props: dict) -> dict:
+        """ See CtbRec.update_model """
+        props = self.parse_model_props(props)
+        mt = self.parse_model_type(model)
+        m = self.updated_model(model if mt == self.ModelType.model_dict else await self.find_model(model), props)
+        if m is not None:
+            await self.send_request("/rec", data={"action": "start", "model": m})
+            self.invalidate_model_cache()
+            return await self.find_model(m)
+        warnings.warn("Failed to update model properties")
+        return dict()
+
+    async def remove_model(self, model: Union[str, dict]):
+        """ See CtbRec.remove_model """
+        await self.send_request(url='/rec', data={"action": "stop", "model": await self.find_model(model)})
+        self.invalidate_model_cache()
+
+    async def remove_models(self, models: list[Union[str, dict]], max_workers: int = 8) -> list[Union[str, dict]]:
+        """ See CtbRec.remove_models """
+        failed = []
+        for r in await self.remove_models_batch(models, max_workers):
+            if r['result'] != 'removed':
+                failed.append(r['model'])
+                warnings.warn(f'Unable to remove {r["model"]} from server: {r["reason"]}')
+        return failed
+
+    async def remove_models_batch(self, models: list[Union[str, dict]], max_workers: int = 8) -> list[dict]:
+        """ See CtbRec.remove_models_batch, max_workers is the most requests sent at once """
+        results = self.match_removals(await self.get_model_index(), models)
+
+        async def stop(r):
+            try:
+                await self.send_request(url='/rec', data={"action": "stop", "model": r['server_model']})
+                return r
+            except CtbRecRequestFailed as error:
+                r['reason'] = str(error)
+                return None
+
+        found = [r for r in results if r['server_model'] is not None]
+        stopped = [r for r in await self.gather_limited(stop, found, max_workers) if r]
+        self.invalidate_model_cache()
+        if stopped:
+            self.check_removed(await self.get_model_index(), stopped)
+        return results
+
+    async def plan_models(self, desired: list[Union[str, dict]], remove_missing: bool = False) -> list[dict]:
+        """ See CtbRec.plan_models """
+        self.invalidate_model_cache()
+        return self.plan_from_index(await self.get_model_index(), desired, remove_missing)
+
+    async def apply_model_plan(self, plan: list[dict], max_workers: int = 8) -> list[dict]:
+        """ See CtbRec.apply_model_plan, max_workers is the most requests sent at once """
+        results = [dict(e, result='failed') for e in plan if e['action'] in ('add', 'update', 'remove')]
+
+        async def send(r):
+            try:
+                mt, model, data = self.plan_request(r)
+                await self.send_request('/rec', data=data)
+                return mt, model
+            except (CtbRecRequestFailed, CtbRecInvalidModelDefinition) as error:
+                r['reason'] = str(error)
+                return None
+
+        sent = [(r, s) for r, s in zip(results, await self.gather_limited(send, results, max_workers))
+                if s is not None]
+        self.invalidate_model_cache()
+        if not sent:
+            return results
+        to_update = self.check_plan(await self.get_model_index(), sent)
+
+        async def update(item):
+            r, m = item
+            try:
+                await self.send_request('/rec', data={'action': 'start', 'model': m})
+                r.update(result='ok', server_model=m)
+            except CtbRecRequestFailed as error:
+                r['reason'] = f'Added but failed to update properties: {error}'
+
+        if to_update:
+            await self.gather_limited(update, to_update, max_workers)
+            self.invalidate_model_cache()
+        return results
+
+    async def find_model(self, model: Union[str, dict]) -> dict:
+        """ See CtbRec.find_model """
+        mt = self.parse_model_type(model)
+        match = self.match_model(await self.get_model_index(), model, mt)
+        if match is not None:
+            return match if isinstance(match, Record) else dict(match)
+        raise CtbRecNotFound("Requested model could not be found on server.")
+
+    async def get_model_index(self) -> ModelIndex:
+        """ See CtbRec.get_model_index """
+        index = self._model_index
+        if self.stale_model_index(index):
+            # only one coroutine refreshes a stale index, the others wait for and then use its result
+            async with self._model_lock:
+                index = self._model_index
+                if self.stale_model_index(index):
+                    await self.get_models()
+                    index = self._model_index
+        return index
+
+    # ----------------------------------------- model group methods ----------------------------------------------------
+    async def get_model_groups(self) -> Mapping[str, dict]:
+        """ See CtbRec.get_model_groups """
+        g = (await self.send_request(url='/rec', data={'action': 'listModelGroups'}))['groups']
+        return {v['name']: v for v in g}
+
+    async def delete_model_group(self, group: Union[dict, str]):
+        """ See CtbRec.delete_model_group """
+        g = await self.find_model_group(group) if isinstance(group, str) else group
+        await self.send_request(url='/rec', data={'action': 'deleteModelGroup', 'modelGroup': g})
+
+    async def save_model_group(self, group: dict):
+        """ See CtbRec.save_model_group """
+        await self.send_request(url='/rec', data={'action': 'saveModelGroup', 'modelGroup': group})
+
+    async def add_models_to_group(self, group: Union[dict, str], model_list: list[Union[dict, str]]) -> dict:
+        """ See CtbRec.add_models_to_group """
+        if isinstance(group, str):
+            group = await self.find_model_group(group)
+        updated = self.group_with_models(group, model_list)
+        if updated is None:
+            return group
+        await self.save_model_group(updated)
+        return (await self.get_model_groups())[updated['name']]
+
+    async def remove_models_from_group(self, group: Union[dict, str], model_list: list[Union[dict, str]]):
+        """ See CtbRec.remove_models_from_group """
+        if isinstance(group, str):
+            group = await self.find_model_group(group)
+        updated = self.group_without_models(group, model_list)
+        if updated is None:
+            return group
+        await self.save_model_group(updated)
+        return (await self.get_model_groups())[updated['name']]
+
+    async def create_model_group(self, name: str, model_list: list) -> dict:
+        """ See CtbRec.create_model_group """
+        if name in await self.get_model_groups():
+            raise CtbRecAlreadyExists(f'Model group {name} already exists')
+        await self.save_model_group(self.new_model_group(name, model_list))
+        return (await self.get_model_groups())[name]
+
+    async def find_model_group(self, name: str) -> dict:
+        """ See CtbRec.find_model_group """
+        groups = await self.get_model_groups()
+        if name in groups:
+            return groups[name]
+        raise CtbRecNotFound(f'Model group {name} could not be found on the server')
+
+    async def sync_model_groups(self, desired: Mapping[str, list[Union[dict, str]]], delete_missing: bool = False,
+                                dry_run: bool = False, max_workers: int = 8) -> list[dict]:
+        """ See CtbRec.sync_model_groups, max_workers is the most requests sent at once """
+        report = self.group_report(await self.get_model_groups(), desired, delete_missing, dry_run)
+        if dry_run:
+            return report
+
+        async def write(r):
+            try:
+                if r['action'] == 'deleted':
+                    await self.delete_model_group(r['group'])
+                else:
+                    await self.save_model_group(r['group'])
+            except CtbRecRequestFailed as error:
+                r['result'] = 'failed'
+                r['reason'] = str(error)
+
+        await self.gather_limited(write, [r for r in report if r['action'] != 'unchanged'], max_workers)
+        return report
+
+    # --------------------------------------- recording methods -------------------------------------------------------
+    async def get_recordings(self, max_age: Optional[float] = None) -> list[dict]:
+        """ See CtbRec.get_recordings """
+        max_age = self.recordings_max_age if max_age is None else max_age
+        cache = self.recording_cache
+        if cache.age() > max_age:
+            async with self._recordings_lock:
+                if cache.age() > max_age:
+                    recordings = (await self.send_request(url='/rec', data={'action': 'recordings'}))['recordings']
+                    cache.update(self.recording_records(recordings))
+        return cache.copy(cache.recordings.values())
+
+    async def get_recordings_delta(self, max_age: Optional[float] = None) -> dict:
+        """ See CtbRec.get_recordings_delta """
+        max_age = self.recordings_max_age if max_age is None else max_age
+        if self.recording_cache.delta is None:
+            max_age = -1
+        await self.get_recordings(max_age)
+        return {k: self.recording_cache.copy(v) for k, v in self.recording_cache.delta.items()}
+
+    async def delete_recording(self, recording: dict):
+        """ See CtbRec.delete_recording """
+        await self.send_request(url='/rec', data={'action': 'delete', 'recording': recording})
+        self.recording_cache.discard(recording)
+
+    async def pin_recording(self, recording: dict):
+        """ See CtbRec.pin_recording """
+        await self.send_request(url='/rec', data={'action': 'pin', 'recording': recording})
+        self.recording_cache.invalidate()
+
+    async def unpin_recording(self, recording: dict):
+        """ See CtbRec.unpin_recording """
+        await self.send_request(url='/rec', data={'action': 'unpin', 'recording': recording})
+        self.recording_cache.invalidate()
+
+    async def annotate_recording(self, recording: dict, note: str):
+        """ See CtbRec.annotate_recording """
+        if isinstance(recording, Record):
+            recording = dict(recording, note=note)
+        else:
+            recording['note'] = note
+        await self.send_request(url='/rec', data={'action': 'setNote', 'recording': recording})
+        self.recording_cache.invalidate()
+
+    async def rerun_post_process(self, recording: dict):
+        """ See CtbRec.rerun_post_process """
+        await self.send_request(url='/rec', data={'action': 'rerunPostProcessing', 'recording': recording})
+        self.recording_cache.invalidate()
+
+    # --------------------------------------- general server methods ---------------------------------------------------
+    async def get_settings(self) -> list:
+        """ See CtbRec.get_settings """
+        settings = await self.send_request(url='/config')
+        self.settings_fetched(settings)
+        return settings
+
+    async def cached_settings(self) -> list:
+        """ See CtbRec.cached_settings """
+        async with self._settings_lock:
+            if self._settings is None:
+                await self.get_settings()
+            return copy.deepcopy(list(self._settings.values()))
+
+    async def update_settings(self, settings: Union[dict, list]) -> list:
+        """ See CtbRec.update_settings """
+        if isinstance(settings, dict):
+            async with self._settings_lock:
+                version = self.settings_version
+                await self._stage_settings(settings)
+                # settings _stage_settings() has just fetched aren't fetched again
+                return await self._commit_settings(None if version == self.settings_version else float('inf'))
+        if self._initial_config is None:
+            await self.get_settings()
+        await self.send_request(url='/config', data=settings)
+        self.settings_written(settings)
+        return copy.deepcopy(settings)
+
+    async def stage_settings(self, settings: dict):
+        """ See CtbRec.stage_settings """
+        async with self._settings_lock:
+            await self._stage_settings(settings)
+
+    async def _stage_settings(self, settings: dict):
+        # asyncio locks can't be taken again by their holder, so the locked methods share these
+        if self._settings is None:
+            await self.get_settings()
+        self.stage_checked(settings)
+
+    async def commit_settings(self, max_age: Optional[float] = None) -> list:
+        """ See CtbRec.commit_settings """
+        async with self._settings_lock:
+            return await self._commit_settings(max_age)
+
+    async def _commit_settings(self, max_age: Optional[float] = None) -> list:
+        if self.stale_settings(max_age):
+            await self.get_settings()
+        data = self.settings_to_commit()
+        if data is None:
+            return copy.deepcopy(list(self._settings.values()))
+        await self.send_request(url='/config', data=data)
+        return self.settings_committed()
+
+    async def discard_settings(self):
+        """ See CtbRec.discard_settings """
+        self._pending_settings.clear()
+
+    async def snapshot_settings(self) -> list:
+        """ See CtbRec.snapshot_settings """
+        return await self.cached_settings()
+
+    async def restore_settings(self, snapshot: list = None) -> list:
+        """ See CtbRec.restore_settings. Without a snapshot the settings are restored to the initial config, which
+        is fetched now if the client was connected without a snapshot and hasn't fetched the settings since. """
+        async with self._settings_lock:
+            version = self.settings_version
+            if snapshot is None:
+                if self._initial_config is None:
+                    await self.get_settings()
+                snapshot = self._initial_config
+            self._pending_settings.clear()
+            await self._stage_settings({s['key']: s['value'] for s in snapshot})
+            return await self._commit_settings(None if version == self.settings_version else float('inf'))
+
+    async def get_space(self) -> dict:
+        """ See CtbRec.get_space """
+        return await self.send_request(url='/rec', data={'action': 'space'})
+
+    async def get_summary(self, max_age: Optional[float] = None) -> dict:
+        """ See CtbRec.get_summary """
+        return (await self.get_server_state(max_age)).summary()
+
+    async def get_server_state(self, max_age: Optional[float] = None) -> ServerState:
+        """ See CtbRec.get_server_state """
+        max_age = self.state_max_age if max_age is None else max_age
+        state = self._server_state
+        if state is None or state.age() > max_age:
+            async with self._state_lock:
+                state = self._server_state
+                if state is None or state.age() > max_age:
+                    models, online, recordings, space = await asyncio.gather(
+                        self.get_models(), self.get_models(online=True), self.get_recordings(), self.get_space())
+                    state = ServerState(models, online, recordings, space, self.model_id)
+                    self._server_state = state
+        return state
+
+    async def pause_recording(self):
+        """ See CtbRec.pause_recording """
+        await self.send_request(url='/rec', data={'action': 'pauseRecorder'})
+
+    async def resume_recording(self):
+        """ See CtbRec.resume_recording """
+        await self.send_request(url='/rec', data={'action': 'resumeRecorder'})
+
+    # ------------------------------------------- internal methods -----------------------------------------------------
+    @staticmethod
+    async def gather_limited(func, items: list, limit: int) -> list:
+        """ Results of awaiting func for each item, in item order, with at most `limit` awaited at a time """
+        semaphore = asyncio.Semaphore(max(limit, 1))
+
+        async def call(item):
+            async with semaphore:
+                return await func(item)
+        return await asyncio.gather(*(call(item) for item in items))
+
+    async def transport(self, action: str, url: str, body: Optional[bytes] = None,
+                        headers: Optional[dict] = None) -> tuple[int, str, bytes, int]:
+        """ Send a request through the circuit breaker, retrying it with backoff if it is idempotent
 
         Args:
-            url: string - relative url for the request, eg. '/rec'
-            data: dict - payload to send to server. If None then GET will be used rather than POST
+            action: the /rec action, or the request path for other requests
+            url: relative url for the request, eg. '/rec'
+            body: request body to POST, or None to send a GET request
+            headers: optional request headers
         Return:
-            server result data structure
+            tuple of the status, which may be any below 500, reason, body and number of bytes received, before
+            decompression if the response was compressed
         Raises:
-            CtbRecRequestFailed
+            CtbRecUnavailable, CtbRecCircuitOpen
         """
-        data_str = '' if data is None else json.dumps(data)
-        data_hmac = hmac.new(self.hmac_key, data_str.encode('utf-8'), hashlib.sha256).hexdigest()
-        self.session.headers.update({'CTBREC-HMAC': data_hmac})
-        if data is None:
-            result = self.session.get(self.server_url + url)
-        else:
-            result = self.session.post(self.server_url+url, data=data_str)
-        if result.status_code == 200:
-            result_json = json.loads(result.text)
-            if isinstance(result_json, dict) and result_json['status'] != "success":
-                raise CtbRecRequestFailed(f"Request failed: {result_json['msg']}")
-            else:
-                return result_json
-        else:
-            raise CtbRecRequestFailed(f'HTTP error: {result.status_code} : {result.reason} : {result.text}')
+        retries = self.request_retries(action, body)
+        for attempt in range(retries + 1):
+            if not self.breaker.allow():
+                raise CtbRecCircuitOpen(f'Server unavailable, not sending {action} request')
+            if attempt:
+                await asyncio.sleep(self.retry_delay(attempt))
+            try:
+                async with self.session.request('GET' if body is None else 'POST', self.server_url + url, data=body,
+                                                headers=headers) as response:
+                    content = await response.read()
+            except self.client_errors as error:
+                self.breaker.failure()
+                if attempt == retries:
+                    raise CtbRecUnavailable(f'Server unavailable: {error!r}') from error
+                continue
+            if response.status < 500:
+                self.breaker.success()
+                return (response.status, response.reason, content,
+                        int(response.headers.get('Content-Length', len(content))))
+            self.breaker.failure()
+            if attempt == retries:
+                raise CtbRecUnavailable(f'HTTP error: {response.status} : {response.reason}')
+
+    async def send_request(self, url: str, data: Optional[Union[dict, list]] = None) -> Union[dict, list]:
+        """ See CtbRec.send_request """
+        stats = {'sign': 0.0, 'parse': 0.0, 'sent': 0, 'received': 0, 'error': 'encode'}
+        start = time.perf_counter()
+        try:
+            body, headers = self.encode_request(data, stats, start)
+            status, reason, content, stats['received'] = await self.transport(self.request_action(url, data), url,
+                                                                               body, headers)
+            return self.decode_response(status, reason, content, stats)
+        except CtbRecCircuitOpen:
+            stats['error'] = 'unavailable'
+            raise
+        finally:
+            self.record_request(self.request_action(url, data), start, **stats)
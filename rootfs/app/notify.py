@@ -0,0 +1,91 @@
+#!/bin/python3
+
+import argparse
+import json
+import os
+import re
+import socket
+import sys
+
+# sinks notifications can be sent to, see notifyd.SINKS. Handing a notification to the daemon only needs the socket,
+# so notifyd, (and with it ctbrec, requests and smtplib), is only imported to send notifications from this process or
+# to run the daemon.
+SINK_NAMES = ('discord', 'telegram', 'ntfy', 'email', 'http')
+
+
+def ask_daemon(path, request, timeout=5.0):
+  """ Send a request to a running daemon and return its reply, or None if there isn't one listening """
+  try:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+      s.settimeout(timeout)
+      s.connect(path)
+      s.sendall(json.dumps(request).encode() + b'\n')
+      with s.makefile('rb') as f:
+        return json.loads(f.readline())
+  except (OSError, ValueError):
+    return None
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='Send a notification for a recording to Discord, Telegram, ntfy, email '
+                                               'and/or an http url, through the notify.py daemon if it is running.')
+  parser.add_argument('--sink', action='append', choices=SINK_NAMES, dest='sinks',
+                      help='where to send notifications, can be given more than once. Default is NOTIFY_SINKS, '
+                           'or every one that is configured.')
+  parser.add_argument('--daemon', action='store_true',
+                      help='run the daemon, keeping connections between notifications')
+  parser.add_argument('--direct', action='store_true', help="send the notification from this process, even if the "
+                                                            "daemon is running")
+  parser.add_argument('--socket', default=os.environ.get('NOTIFY_SOCKET', '/tmp/ctbrec-notify.sock'),
+                      help='unix socket of the daemon, default is NOTIFY_SOCKET or /tmp/ctbrec-notify.sock')
+  parser.add_argument('--window', type=float, default=2.0,
+                      help='seconds the daemon waits for more notifications to send along with one')
+  parser.add_argument('--queue-size', type=int, default=100, help='most notifications queued per sink')
+  parser.add_argument('--retries', type=int, default=5, help='times a failed notification is sent again')
+  parser.add_argument('--timeout', type=float, default=120.0,
+                      help='most seconds spent sending a notification without the daemon')
+  parser.add_argument('file', nargs='?', help='${absolutePath} of the recording')
+  parser.add_argument('args', nargs=argparse.REMAINDER,
+                      help='any number of arguments, joined with " - " for the subject')
+  args = parser.parse_args(argv)
+  if args.sinks is None and os.environ.get('NOTIFY_SINKS'):
+    args.sinks = [n for n in re.split(r'[\s,]+', os.environ['NOTIFY_SINKS']) if n in SINK_NAMES]
+  options = {'queue_size': args.queue_size, 'window': args.window, 'retries': args.retries}
+
+  if args.daemon:
+    import notifyd
+    dispatcher = notifyd.Dispatcher(notifyd.configured_sinks(args.sinks, **options))
+    if not dispatcher.sinks:
+      print('notify.py: no notification sinks are configured', flush=True)
+      return 1
+    if ask_daemon(args.socket, {'action': 'stats'}) is not None:
+      print(f'notify.py: a daemon is already listening on {args.socket}', flush=True)
+      return 1
+    notifyd.serve(args.socket, dispatcher)
+    return 0
+
+  if not args.file:
+    parser.error('the recording file is required')
+  sinks = args.sinks
+  if not args.direct:
+    reply = ask_daemon(args.socket, {'file': args.file, 'args': args.args, 'sinks': sinks})
+    if reply is not None and reply.get('status') == 'error':
+      print(f"notify.py: the daemon refused the notification: {reply.get('error')}", flush=True)
+      return 1
+    if reply is not None:
+      # sinks the daemon wasn't started with are sent to from here
+      if not sinks:
+        return 0
+      sinks = [n for n in sinks if n not in reply.get('sinks', [])]
+      if not sinks:
+        return 0
+  import notifyd
+  dispatcher = notifyd.Dispatcher(notifyd.configured_sinks(sinks, **options))
+  dispatcher.dispatch(notifyd.make_event(args.file, args.args))
+  if not dispatcher.close(args.timeout):
+    return 1
+  return 1 if any(s.stats['failed'] for s in dispatcher.sinks.values()) else 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
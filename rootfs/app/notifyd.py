@@ -0,0 +1,566 @@
+""" Notification sinks, the dispatcher sending to them and the daemon server used by notify.py
+
+Kept apart from notify.py so that a notify.py client handing a notification to the daemon only imports what it
+needs to talk to the daemon's socket. This module is imported when notifications are sent, by the daemon or by a
+client sending them directly.
+"""
+
+from recmeta import RecordingIndex, format_duration, probe_duration
+from collections import deque
+from email.header import Header
+from email.message import EmailMessage
+from urllib.parse import urlsplit
+import abc
+import base64
+import json
+import os
+import random
+import shlex
+import signal
+import smtplib
+import socketserver
+import sqlite3
+import ssl
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class NotifyError(Exception):
+  """ A notification couldn't be sent. `retry` is False when sending it again won't help. """
+
+  def __init__(self, message, retry=True, retry_after=None):
+    super().__init__(message)
+    self.retry = retry
+    self.retry_after = retry_after
+
+
+def recording_duration(file):
+  """ Duration of a recording as hh:mm:ss, or '' if it can't be read. It is read from the recording index kept by
+  recindex.py if there is one, which probes the recording only if it hasn't already, otherwise from a single
+  ffmpeg probe. """
+  path = os.environ.get('RECORDING_INDEX', '/app/config/recindex.db')
+  if os.path.exists(path):
+    try:
+      with RecordingIndex(path) as index:
+        return format_duration(index.duration(file))
+    except sqlite3.Error:
+      pass
+  return format_duration(probe_duration(file))
+
+
+def make_event(file, args, sinks=None, duration=None):
+  """ Notification for a recording. The subject is made the same way as by the send2*.sh scripts, the
+  arguments joined with ' - ' followed by the duration of the recording. """
+  duration = recording_duration(file) if duration is None else duration
+  content = ' - '.join(args) if args else 'Contact sheet'
+  return {'file': file, 'args': list(args), 'sheet': os.path.splitext(file)[0] + '.jpg', 'duration': duration,
+          'content': f'{content}: {duration}', 'sinks': sinks, 'time': time.time()}
+
+
+def read_sheet(event):
+  """ The contact sheet of a notification as (file name, bytes), or None if there isn't one """
+  try:
+    with open(event['sheet'], 'rb') as f:
+      return os.path.basename(event['sheet']), f.read()
+  except OSError:
+    return None
+
+
+class Sink(abc.ABC):
+  """ Sends notifications from a bounded queue on a thread of its own. Up to `max_batch` notifications
+  arriving within `window` seconds of each other are sent as one message, repeated notifications for the
+  same recording are sent once, and failures are retried with backoff. When the queue is full the oldest
+  notification is dropped. """
+  name = None
+  max_batch = 1
+
+  def __init__(self, queue_size=100, window=2.0, retries=5, backoff=1.0):
+    self.queue = deque()
+    self.queue_size = queue_size
+    self.window = window
+    self.retries = retries
+    self.backoff = backoff
+    self.cond = threading.Condition()
+    self.thread = None
+    self.busy = False
+    self.closed = False
+    self.stats = {'queued': 0, 'sent': 0, 'messages': 0, 'coalesced': 0, 'retries': 0, 'dropped': 0, 'failed': 0}
+
+  def submit(self, event):
+    with self.cond:
+      if len(self.queue) >= self.queue_size:
+        self.queue.popleft()
+        self.stats['dropped'] += 1
+        print(f"notify.py {self.name}: queue full, dropped the oldest notification", flush=True)
+      self.queue.append(event)
+      self.stats['queued'] += 1
+      if self.thread is None:
+        self.thread = threading.Thread(target=self.run, name=f'notify-{self.name}', daemon=True)
+        self.thread.start()
+      self.cond.notify_all()
+
+  def next_batch(self):
+    """ Wait for a notification, then up to `window` seconds for more to send along with it """
+    with self.cond:
+      while not self.queue and not self.closed:
+        self.cond.wait()
+      if not self.queue:
+        return None
+      deadline = time.monotonic() + self.window
+      while len(self.queue) < self.max_batch and not self.closed:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+          break
+        self.cond.wait(remaining)
+      batch = []
+      while self.queue and len(batch) < self.max_batch:
+        event = self.queue.popleft()
+        if any(e['file'] == event['file'] for e in batch):
+          self.stats['coalesced'] += 1
+          batch = [e for e in batch if e['file'] != event['file']]
+        batch.append(event)
+      self.busy = True
+      return batch
+
+  def run(self):
+    while True:
+      batch = self.next_batch()
+      if batch is None:
+        return
+      self.deliver(batch)
+      with self.cond:
+        self.busy = False
+        self.cond.notify_all()
+
+  def deliver(self, batch):
+    """ Send a batch, retrying with exponential backoff, or as long as the service asks """
+    for attempt in range(self.retries + 1):
+      try:
+        self.send(batch)
+        self.stats['sent'] += len(batch)
+        self.stats['messages'] += 1
+        return True
+      except NotifyError as error:
+        if not error.retry or attempt == self.retries:
+          self.stats['failed'] += len(batch)
+          print(f"notify.py {self.name}: {error}", flush=True)
+          return False
+        self.stats['retries'] += 1
+        delay = error.retry_after
+        if delay is None:
+          delay = self.backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+        time.sleep(min(delay, 300))
+
+  @abc.abstractmethod
+  def send(self, batch):
+    """ Send a batch of notifications as one message, raising NotifyError if it can't be sent """
+
+  def flush(self, timeout=None):
+    """ Wait until every queued notification has been sent or given up on. Returns False on timeout. """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    with self.cond:
+      while self.queue or self.busy:
+        remaining = None if deadline is None else deadline - time.monotonic()
+        if remaining is not None and remaining <= 0:
+          return False
+        self.cond.wait(remaining)
+    return True
+
+  def close(self, timeout=None):
+    """ Send what is queued without waiting for more, then stop """
+    with self.cond:
+      self.closed = True
+      self.cond.notify_all()
+    return self.flush(timeout)
+
+
+class HttpSink(Sink):
+  """ Sink for an http api, sending over a single pooled keep-alive connection """
+
+  def __init__(self, timeout=(5.0, 60.0), **kwargs):
+    super().__init__(**kwargs)
+    self.timeout = timeout
+    self.session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+    self.session.mount('http://', adapter)
+    self.session.mount('https://', adapter)
+
+  def request(self, method, url, **kwargs):
+    # the urls of most services contain their token, so they are kept out of the messages
+    try:
+      response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+    except requests.RequestException as error:
+      raise NotifyError(f'request failed: {type(error).__name__}')
+    if response.status_code == 429 or response.status_code >= 500:
+      retry_after = response.headers.get('Retry-After')
+      try:
+        retry_after = float(retry_after) if retry_after is not None else None
+      except ValueError:
+        retry_after = None
+      raise NotifyError(f'HTTP {response.status_code}', retry_after=retry_after)
+    if response.status_code >= 400:
+      raise NotifyError(f'HTTP {response.status_code}: {response.text[:200]}', retry=False)
+    return response
+
+  def close(self, timeout=None):
+    done = super().close(timeout)
+    self.session.close()
+    return done
+
+
+class DiscordSink(HttpSink):
+  """ Posts to a Discord webhook, up to 10 contact sheets to a message """
+  name = 'discord'
+  max_batch = 10
+
+  def __init__(self, hook, **kwargs):
+    super().__init__(**kwargs)
+    self.hook = hook
+
+  def send(self, batch):
+    payload = {'username': 'CTBRec', 'content': '\n'.join(e['content'] for e in batch)}
+    sheets = [s for s in map(read_sheet, batch) if s is not None]
+    if not sheets:
+      self.request('POST', self.hook, json=payload)
+      return
+    files = {f'file{i}': (name, data, 'image/jpeg') for i, (name, data) in enumerate(sheets, 1)}
+    self.request('POST', self.hook, data={'payload_json': json.dumps(payload)}, files=files)
+
+
+class TelegramSink(HttpSink):
+  """ Sends contact sheets to a Telegram chat, several at once as an album """
+  name = 'telegram'
+  max_batch = 10
+
+  def __init__(self, chat_id, token, api='https://api.telegram.org', **kwargs):
+    super().__init__(**kwargs)
+    self.chat_id = chat_id
+    self.base = f"{api.rstrip('/')}/bot{token}"
+
+  def send(self, batch):
+    sheets = list(map(read_sheet, batch))
+    photos = [(e, s) for e, s in zip(batch, sheets) if s is not None]
+    text = [e['content'] for e, s in zip(batch, sheets) if s is None]
+    if len(photos) == 1:
+      (e, (name, data)), = photos
+      self.request('POST', f'{self.base}/sendPhoto', data={'chat_id': self.chat_id, 'caption': e['content']},
+                   files={'photo': (name, data, 'image/jpeg')})
+    elif photos:
+      media = [{'type': 'photo', 'media': f'attach://photo{i}', 'caption': e['content']}
+               for i, (e, _) in enumerate(photos)]
+      self.request('POST', f'{self.base}/sendMediaGroup', data={'chat_id': self.chat_id, 'media': json.dumps(media)},
+                   files={f'photo{i}': (name, data, 'image/jpeg') for i, (_, (name, data)) in enumerate(photos)})
+    if text:
+      self.request('POST', f'{self.base}/sendMessage', data={'chat_id': self.chat_id, 'text': '\n'.join(text)})
+
+
+class NtfySink(HttpSink):
+  """ Publishes to an ntfy topic, with the contact sheet as the attachment """
+  name = 'ntfy'
+
+  def __init__(self, url, token=None, **kwargs):
+    super().__init__(**kwargs)
+    self.url = url
+    if token:
+      self.session.headers['Authorization'] = f'Bearer {token}'
+
+  @staticmethod
+  def header(value):
+    # ntfy accepts RFC 2047 encoded headers for text that isn't ascii
+    return value if value.isascii() else Header(value, 'utf-8', maxlinelen=10000).encode()
+
+  def send(self, batch):
+    event = batch[0]
+    sheet = read_sheet(event)
+    if sheet is None:
+      self.request('POST', self.url, data=event['content'].encode(), headers={'Title': 'CTBRec'})
+      return
+    self.request('PUT', self.url, data=sheet[1], headers={'Title': 'CTBRec', 'Message': self.header(event['content']),
+                                                          'Filename': self.header(sheet[0])})
+
+
+# curl arguments that only change what curl prints, so there is nothing to say about leaving them out
+QUIET_CURL_ARGS = {'-s', '--silent', '-S', '--show-error', '-sS', '-f', '--fail', '-v', '--verbose'}
+
+
+def curl_options(args):
+  """ The request options of the curl arguments send2http.sh passed on from CURL_ARGS: headers, (-H),
+  credentials, (-u), the user agent, (-A), and skipping certificate checks, (-k). Other arguments are left out
+  with a message. """
+  options = {'headers': {}, 'auth': None, 'verify': True}
+  ignored = []
+  words = iter(shlex.split(args or ''))
+  for word in words:
+    for short, long in (('-H', '--header'), ('-u', '--user'), ('-A', '--user-agent')):
+      if word in (short, long):
+        value = next(words, '')
+      elif word.startswith(short) and not word.startswith('--'):
+        value = word[len(short):]
+      else:
+        continue
+      if short == '-H':
+        name, _, header = value.partition(':')
+        options['headers'][name.strip()] = header.strip()
+      elif short == '-u':
+        user, _, password = value.partition(':')
+        options['auth'] = (user, password)
+      else:
+        options['headers']['User-Agent'] = value
+      break
+    else:
+      if word in ('-k', '--insecure'):
+        options['verify'] = False
+      elif word not in QUIET_CURL_ARGS:
+        ignored.append(word)
+  if ignored:
+    print(f"notify.py http: CURL_ARGS {' '.join(ignored)} ignored, only -H, -u, -A and -k are used", flush=True)
+  return options
+
+
+class HttpPostSink(HttpSink):
+  """ Sends the fields of send2http.sh to a url, as multipart/form-data or, with `get`, as query parameters
+  without the contact sheet. `headers`, `auth` and `verify` are sent with every request, as CURL_ARGS was. """
+  name = 'http'
+
+  def __init__(self, url, get=False, headers=None, auth=None, verify=True, **kwargs):
+    super().__init__(**kwargs)
+    self.url = url
+    self.get = get
+    self.session.headers.update(headers or {})
+    self.session.auth = auth
+    self.session.verify = verify
+
+  def send(self, batch):
+    event = batch[0]
+    fields = {'file': event['file'][len('/app/captures/'):], 'duration': event['duration'],
+              'argv': base64.b64encode((' '.join(event['args']) + '\n').encode()).decode()}
+    if self.get:
+      self.request('GET', self.url, params=fields)
+      return
+    sheet = read_sheet(event)
+    self.request('POST', self.url, data=fields,
+                 files={'sheet': (sheet[0], sheet[1], 'image/jpeg')} if sheet else {'sheet': ('', b'')})
+
+
+class EmailSink(Sink):
+  """ Emails contact sheets with smtplib, up to 10 to an email, keeping the connection to the mail server
+  open between emails. smtps:// servers use TLS from the start, smtp:// servers must support STARTTLS. """
+  name = 'email'
+  max_batch = 10
+
+  def __init__(self, server, sender, recipient, password, timeout=60.0, **kwargs):
+    super().__init__(**kwargs)
+    url = urlsplit(server)
+    self.tls = url.scheme == 'smtps'
+    self.host = url.hostname
+    self.port = url.port or (465 if self.tls else 587)
+    self.sender = sender
+    self.recipient = recipient
+    self.password = password
+    self.timeout = timeout
+    self.smtp = None
+
+  def connect(self):
+    # certificates are verified, as curl did
+    context = ssl.create_default_context()
+    if self.tls:
+      smtp = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout, context=context)
+    else:
+      smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+      smtp.starttls(context=context)
+    smtp.login(self.sender, self.password)
+    return smtp
+
+  def disconnect(self):
+    if self.smtp is not None:
+      try:
+        self.smtp.quit()
+      except (smtplib.SMTPException, OSError):
+        pass
+      self.smtp = None
+
+  def message(self, batch):
+    msg = EmailMessage()
+    msg['Subject'] = batch[0]['content'] if len(batch) == 1 else f"{len(batch)} recordings: {batch[0]['content']}, ..."
+    msg['From'] = self.sender
+    msg['To'] = self.recipient
+    msg.set_content('\n'.join(e['content'] for e in batch))
+    for sheet in map(read_sheet, batch):
+      if sheet is not None:
+        msg.add_attachment(sheet[1], maintype='image', subtype='jpeg', filename=sheet[0])
+    return msg
+
+  def send(self, batch):
+    msg = self.message(batch)
+    # a kept connection may have been closed by the server, in which case it is opened again once
+    for reconnect in (self.smtp is not None, False):
+      try:
+        if self.smtp is None:
+          self.smtp = self.connect()
+        self.smtp.send_message(msg)
+        return
+      except smtplib.SMTPAuthenticationError as error:
+        self.disconnect()
+        raise NotifyError(f'login failed: {error.smtp_code}', retry=False)
+      except smtplib.SMTPResponseException as error:
+        self.disconnect()
+        raise NotifyError(f"SMTP {error.smtp_code}: {error.smtp_error.decode(errors='replace')[:200]}",
+                          retry=error.smtp_code < 500)
+      except smtplib.SMTPNotSupportedError as error:
+        self.disconnect()
+        raise NotifyError(str(error), retry=False)
+      except (smtplib.SMTPException, OSError) as error:
+        self.disconnect()
+        if not reconnect:
+          raise NotifyError(f'SMTP failed: {type(error).__name__}')
+
+  def close(self, timeout=None):
+    done = super().close(timeout)
+    self.disconnect()
+    return done
+
+
+# sink name -> (environment variables it needs, function creating it from the environment)
+SINKS = {
+  'discord': (('DISCORDHOOK',), lambda env, **kw: DiscordSink(env['DISCORDHOOK'], **kw)),
+  'telegram': (('CHAT_ID', 'TOKEN'),
+               lambda env, **kw: TelegramSink(env['CHAT_ID'], env['TOKEN'],
+                                              env.get('TELEGRAM_API', 'https://api.telegram.org'), **kw)),
+  'ntfy': (('NTFY_URL',), lambda env, **kw: NtfySink(env['NTFY_URL'], env.get('NTFY_TOKEN'), **kw)),
+  'email': (('MAILSERVER', 'MAILFROM', 'MAILTO', 'MAILPASS'),
+            lambda env, **kw: EmailSink(env['MAILSERVER'], env['MAILFROM'], env['MAILTO'], env['MAILPASS'], **kw)),
+  'http': (('HTTP_URL',), lambda env, **kw: HttpPostSink(env['HTTP_URL'], bool(env.get('CURL_GET')),
+                                                         **curl_options(env.get('CURL_ARGS')), **kw)),
+}
+
+
+def configured_sinks(names=None, env=None, **kwargs):
+  """ The sinks named, or all sinks whose environment variables are set, keyed by name. Sinks missing
+  variables are left out with a message. """
+  env = os.environ if env is None else env
+  sinks = {}
+  for name in names or SINKS:
+    needs, create = SINKS[name]
+    missing = [v for v in needs if not env.get(v)]
+    if not missing:
+      sinks[name] = create(env, **kwargs)
+    elif names:
+      print(f"notify.py {name}: not configured, set {', '.join(missing)}", flush=True)
+  return sinks
+
+
+class Dispatcher:
+  """ Hands each notification to every sink it is for """
+
+  def __init__(self, sinks):
+    self.sinks = sinks
+
+  def route(self, sinks=None):
+    """ Names of the sinks, of those asked for, that notifications can be sent to """
+    return [n for n in (sinks or self.sinks) if n in self.sinks]
+
+  def dispatch(self, event):
+    """ Queue a notification, returning the names of the sinks it was queued for """
+    names = self.route(event.get('sinks'))
+    for name in names:
+      self.sinks[name].submit(event)
+    return names
+
+  def flush(self, timeout=None):
+    deadline = None if timeout is None else time.monotonic() + timeout
+    return all([s.flush(None if deadline is None else max(deadline - time.monotonic(), 0))
+                for s in self.sinks.values()])
+
+  def close(self, timeout=None):
+    for sink in self.sinks.values():
+      with sink.cond:
+        sink.closed = True
+        sink.cond.notify_all()
+    deadline = None if timeout is None else time.monotonic() + timeout
+    return all([s.close(None if deadline is None else max(deadline - time.monotonic(), 0))
+                for s in self.sinks.values()])
+
+  def stats(self):
+    return {name: dict(sink.stats, queue=len(sink.queue)) for name, sink in self.sinks.items()}
+
+
+def check_request(request):
+  """ Why a request to the daemon is invalid, or None if it is valid """
+  if not isinstance(request, dict):
+    return 'the request must be a json object'
+  action = request.get('action', 'notify')
+  if action not in ('notify', 'stats', 'flush'):
+    return f'unknown action {action!r}'
+  if action == 'flush':
+    timeout = request.get('timeout')
+    if timeout is not None and (isinstance(timeout, bool) or not isinstance(timeout, (int, float))):
+      return "'timeout' must be a number"
+  if action == 'notify':
+    if not isinstance(request.get('file'), str) or not request['file']:
+      return "'file' must be the path of the recording"
+    if not isinstance(request.get('args', []), list) or not all(isinstance(a, str) for a in request.get('args', [])):
+      return "'args' must be a list of strings"
+    sinks = request.get('sinks')
+    if sinks is not None and (not isinstance(sinks, list) or not all(isinstance(n, str) for n in sinks)):
+      return "'sinks' must be a list of sink names"
+  return None
+
+
+class NotifyHandler(socketserver.StreamRequestHandler):
+  """ Reads one json request from a client: a notification to queue, or 'stats' or 'flush'. Invalid requests are
+  answered with an error. """
+
+  def reply(self, reply):
+    self.wfile.write(json.dumps(reply).encode() + b'\n')
+    self.wfile.flush()
+
+  def handle(self):
+    try:
+      request = json.loads(self.rfile.readline())
+    except ValueError:
+      return self.reply({'status': 'error', 'error': 'the request is not valid json'})
+    error = check_request(request)
+    if error is not None:
+      print(f'notify.py daemon: refused a request, {error}', flush=True)
+      return self.reply({'status': 'error', 'error': error})
+    dispatcher = self.server.dispatcher
+    action = request.get('action', 'notify')
+    if action == 'stats':
+      reply = {'status': 'ok', 'stats': dispatcher.stats()}
+    elif action == 'flush':
+      reply = {'status': 'ok' if dispatcher.flush(request.get('timeout')) else 'timeout'}
+    else:
+      reply = {'status': 'queued', 'sinks': dispatcher.route(request.get('sinks'))}
+    self.reply(reply)
+    if action == 'notify':
+      # the client has its answer, so the recording is probed after it has gone
+      dispatcher.dispatch(make_event(request['file'], request.get('args', []), request.get('sinks')))
+
+
+class NotifyDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+  """ Keeps the sinks, and their connections, between notifications sent by notify.py clients over a unix socket """
+  daemon_threads = True
+
+  def __init__(self, path, dispatcher):
+    if os.path.exists(path):
+      os.unlink(path)
+    self.dispatcher = dispatcher
+    super().__init__(path, NotifyHandler)
+    os.chmod(path, 0o666)
+
+
+def serve(path, dispatcher):
+  """ Run the daemon on a unix socket until it is sent SIGTERM or interrupted, then send what is queued """
+  server = NotifyDaemon(path, dispatcher)
+  signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown).start())
+  print(f"notify.py daemon listening on {path}, sending to {', '.join(dispatcher.sinks)}", flush=True)
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  server.server_close()
+  dispatcher.close(30.0)
+  os.unlink(path)
@@ -2,4 +2,10 @@
 # Server non-single file use only.
 # plcheck.sh ${absolutePath}
 
-[[ -d "${1}" ]] && [[ -f "${1%/}/playlist.m3u8" ]] && echo "#EXT-X-ENDLIST" >> "${1%/}/playlist.m3u8" || exit 0
+playlist="${1%/}/playlist.m3u8"
+[[ -d "${1}" ]] && [[ -f "${playlist}" ]] || exit 0
+
+# Only the end of the playlist is read, and the tag is only appended if it's missing
+tail -c 64 "${playlist}" | grep -q "#EXT-X-ENDLIST" && exit 0
+[[ -n "$(tail -c 1 "${playlist}")" ]] && echo >> "${playlist}"
+echo "#EXT-X-ENDLIST" >> "${playlist}" || exit 0
@@ -0,0 +1,171 @@
+#!/bin/python3
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from ctbrec import CtbRec, CtbRecRequestFailed, RequestMetrics, recording_key
+from ppsched import PostProcessScheduler
+
+WORKERS = 16
+# most directories scanned by a worker at a time
+BATCH = 256
+ENDLIST = b'#EXT-X-ENDLIST'
+# bytes read from the end of a playlist, enough for the end tag and any trailing whitespace
+TAIL = 64
+# statuses of recordings whose playlists are still being written or read
+ACTIVE = ('RECORDING', 'GENERATING_PLAYLIST', 'POST_PROCESSING', 'WAITING')
+
+
+def check_playlist(path):
+  """ Whether a playlist ends with #EXT-X-ENDLIST, reading only its last bytes. Returns a dict of the playlist's
+  'path', 'mtime', whether it is 'ended' and whether it ends with a newline, or None if it can't be read. """
+  try:
+    fd = os.open(path, os.O_RDONLY)
+  except OSError:
+    return None
+  try:
+    stat = os.fstat(fd)
+    tail = os.pread(fd, TAIL, max(stat.st_size - TAIL, 0))
+  except OSError:
+    return None
+  finally:
+    os.close(fd)
+  return {'path': path, 'mtime': stat.st_mtime, 'ended': tail.rstrip().endswith(ENDLIST),
+          'newline': not tail or tail.endswith(b'\n')}
+
+
+def scan_dir(path):
+  """ Subdirectories of a directory to scan, and the check of its playlist if it is a capture directory. Capture
+  directories aren't listed, as they hold the segments of the recording. """
+  playlist = check_playlist(os.path.join(path, 'playlist.m3u8'))
+  if playlist is not None:
+    return [], playlist
+  try:
+    with os.scandir(path) as entries:
+      return [e.path for e in entries if e.is_dir(follow_symlinks=False)], None
+  except OSError:
+    return [], None
+
+
+def scan_dirs(paths):
+  """ scan_dir for several directories, returning their subdirectories and the checks of their playlists """
+  subdirs, playlists = [], []
+  for path in paths:
+    more, playlist = scan_dir(path)
+    subdirs += more
+    if playlist is not None:
+      playlists.append(playlist)
+  return subdirs, playlists
+
+
+def scan(root, workers=WORKERS):
+  """ Checks of the playlists of every capture directory under root, the directories of each level of the tree
+  being scanned in parallel. Each worker is given a batch of directories at a time, as scanning one takes less
+  time than handing it to a worker. """
+  found = []
+  level = [root]
+  with ThreadPoolExecutor(max_workers=workers) as pool:
+    while level:
+      size = min(max(len(level) // (workers * 4), 1), BATCH)
+      next_level = []
+      for subdirs, playlists in pool.map(scan_dirs, [level[i:i + size] for i in range(0, len(level), size)]):
+        next_level += subdirs
+        found += playlists
+      level = next_level
+  return found
+
+
+def finalize(playlist):
+  """ Append #EXT-X-ENDLIST to a playlist, checking again that it is still missing. Returns True if it was added. """
+  current = check_playlist(playlist['path'])
+  if current is None or current['ended']:
+    return False
+  with open(playlist['path'], 'ab') as f:
+    f.write((b'' if current['newline'] else b'\n') + ENDLIST + b'\n')
+  return True
+
+
+def capture_dir(recording):
+  """ The capture directory of a recording, (its absoluteFile unless it is the playlist), which is only a
+  directory if the recording isn't a single file """
+  path = os.path.normpath(recording['absoluteFile'])
+  return os.path.dirname(path) if os.path.basename(path) == 'playlist.m3u8' else path
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='Append #EXT-X-ENDLIST to the playlists of capture directories that '
+                                               'are missing it, eg. after a crash, and optionally rerun '
+                                               'post-processing for their recordings.')
+  parser.add_argument('root', nargs='?', default='/app/captures', help='directory to scan, default /app/captures')
+  parser.add_argument('--dry-run', action='store_true', help='only list the playlists missing the end tag')
+  parser.add_argument('--min-age', type=float, default=600,
+                      help='seconds since a playlist was last written before it is finalized, default 600')
+  parser.add_argument('--offline', action='store_true',
+                      help="don't ask the server which recordings are in progress, relying on --min-age")
+  parser.add_argument('--workers', type=int, default=WORKERS, help='directories scanned at once')
+  parser.add_argument('--rerun', action='store_true',
+                      help='rerun post-processing for the recordings of the finalized playlists')
+  parser.add_argument('--limit', type=int, default=2,
+                      help='with --rerun, most recordings waiting for or in post-processing at once, see ppsched.py')
+  parser.add_argument('--interval', type=float, default=10.0, help='with --rerun, seconds between polls of the server')
+  parser.add_argument('--checkpoint', default='/app/config/plfinalize.json',
+                      help='with --rerun, file progress is kept in, it can be resumed with ppsched.py --checkpoint')
+  args = parser.parse_args(argv)
+  if args.rerun and args.offline:
+    parser.error('--rerun needs the server, it can not be used with --offline')
+
+  start = time.perf_counter()
+  playlists = scan(os.path.abspath(args.root), args.workers)
+  missing = [p for p in playlists if not p['ended']]
+  print(f"plfinalize.py found {len(playlists)} playlists, {len(missing)} missing the end tag, "
+        f"in {time.perf_counter() - start:.1f}s", flush=True)
+
+  metrics = None
+  recordings = {}
+  if not args.offline:
+    srv_url=os.environ.get('SRVURL')
+    srv_usr=os.environ.get('SRVUSR')
+    srv_pss=os.environ.get('SRVPSS')
+    metrics = RequestMetrics.from_env('plfinalize')
+    ctb = CtbRec(server_url=srv_url, username=srv_usr, password=srv_pss, snapshot=False, metrics=metrics)
+    if missing:
+      try:
+        recordings = {capture_dir(r): r for r in ctb.iter_recordings()}
+      except CtbRecRequestFailed as error:
+        print(f"plfinalize.py can't get the recordings: {error}", flush=True)
+        return 1
+
+  now = time.time()
+  finalized = []
+  for p in missing:
+    folder = os.path.dirname(p['path'])
+    r = recordings.get(folder)
+    if r is not None and r['status'] in ACTIVE:
+      print(f"{folder} - skipped, {r['status']}")
+    elif now - p['mtime'] < args.min_age:
+      print(f"{folder} - skipped, written {now - p['mtime']:.0f}s ago")
+    elif args.dry_run:
+      print(f"{folder} - missing the end tag")
+    elif finalize(p):
+      print(f"{folder} - finalized")
+      finalized.append(folder)
+  if not args.dry_run:
+    print(f"plfinalize.py finalized {len(finalized)} playlists", flush=True)
+
+  failed = False
+  if args.rerun and finalized:
+    keys = [recording_key(recordings[f]) for f in finalized if f in recordings]
+    print(f"plfinalize.py rerunning post-processing for {len(keys)} recordings", flush=True)
+    scheduler = PostProcessScheduler(ctb, keys, args.limit, args.interval, args.checkpoint)
+    scheduler.run()
+    print(f"plfinalize.py post-processed {scheduler.done}, {len(scheduler.failed)} failed, "
+          f"{len(scheduler.missing)} missing", flush=True)
+    failed = bool(scheduler.failed)
+  if metrics:
+    metrics.write()
+  return 1 if failed else 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,233 @@
+#!/bin/python3
+
+from ctbrec import CtbRec, CtbRecRequestFailed, CtbRecUnavailable, RequestMetrics, model_url_key, recording_key
+import argparse
+import json
+import os
+import sys
+import time
+
+
+class PostProcessScheduler:
+  """ Reruns post-processing for a set of recordings without flooding the server. Every `interval`
+  seconds the recordings are polled, and only as many recordings are submitted as keep the number
+  waiting for or in post-processing, (by anyone), under `limit`. A submitted recording is only
+  counted as done or failed once the server has been seen to pick it up, or its status has changed,
+  or `settle` seconds have passed. Progress is written to a checkpoint file after every poll, so a
+  stopped run can be resumed. """
+
+  # statuses of recordings queued for or in post-processing on the server
+  busy = ('POST_PROCESSING', 'WAITING')
+
+  def __init__(self, ctb, keys, limit=2, interval=10.0, checkpoint=None, settle=60.0):
+    self.ctb = ctb
+    self.limit = limit
+    self.interval = interval
+    self.checkpoint = checkpoint
+    self.settle = settle
+    self.pending = list(keys)
+    # recording_key -> when it was submitted, its status then and whether it has been seen busy since
+    self.submitted = {}
+    self.done = 0
+    self.failed = {}
+    self.missing = []
+    self.started = time.time()
+    self.last = {}
+    # throughput is measured from when this process started, not from when the run first started
+    self.session = (time.time(), 0)
+
+  @classmethod
+  def resume(cls, ctb, checkpoint, limit=2, interval=10.0, settle=60.0):
+    """ Scheduler carrying on from a checkpoint file, or None if there isn't one """
+    try:
+      with open(checkpoint) as f:
+        state = json.load(f)
+    except (OSError, ValueError):
+      return None
+    scheduler = cls(ctb, state['pending'], limit, interval, checkpoint, settle)
+    # earlier checkpoints only kept the time each recording was submitted
+    scheduler.submitted = {k: v if isinstance(v, dict) else {'time': v, 'status': None, 'busy': False}
+                           for k, v in state['submitted'].items()}
+    scheduler.done = state['done']
+    scheduler.failed = state['failed']
+    scheduler.missing = state['missing']
+    scheduler.started = state['started']
+    scheduler.session = (time.time(), scheduler.done)
+    return scheduler
+
+  def save(self):
+    """ Write the checkpoint file, replacing the previous one atomically """
+    if not self.checkpoint:
+      return
+    tmp = self.checkpoint + '.tmp'
+    with open(tmp, 'w') as f:
+      json.dump({'started': self.started, 'pending': self.pending, 'submitted': self.submitted, 'done': self.done,
+                 'failed': self.failed, 'missing': self.missing, 'last': self.last}, f)
+    os.replace(tmp, self.checkpoint)
+
+  def finished(self):
+    return not self.pending and not self.submitted
+
+  def poll(self):
+    """ Count the recordings queued for or in post-processing by anyone, and get the statuses of the
+    submitted recordings and the pending recordings, which may be submitted. The server can't be asked
+    for single recordings, so the list is streamed and only the recordings being scheduled are kept. """
+    pending = set(self.pending)
+    depth = 0
+    statuses = {}
+    current = {}
+    for r in self.ctb.iter_recordings():
+      status = r['status']
+      if status in self.busy:
+        depth += 1
+      key = recording_key(r)
+      if key in self.submitted:
+        statuses[key] = status
+      elif key in pending:
+        current[key] = r
+    return depth, statuses, current
+
+  def settled(self, job, status):
+    """ Whether the status of a submitted recording that isn't busy is its outcome, rather than the status
+    it had before the server picked up the rerun """
+    return job['busy'] or status != job['status'] or time.time() - job['time'] >= self.settle
+
+  def track(self, key, status):
+    """ Note a recording as submitted, with its status now """
+    self.submitted[key] = {'time': time.time(), 'status': status, 'busy': status in self.busy}
+
+  def step(self):
+    """ Poll the server once, note the recordings that finished post-processing and submit as many
+    as fit under the limit. Returns a progress report. """
+    start = time.perf_counter()
+    depth, statuses, current = self.poll()
+    finished = 0
+    for key, job in list(self.submitted.items()):
+      status = statuses.get(key)
+      if status is None:
+        self.missing.append(key)
+      elif status in self.busy:
+        job['busy'] = True
+        continue
+      elif not self.settled(job, status):
+        continue
+      elif status == 'FAILED':
+        self.failed[key] = 'Post-processing failed'
+      else:
+        self.done += 1
+        finished += 1
+      del self.submitted[key]
+
+    slots = max(self.limit - depth, 0)
+    pending = []
+    submitted = 0
+    for key in self.pending:
+      r = current.get(key)
+      if r is None:
+        self.missing.append(key)
+      elif r['status'] in self.busy:
+        # already being post-processed, wait for it like the ones submitted here
+        self.track(key, r['status'])
+      elif not slots or r['status'] == 'RECORDING':
+        pending.append(key)
+      else:
+        try:
+          self.ctb.rerun_post_process(r)
+          self.track(key, r['status'])
+          submitted += 1
+          slots -= 1
+        except CtbRecUnavailable:
+          pending.append(key)
+        except CtbRecRequestFailed as error:
+          self.failed[key] = str(error)
+    self.pending = pending
+
+    elapsed = time.time() - self.session[0]
+    rate = (self.done - self.session[1]) / elapsed * 3600 if elapsed > 0 else 0.0
+    remaining = len(self.pending) + len(self.submitted)
+    self.last = {'time': time.time(), 'depth': depth + submitted, 'limit': self.limit, 'submitted': submitted,
+                 'finished': finished, 'in_progress': len(self.submitted), 'pending': len(self.pending),
+                 'done': self.done, 'failed': len(self.failed), 'missing': len(self.missing),
+                 'per_hour': round(rate, 1), 'eta': round(remaining / rate * 3600) if rate else None,
+                 'poll': round(time.perf_counter() - start, 3)}
+    self.save()
+    return self.last
+
+  def run(self):
+    while not self.finished():
+      try:
+        report = self.step()
+        eta = '-' if report['eta'] is None else f"{report['eta'] // 60}m"
+        print(f"ppsched.py queue {report['depth']}/{report['limit']}, submitted {report['submitted']}, "
+              f"in progress {report['in_progress']}, pending {report['pending']}, done {report['done']}, "
+              f"failed {report['failed']}, missing {report['missing']}, {report['per_hour']}/h, eta {eta}",
+              flush=True)
+      except CtbRecRequestFailed as error:
+        print(f"ppsched.py error: {error}", flush=True)
+      if not self.finished():
+        time.sleep(self.interval)
+
+
+def select(ctb, statuses, models, ids):
+  """ Keys of the recordings to post-process, oldest first: those with one of `statuses`, of one of `models`,
+  (url or Site:Name), and with a key in `ids`. Empty or None arguments don't restrict the selection. """
+  wanted = {model_url_key(m) if '://' in m else m for m in models}
+  recordings = []
+  for r in ctb.iter_recordings():
+    if ids and recording_key(r) not in ids:
+      continue
+    if statuses and r['status'] not in statuses:
+      continue
+    if wanted and ctb.model_id(r['model']) not in wanted and model_url_key(r['model']['url']) not in wanted:
+      continue
+    recordings.append((r['startDate'], recording_key(r)))
+  return [key for _, key in sorted(recordings)]
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='Rerun post-processing for many recordings, keeping the number of '
+                                               'recordings post-processing on the server under a limit.')
+  parser.add_argument('--limit', type=int, default=2,
+                      help='most recordings waiting for or in post-processing on the server at once')
+  parser.add_argument('--interval', type=float, default=10.0, help='seconds between polls of the server')
+  parser.add_argument('--status', nargs='*',
+                      help='statuses of the recordings to post-process, default FAILED unless --model or --ids '
+                           'are given')
+  parser.add_argument('--model', nargs='*', default=[], help='only recordings of these models, url or Site:Name')
+  parser.add_argument('--ids', help='file of recording ids to post-process, one per line')
+  parser.add_argument('--checkpoint', default='/app/config/ppsched.json',
+                      help='file progress is kept in, so a run can be resumed')
+  parser.add_argument('--restart', action='store_true', help='select the recordings again, ignoring the checkpoint')
+  args = parser.parse_args(argv)
+
+  srv_url=os.environ.get('SRVURL')
+  srv_usr=os.environ.get('SRVUSR')
+  srv_pss=os.environ.get('SRVPSS')
+  metrics = RequestMetrics.from_env('ppsched')
+  ctb = CtbRec(server_url=srv_url, username=srv_usr, password=srv_pss, snapshot=False, metrics=metrics)
+
+  scheduler = None
+  if not args.restart:
+    scheduler = PostProcessScheduler.resume(ctb, args.checkpoint, args.limit, args.interval)
+  if scheduler is None:
+    ids = None
+    if args.ids:
+      with open(args.ids) as f:
+        ids = {line.strip() for line in f if line.strip()}
+    statuses = set(args.status) if args.status is not None else set() if args.model or ids else {'FAILED'}
+    keys = select(ctb, statuses, args.model, ids)
+    scheduler = PostProcessScheduler(ctb, keys, args.limit, args.interval, args.checkpoint)
+    print(f"ppsched.py selected {len(keys)} recordings", flush=True)
+  else:
+    print(f"ppsched.py resuming: {len(scheduler.pending)} pending, {len(scheduler.submitted)} in progress",
+          flush=True)
+  scheduler.run()
+  print(f"ppsched.py finished: {scheduler.done} done, {len(scheduler.failed)} failed, "
+        f"{len(scheduler.missing)} missing", flush=True)
+  if metrics:
+    metrics.write()
+  return 1 if scheduler.failed else 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
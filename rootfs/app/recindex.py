@@ -0,0 +1,92 @@
+#!/bin/python3
+
+from ctbrec import CtbRec, RequestMetrics
+from recmeta import RecordingIndex, format_duration, update_recording_index
+from datetime import datetime
+import argparse
+import json
+import os
+import sys
+
+
+def timestamp(text):
+  """ A date, (YYYY-MM-DD or YYYY-MM-DD HH:MM), as milliseconds since the epoch """
+  for fmt in ('%Y-%m-%d %H:%M', '%Y-%m-%d'):
+    try:
+      return int(datetime.strptime(text, fmt).timestamp() * 1000)
+    except ValueError:
+      pass
+  raise argparse.ArgumentTypeError(f"invalid date '{text}', use YYYY-MM-DD or 'YYYY-MM-DD HH:MM'")
+
+
+def update(index, args):
+  srv_url=os.environ.get('SRVURL')
+  srv_usr=os.environ.get('SRVUSR')
+  srv_pss=os.environ.get('SRVPSS')
+  metrics = RequestMetrics.from_env('recindex')
+  ctb = CtbRec(server_url=srv_url, username=srv_usr, password=srv_pss, snapshot=False, metrics=metrics)
+  changes = update_recording_index(ctb, index, probe=not args.no_probe, max_workers=args.workers)
+  print(f"Index updated: {changes['added']} added, {changes['removed']} removed, {changes['changed']} changed, "
+        f"{changes['examined']} files examined")
+  if metrics:
+    metrics.write()
+  return 0
+
+
+def query(index, args):
+  found = index.query(model=args.model, site=args.site, status=args.status, since=args.since, until=args.until,
+                      text=args.text, min_duration=args.min_duration, limit=args.limit)
+  if args.json:
+    print(json.dumps(found, indent=2))
+    return 0
+  for r in found:
+    start = datetime.fromtimestamp(r['start'] / 1000).strftime('%Y-%m-%d %H:%M')
+    print(f"{start}  {r['model']:<40} {r['status']:<15} {r['size']/1e9:>8.3f} GB "
+          f"{format_duration(r['duration']) or '-':>9}  {r['file']}")
+  print(f"{len(found)} recordings", file=sys.stderr)
+  return 0
+
+
+def duration(index, args):
+  seconds = index.duration(args.file, probe=not args.no_probe)
+  if seconds is None:
+    print(f"Duration of {args.file} isn't known", file=sys.stderr)
+    return 1
+  print(format_duration(seconds))
+  return 0
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='Keep a local index of recording metadata, (durations, sizes, notes and '
+                                               'contact sheets), and query it.')
+  parser.add_argument('--index', default=os.environ.get('RECORDING_INDEX', '/app/config/recindex.db'),
+                      help='SQLite file of the index, default is RECORDING_INDEX or /app/config/recindex.db')
+  commands = parser.add_subparsers(dest='command')
+  parser_update = commands.add_parser('update', help='update the index with the recordings added or changed on the '
+                                                     'server, (the default)')
+  parser_update.add_argument('--no-probe', action='store_true', help="don't probe the durations of the recordings")
+  parser_update.add_argument('--workers', type=int, default=4, help='most ffmpeg probes run at once')
+  parser_query = commands.add_parser('query', help='list the recordings in the index')
+  parser_query.add_argument('--model', help='only recordings of this model, as Site:ModelName')
+  parser_query.add_argument('--site', help='only recordings of this site')
+  parser_query.add_argument('--status', help='only recordings with this status, eg. FINISHED')
+  parser_query.add_argument('--since', type=timestamp, help='only recordings started on or after this date')
+  parser_query.add_argument('--until', type=timestamp, help='only recordings started on or before this date')
+  parser_query.add_argument('--text', help='only recordings with this text in their note or notes file')
+  parser_query.add_argument('--min-duration', type=float, help='only recordings at least this many seconds long')
+  parser_query.add_argument('--limit', type=int, help='most recordings to list')
+  parser_query.add_argument('--json', action='store_true', help='print the recordings as json')
+  parser_duration = commands.add_parser('duration', help='print the duration of a recording, probing it only if the '
+                                                         'index does not have it')
+  parser_duration.add_argument('file', help='${absolutePath} of the recording')
+  parser_duration.add_argument('--no-probe', action='store_true', help="don't probe the recording")
+  args = parser.parse_args(argv)
+  if args.command is None:
+    args = parser.parse_args((sys.argv[1:] if argv is None else list(argv)) + ['update'])
+
+  with RecordingIndex(args.index) as index:
+    return {'update': update, 'query': query, 'duration': duration}[args.command](index, args)
+
+
+if __name__ == '__main__':
+  sys.exit(main())
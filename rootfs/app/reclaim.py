@@ -1,30 +1,60 @@
 #!/bin/python3
- 
-from ctbrec import CtbRec
+
+from ctbrec import CtbRec, RequestMetrics
+import argparse
 import os
-import time
-
-srv_url=os.environ.get('SRVURL')
-srv_usr=os.environ.get('SRVUSR')
-srv_pss=os.environ.get('SRVPSS')
-recover=int(os.environ.get('RECOVER'))
-
-# Create CTBRec Python client instance
-ctb = CtbRec(server_url=srv_url, username=srv_usr, password=srv_pss)
-
-# Get disk space
-space=ctb.get_space()
-minspace=(space['spaceFree'] + recover)
-print('reclaim.py\nFree:     ' + space['spaceFree'] + '\nRequired: ' + minspace)
-
-# Get recordings
-recordings = ctb.get_recordings()
-if recordings:
-  index = 0
-  for record in recordings:  
-    if not record['pinned'] and (record['status'] == 'FINISHED'):
-      if ((ctb.get_space())['spaceFree'] < minspace):
-        ctb.delete_recording(recordings[index])
-        print(record['metaDataFile'] + " - Deleted")
-        time.sleep(2)
-    index += 1
+
+
+def plan_reclaim(recordings, required):
+  """ Pick the oldest non-pinned FINISHED recordings whose sizes add up to at least `required` bytes.
+  Returns the list of recordings to delete, oldest first, and the number of bytes they free. """
+  candidates = sorted((r for r in recordings if not r['pinned'] and r['status'] == 'FINISHED'),
+                      key=lambda r: r['startDate'])
+  plan = []
+  freed = 0
+  for record in candidates:
+    if freed >= required:
+      break
+    plan.append(record)
+    freed += record.get('sizeInByte', 0)
+  return plan, freed
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='Delete the oldest non-pinned recordings until RECOVER bytes are freed.')
+  parser.add_argument('--dry-run', action='store_true', help='print the deletion plan without deleting anything')
+  args = parser.parse_args(argv)
+
+  srv_url=os.environ.get('SRVURL')
+  srv_usr=os.environ.get('SRVUSR')
+  srv_pss=os.environ.get('SRVPSS')
+  recover=int(os.environ.get('RECOVER'))
+
+  # Create CTBRec Python client instance
+  metrics = RequestMetrics.from_env('reclaim')
+  ctb = CtbRec(server_url=srv_url, username=srv_usr, password=srv_pss, snapshot=False, metrics=metrics)
+
+  # Get disk space and recordings once, then work out what to delete
+  space = ctb.get_space()
+  minspace = space['spaceFree'] + recover
+  print(f"reclaim.py\nFree:      {space['spaceFree']}\nRequired:  {minspace}")
+  plan, freed = plan_reclaim(ctb.get_recordings(), recover)
+  print(f"Planned:   {len(plan)} recordings, {freed} bytes\nProjected: {space['spaceFree'] + freed}")
+  if freed < recover:
+    print('Not enough non-pinned finished recordings to recover the required space')
+
+  for record in plan:
+    if args.dry_run:
+      print(record['metaDataFile'] + " - " + str(record.get('sizeInByte', 0)) + " bytes - Would delete")
+    else:
+      ctb.delete_recording(record)
+      print(record['metaDataFile'] + " - Deleted")
+
+  if plan and not args.dry_run:
+    print(f"Free:      {ctb.get_space()['spaceFree']}")
+  if metrics:
+    metrics.write()
+
+
+if __name__ == '__main__':
+  main()
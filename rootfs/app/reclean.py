@@ -1,22 +1,102 @@
 #!/bin/python3
+import argparse
 import os
-from ctbrec import CtbRec
-
-srv_url=os.environ.get('SRVURL')
-srv_usr=os.environ.get('SRVUSR')
-srv_pss=os.environ.get('SRVPSS')
-# create CtbRec python client instance
-ctb = CtbRec(server_url=srv_url, username=srv_usr, password=srv_pss)
-
-# get recordings
-recordings = ctb.get_recordings()
-if recordings:
-  print("Number of recordings:", len(recordings))
-  index = 0
+import time
+from collections import defaultdict
+from ctbrec import CtbRec, RequestMetrics
+
+BATCH = 5000
+
+
+def list_dir(path):
+  """ Names of the entries in a directory, an empty set if the directory doesn't exist,
+  or None if it couldn't be listed """
+  try:
+    with os.scandir(path) as entries:
+      return {entry.name for entry in entries}
+  except (FileNotFoundError, NotADirectoryError):
+    return set()
+  except OSError:
+    return None
+
+
+def existing_files(paths, listings=None):
+  """ Get the subset of paths that exist, listing each parent directory once and checking
+  files individually only where a directory couldn't be listed. Directory listings are
+  kept in `listings`, if given, so later calls don't list the same directory again. """
+  listings = {} if listings is None else listings
+  by_dir = defaultdict(list)
+  for path in paths:
+    by_dir[os.path.dirname(os.path.normpath(path))].append(path)
+  found = set()
+  for folder, files in by_dir.items():
+    if folder not in listings:
+      listings[folder] = list_dir(folder)
+    names = listings[folder]
+    if names is None:
+      found.update(f for f in files if os.path.exists(f))
+    else:
+      found.update(f for f in files if os.path.basename(os.path.normpath(f)) in names)
+  return found
+
+
+def batches(recordings, size=BATCH):
+  """ Split an iterable of recordings into lists of at most `size` recordings """
+  batch = []
   for record in recordings:
-    if not os.path.exists(record['absoluteFile']):
-      print(record['absoluteFile'] + " - " + record['status'])
-      if record['status'] == 'FINISHED':
-        ctb.delete_recording(recordings[index])
-        print(record['metaDataFile'] + " - Deleted")
-    index += 1
+    batch.append(record)
+    if len(batch) == size:
+      yield batch
+      batch = []
+  if batch:
+    yield batch
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='Delete finished recordings whose media file no longer exists.')
+  parser.add_argument('--stream', action='store_true',
+                      help=f'parse the recordings from the server in batches of {BATCH} to limit memory use')
+  args = parser.parse_args(argv)
+
+  srv_url=os.environ.get('SRVURL')
+  srv_usr=os.environ.get('SRVUSR')
+  srv_pss=os.environ.get('SRVPSS')
+  # create CtbRec python client instance
+  metrics = RequestMetrics.from_env('reclean')
+  ctb = CtbRec(server_url=srv_url, username=srv_usr, password=srv_pss, snapshot=False, metrics=metrics)
+
+  # get recordings, either all at once or in batches as they are parsed
+  timings = {'Fetch': 0.0, 'Verify': 0.0, 'Delete': 0.0}
+  start = time.perf_counter()
+  recordings = batches(ctb.iter_recordings()) if args.stream else [ctb.get_recordings()]
+  listings = {}
+  total = 0
+  deleted = 0
+  for batch in recordings:
+    fetched = time.perf_counter()
+    timings['Fetch'] += fetched - start
+    total += len(batch)
+
+    # check which media files still exist
+    found = existing_files({record['absoluteFile'] for record in batch}, listings=listings)
+    verified = time.perf_counter()
+    timings['Verify'] += verified - fetched
+
+    for record in batch:
+      if record['absoluteFile'] not in found:
+        print(record['absoluteFile'] + " - " + record['status'])
+        if record['status'] == 'FINISHED':
+          ctb.delete_recording(record)
+          print(record['metaDataFile'] + " - Deleted")
+          deleted += 1
+    start = time.perf_counter()
+    timings['Delete'] += start - verified
+  if total:
+    print("Number of recordings:", total)
+    print(f"Fetch: {timings['Fetch']:.3f}s  Verify: {timings['Verify']:.3f}s  Delete ({deleted}): {timings['Delete']:.3f}s")
+  if metrics:
+    metrics.write()
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,319 @@
+""" Local SQLite index of recording metadata, (durations, sizes, notes and contact sheets), used by recindex.py
+and by notifications to read durations without probing the media again
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Iterable, Optional
+import os
+import re
+import sqlite3
+import subprocess
+import threading
+import time
+
+from ctbrec import CtbRec, Model, model_site, recording_key
+
+
+def probe_duration(file: str, ffmpeg: Optional[str] = None) -> Optional[float]:
+    """
+    Duration of a media file in seconds, from a single ffmpeg probe
+
+    Args:
+        file: the media file, or playlist of a recording that isn't a single file
+        ffmpeg: the ffmpeg binary, default is FFMPEG or /app/ffmpeg/ffmpeg
+    Returns:
+        the duration, or None if ffmpeg couldn't read one
+    """
+    try:
+        proc = subprocess.run([ffmpeg or os.environ.get('FFMPEG', '/app/ffmpeg/ffmpeg'), '-hide_banner', '-i', file],
+                              stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=60)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    match = re.search(rb'Duration: (\d+):(\d\d):(\d\d(?:\.\d+)?)', proc.stderr)
+    if not match:
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def format_duration(seconds: Optional[float]) -> str:
+    """ A duration as hh:mm:ss, (whole seconds as the send2*.sh scripts printed them), or '' if it isn't known """
+    if seconds is None:
+        return ''
+    seconds = int(seconds)
+    return f'{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}'
+
+
+class RecordingIndex:
+    """
+    SQLite index of recording metadata, kept on disk between runs. Along with the fields of each recording on the
+    server it keeps the duration of the media file, from a single ffmpeg probe, and the contact sheet and notes,
+    (written by note2txt.sh), found next to it. Updates only look at the recordings that were added or changed
+    since the last one, and media files are only probed again if their size or modification time changed, so
+    scripts and notifications can read durations and notes from the index instead of probing the media.
+
+    The index can be used by several processes at once, and by several threads of one process.
+    """
+    # recordings whose files may still change, so they aren't probed yet
+    unsettled = ('RECORDING', 'GENERATING_PLAYLIST', 'POST_PROCESSING', 'WAITING')
+    columns = ('key', 'model', 'site', 'start', 'status', 'pinned', 'size', 'file', 'note', 'duration', 'sheet',
+               'notes')
+    # the PRAGMA user_version of a file with the current schema, to be raised along with any change to it
+    schema_version = 1
+    schema = """
+        CREATE TABLE IF NOT EXISTS recordings (
+            key TEXT PRIMARY KEY, model TEXT NOT NULL, site TEXT NOT NULL, start INTEGER, status TEXT,
+            pinned INTEGER, size INTEGER, file TEXT, note TEXT);
+        CREATE INDEX IF NOT EXISTS recordings_model ON recordings (model, start);
+        CREATE INDEX IF NOT EXISTS recordings_site ON recordings (site, start);
+        CREATE INDEX IF NOT EXISTS recordings_start ON recordings (start);
+        CREATE INDEX IF NOT EXISTS recordings_file ON recordings (file);
+        CREATE TABLE IF NOT EXISTS files (
+            path TEXT PRIMARY KEY, size INTEGER, mtime REAL, duration REAL, probed INTEGER, sheet TEXT, notes TEXT);
+        CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value);
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: the SQLite database file, created if it doesn't exist
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        # the journal mode is kept in the file, so it and the schema are only set up once
+        if self.db.execute('PRAGMA user_version').fetchone()[0] < self.schema_version:
+            with self.lock, self.db:
+                # readers don't wait for an update being written
+                self.db.execute('PRAGMA journal_mode=WAL')
+                self.db.executescript(self.schema)
+                self.db.execute(f'PRAGMA user_version = {self.schema_version}')
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def __enter__(self) -> 'RecordingIndex':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def updated(self) -> Optional[float]:
+        """ When the index was last updated from the server, None if it never has been """
+        with self.lock:
+            row = self.db.execute("SELECT value FROM meta WHERE name = 'updated'").fetchone()
+        return row[0] if row else None
+
+    def age(self) -> float:
+        """ Seconds since the index was updated, infinite if it never has been """
+        updated = self.updated
+        return float('inf') if updated is None else time.time() - updated
+
+    @staticmethod
+    def row(recording: dict) -> tuple:
+        """ The fields of a recording kept by the index, in the order of the recordings table """
+        model = recording['model']
+        model_id = model.id if isinstance(model, Model) else model_site(model['type']) + ':' + model['name']
+        return (recording_key(recording), model_id, model_id.split(':', 1)[0], recording['startDate'],
+                recording['status'], int(bool(recording['pinned'])), recording.get('sizeInByte', 0),
+                recording.get('absoluteFile'), recording.get('note') or None)
+
+    @staticmethod
+    def media(file: str) -> str:
+        """ The file to probe for a recording, its playlist if it isn't a single file """
+        return os.path.join(file, 'playlist.m3u8') if os.path.isdir(file) else file
+
+    @staticmethod
+    def examine(path: str, probe: bool = True, ffmpeg: Optional[str] = None) -> Optional[tuple]:
+        """
+        Read the metadata of a recording's file from the file system
+
+        Args:
+            path: the recording's absoluteFile
+            probe: probe the duration with ffmpeg
+            ffmpeg: the ffmpeg binary, see probe_duration
+        Returns:
+            a row of the files table, or None if the file doesn't exist
+        """
+        try:
+            stat = os.stat(RecordingIndex.media(path))
+        except OSError:
+            return None
+        base = os.path.splitext(path)[0]
+        sheet = base + '.jpg' if os.path.isfile(base + '.jpg') else None
+        try:
+            with open(base + '.txt', encoding='utf-8', errors='replace') as f:
+                notes = f.read()
+        except OSError:
+            notes = None
+        duration = probe_duration(RecordingIndex.media(path), ffmpeg) if probe else None
+        return path, stat.st_size, stat.st_mtime, duration, int(probe), sheet, notes
+
+    def update(self, recordings: Iterable[dict], probe: bool = True, max_workers: int = 4) -> dict:
+        """
+        Bring the index up to date with the full recording list, in a single pass so that the recordings can be
+        streamed from the server with CtbRec.iter_recordings(). The files of recordings that were added or changed,
+        or haven't been examined yet, are examined when they are no longer being recorded or post-processed.
+
+        Args:
+            recordings: every recording on the server
+            probe: probe the duration of the files examined, otherwise only their sheets and notes are read
+            max_workers: most ffmpeg probes run at once
+        Returns:
+            dict with the number of recordings 'added', 'removed' and 'changed' and of files 'examined'
+        """
+        with self.lock:
+            previous = {r[0]: r for r in self.db.execute('SELECT * FROM recordings')}
+            files = {r[0]: r[1:] for r in self.db.execute('SELECT path, size, mtime, probed FROM files')}
+        rows, seen, candidates = [], set(), []
+        added = changed = 0
+        for r in recordings:
+            row = self.row(r)
+            seen.add(row[0])
+            old = previous.get(row[0])
+            if old != row:
+                rows.append(row)
+                if old is None:
+                    added += 1
+                else:
+                    changed += 1
+            if row[7] and row[4] not in self.unsettled:
+                known = files.get(row[7])
+                # files examined by an update that didn't probe are probed by the next one that does
+                if old != row or known is None or (probe and not known[2]):
+                    candidates.append(row[7])
+        removed = [(k, r[7]) for k, r in previous.items() if k not in seen]
+
+        # the files are only examined again if they changed since they last were, or still need probing
+        def needs_examining(path):
+            try:
+                stat = os.stat(self.media(path))
+            except OSError:
+                return False
+            known = files.get(path)
+            return known is None or known[:2] != (stat.st_size, stat.st_mtime) or (probe and not known[2])
+
+        candidates = [p for p in dict.fromkeys(candidates) if needs_examining(p)]
+        with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as pool:
+            examined = [f for f in pool.map(partial(self.examine, probe=probe), candidates) if f is not None]
+
+        with self.lock, self.db:
+            self.db.executemany('INSERT OR REPLACE INTO recordings VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            self.db.executemany('DELETE FROM recordings WHERE key = ?', [(k,) for k, _ in removed])
+            self.db.executemany('DELETE FROM files WHERE path = ? AND NOT EXISTS '
+                                '(SELECT 1 FROM recordings WHERE file = files.path)', [(f,) for _, f in removed])
+            self.db.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)', examined)
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('updated', ?)", (time.time(),))
+        return {'added': added, 'removed': len(removed), 'changed': changed, 'examined': len(examined)}
+
+    def duration(self, file: str, probe: bool = True) -> Optional[float]:
+        """
+        Duration of a recording's file in seconds, from the index if the file hasn't changed since it was probed
+
+        Args:
+            file: the recording's absoluteFile
+            probe: probe the file if the index doesn't have its duration, and keep the result
+        Returns:
+            the duration, or None if it isn't known
+        """
+        try:
+            stat = os.stat(self.media(file))
+        except OSError:
+            return None
+        with self.lock:
+            row = self.db.execute('SELECT size, mtime, probed, duration FROM files WHERE path = ?', (file,)).fetchone()
+        if row and row[:2] == (stat.st_size, stat.st_mtime) and (row[2] or not probe):
+            return row[3]
+        if not probe:
+            return None
+        examined = self.examine(file)
+        if examined is None:
+            return None
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)', examined)
+        return examined[3]
+
+    def select(self, where: str = '', params: tuple = (), limit: Optional[int] = None) -> list[dict]:
+        """ Recordings joined with the metadata of their files, as dicts with the keys in `columns` """
+        sql = ('SELECT r.key, r.model, r.site, r.start, r.status, r.pinned, r.size, r.file, r.note, f.duration, '
+               f'f.sheet, f.notes FROM recordings r LEFT JOIN files f ON f.path = r.file {where} ORDER BY r.start')
+        if limit:
+            sql += f' LIMIT {int(limit)}'
+        with self.lock:
+            return [dict(zip(self.columns, row)) for row in self.db.execute(sql, params)]
+
+    def get(self, key: str) -> Optional[dict]:
+        """ A recording by its recording_key, None if it isn't in the index """
+        found = self.select('WHERE r.key = ?', (key,))
+        return found[0] if found else None
+
+    def find(self, file: str) -> Optional[dict]:
+        """ The recording of a file, (its absoluteFile), None if it isn't in the index """
+        found = self.select('WHERE r.file = ?', (file,))
+        return found[0] if found else None
+
+    def query(self, model: Optional[str] = None, site: Optional[str] = None, status: Optional[str] = None,
+              since: Optional[int] = None, until: Optional[int] = None, text: Optional[str] = None,
+              min_duration: Optional[float] = None, limit: Optional[int] = None) -> list[dict]:
+        """
+        Recordings matching all of the conditions given, oldest first
+
+        Args:
+            model: Site:ModelName
+            site: site name
+            status: recording status, eg. FINISHED
+            since: earliest start date, in milliseconds since the epoch
+            until: latest start date, in milliseconds since the epoch
+            text: text found in the recording's note or notes file, ignoring case
+            min_duration: shortest duration in seconds, excluding recordings whose duration isn't known
+            limit: most recordings returned
+        Returns:
+            list of dicts with the keys in `columns`
+        """
+        conditions, params = [], []
+        for column, value in (('r.model', model), ('r.site', site), ('r.status', status)):
+            if value is not None:
+                conditions.append(f'{column} = ?')
+                params.append(value)
+        if since is not None:
+            conditions.append('r.start >= ?')
+            params.append(since)
+        if until is not None:
+            conditions.append('r.start <= ?')
+            params.append(until)
+        if text:
+            conditions.append("(r.note LIKE ? ESCAPE '\\' OR f.notes LIKE ? ESCAPE '\\')")
+            pattern = '%' + re.sub(r'([%_\\])', r'\\\1', text) + '%'
+            params += [pattern, pattern]
+        if min_duration is not None:
+            conditions.append('f.duration >= ?')
+            params.append(min_duration)
+        return self.select('WHERE ' + ' AND '.join(conditions) if conditions else '', tuple(params), limit)
+
+
+def update_recording_index(ctb: CtbRec, index: RecordingIndex, max_age: Optional[float] = None, probe: bool = True,
+                           max_workers: int = 4) -> dict:
+    """
+    Bring a recording metadata index up to date with the recordings on the server, probing the files of the
+    recordings added or changed since the last update. The recordings are streamed from the server unless the
+    cached recording list of the client is recent enough to be used.
+
+    Args:
+        ctb: the client to get the recordings with
+        index: the RecordingIndex to update
+        max_age: use the cached recording list if it is no older than this many seconds. Default is the client's
+                 recordings_max_age.
+        probe: probe the durations of the files with ffmpeg
+        max_workers: most ffmpeg probes run at once
+    Returns:
+        dict with the number of recordings 'added', 'removed' and 'changed' and of files 'examined', see
+        RecordingIndex.update
+    Raises:
+        CtbRecRequestFailed
+    """
+    max_age = ctb.recordings_max_age if max_age is None else max_age
+    recordings = ctb.get_recordings(max_age) if ctb.recording_cache.age() <= max_age else ctb.iter_recordings()
+    return index.update(recordings, probe, max_workers)
@@ -0,0 +1,88 @@
+#!/bin/python3
+
+from ctbrec import CtbRec, RequestMetrics
+from datetime import datetime
+import argparse
+import json
+import os
+import sys
+
+
+def load_desired(path):
+  """ Read a desired state file, either a list of models or a dict with 'models' and optionally 'groups' and
+  'remove_missing'. recordUntil can be given as an ISO date/time string. """
+  with open(path) as f:
+    desired = json.load(f)
+  if isinstance(desired, list):
+    desired = {'models': desired}
+  for item in desired.get('models', []):
+    if isinstance(item, dict) and isinstance(item.get('recordUntil'), str):
+      item['recordUntil'] = datetime.fromisoformat(item['recordUntil'])
+  return desired
+
+
+def describe(entry):
+  """ One line description of a plan entry """
+  model = entry['model'] if isinstance(entry['model'], str) else entry['model'].get('url', entry['model'])
+  if entry['action'] == 'add':
+    props = ' '.join(f'{k}={v}' for k, v in entry['props'].items())
+    return f"+ {model} {props}".rstrip()
+  if entry['action'] == 'update':
+    changes = ', '.join(f'{k}: {old} -> {new}' for k, (old, new) in entry['changes'].items())
+    return f"~ {model} {changes}"
+  if entry['action'] == 'remove':
+    return f"- {model}"
+  return f"! {model} {entry['action']}: {entry['reason']}"
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='Make the models and model groups on the server match a desired '
+                                               'state file. Prints the plan unless --apply is given.')
+  parser.add_argument('file', help='json file of the desired models, and optionally model groups')
+  parser.add_argument('--apply', action='store_true', help='make the changes, rather than only printing them')
+  parser.add_argument('--remove-missing', action='store_true', default=None,
+                      help='remove models, and groups, that are not in the file')
+  parser.add_argument('--workers', type=int, default=8, help='maximum number of concurrent requests')
+  args = parser.parse_args(argv)
+  desired = load_desired(args.file)
+  remove_missing = desired.get('remove_missing', False) if args.remove_missing is None else args.remove_missing
+
+  srv_url=os.environ.get('SRVURL')
+  srv_usr=os.environ.get('SRVUSR')
+  srv_pss=os.environ.get('SRVPSS')
+  metrics = RequestMetrics.from_env('reconcile')
+  ctb = CtbRec(server_url=srv_url, username=srv_usr, password=srv_pss, snapshot=False, metrics=metrics)
+
+  failed = 0
+  if 'models' in desired:
+    plan = ctb.plan_models(desired['models'], remove_missing=remove_missing)
+    changes = [e for e in plan if e['action'] != 'unchanged']
+    for entry in changes:
+      print(describe(entry))
+    counts = {a: sum(e['action'] == a for e in plan) for a in ('add', 'update', 'remove', 'unchanged')}
+    print(f"Models: {counts['add']} to add, {counts['update']} to update, {counts['remove']} to remove, "
+          f"{counts['unchanged']} unchanged")
+    if args.apply:
+      results = ctb.apply_model_plan(plan, max_workers=args.workers)
+      for r in results:
+        if r['result'] != 'ok':
+          failed += 1
+          print(f"{describe(r)} - {r['result']}: {r['reason']}")
+      print(f"Models: {len(results) - failed} changed, {failed} failed")
+
+  if 'groups' in desired:
+    report = ctb.sync_model_groups(desired['groups'], delete_missing=remove_missing, dry_run=not args.apply,
+                                   max_workers=args.workers)
+    for r in report:
+      if r['action'] != 'unchanged':
+        print(f"Group {r['name']} {r['action']}: +{len(r['added'])} -{len(r['removed'])}"
+              + (f" - failed: {r['reason']}" if r['result'] == 'failed' else ''))
+    failed += sum(r['result'] == 'failed' for r in report)
+
+  if metrics:
+    metrics.write()
+  return 1 if failed else 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
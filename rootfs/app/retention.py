@@ -0,0 +1,207 @@
+#!/bin/python3
+
+from ctbrec import CtbRec, CtbRecRequestFailed, RequestMetrics, model_url_key, recording_key
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import json
+import os
+import sys
+import time
+
+# rule keys selecting recordings, and limits applied to them
+SELECTORS = ('group', 'site', 'model', 'unlisted')
+LIMITS = ('keep_last', 'max_age_days', 'max_bytes')
+
+
+def parse_rule(rule, number):
+  """ Check a retention rule and turn its selectors into sets, (None to match any), for plan_retention. `number` is
+  the position of the rule, used to name it if it has no 'name'. Raises ValueError if the rule has unknown keys or
+  no limits. """
+  def values(key):
+    v = rule.get(key)
+    return None if v is None else [v] if isinstance(v, str) else list(v)
+
+  unknown = set(rule) - set(SELECTORS + LIMITS + ('name', 'per'))
+  if unknown:
+    raise ValueError(f"Unknown retention rule keys {', '.join(sorted(unknown))}")
+  if not any(rule.get(k) is not None for k in LIMITS):
+    raise ValueError(f"Retention rule {rule.get('name', number)} has none of {', '.join(LIMITS)}")
+  if rule.get('per', 'model') not in ('model', 'rule'):
+    raise ValueError(f"Retention rule 'per' must be 'model' or 'rule', not {rule['per']}")
+  groups, sites, models = values('group'), values('site'), values('model')
+  return {'name': rule.get('name', f'rule {number}'),
+          'groups': None if groups is None else set(groups),
+          'sites': None if sites is None else {s.lower() for s in sites},
+          'models': None if models is None else {model_url_key(m) if CtbRec.regex['url'].match(m) else m
+                                                 for m in models},
+          'unlisted': rule.get('unlisted'), 'per_model': rule.get('per', 'model') == 'model',
+          **{k: rule.get(k) for k in LIMITS}}
+
+
+def plan_retention(ctb, rules, now=None):
+  """
+  Work out which recordings to delete to satisfy a list of retention rules, from a single fetch of the recordings,
+  models and model groups. Pinned recordings and recordings that aren't FINISHED are never deleted, but still count
+  towards keep_last and max_bytes.
+
+  Each rule selects recordings with any of
+    'group': model group name, or list of names
+    'site': site code, eg. 'Chaturbate', or list of codes
+    'model': model url or Site:Name, or list of them
+    'unlisted': True for models no longer on the server's model list, False for models on it
+  and limits them with any of
+    'keep_last': number of newest recordings to keep
+    'max_age_days': delete recordings that started more than this many days ago
+    'max_bytes': delete the oldest recordings until the rest add up to no more than this
+  A rule without selectors applies to all recordings. The limits apply to each model separately unless the rule has
+  'per': 'rule', when they apply to all the recordings it selects together. Rules are applied in order, and
+  max_bytes takes recordings already planned for deletion by earlier limits into account. Rules can have a 'name'
+  used in the reasons.
+
+  `now` is the time to measure max_age_days from, in seconds since the epoch, by default the current time. Returns a
+  list of plan entries, oldest recording first, each with keys 'recording', 'bytes' and 'reasons', (every rule and
+  limit that selected the recording). Raises ValueError if a rule is invalid, or CtbRecRequestFailed.
+  """
+  rules = [parse_rule(r, i + 1) for i, r in enumerate(rules)]
+  models = ctb.get_models()
+  groups = {}
+  for g in ctb.get_model_groups().values():
+    for url in g['modelUrls']:
+      groups.setdefault(model_url_key(url), set()).add(g['name'])
+
+  # one pass over the recordings, sorting them into a bucket per rule and model (or per rule)
+  buckets = [{} for _ in rules]
+  for r in ctb.get_recordings():
+    model = r['model']
+    mid = ctb.model_id(model)
+    key = model_url_key(model['url'])
+    site = mid.split(':', 1)[0].lower()
+    member = groups.get(key, ())
+    for rule, bucket in zip(rules, buckets):
+      if (rule['groups'] is None or not rule['groups'].isdisjoint(member)) and \
+          (rule['sites'] is None or site in rule['sites']) and \
+          (rule['models'] is None or mid in rule['models'] or key in rule['models']) and \
+          (rule['unlisted'] is None or rule['unlisted'] == (mid not in models)):
+        bucket.setdefault(mid if rule['per_model'] else None, []).append(r)
+
+  planned = {}
+
+  def plan(recording, reason):
+    entry = planned.get(recording_key(recording))
+    if entry is None:
+      planned[recording_key(recording)] = {'recording': recording, 'bytes': recording.get('sizeInByte', 0),
+                                           'reasons': [reason]}
+    else:
+      entry['reasons'].append(reason)
+
+  cutoff = (time.time() if now is None else now) * 1000
+  for rule, bucket in zip(rules, buckets):
+    name = rule['name']
+    for recordings in bucket.values():
+      deletable = [r for r in recordings if not r['pinned'] and r['status'] == 'FINISHED']
+      if rule['keep_last'] is not None:
+        newest = sorted(recordings, key=lambda r: r['startDate'], reverse=True)[:rule['keep_last']]
+        keep = {recording_key(r) for r in newest}
+        for r in deletable:
+          if recording_key(r) not in keep:
+            plan(r, f"{name}: not one of the last {rule['keep_last']}")
+      if rule['max_age_days'] is not None:
+        oldest = cutoff - rule['max_age_days'] * 86400000
+        for r in deletable:
+          if r['startDate'] < oldest:
+            plan(r, f"{name}: older than {rule['max_age_days']} days")
+      if rule['max_bytes'] is not None:
+        total = sum(r.get('sizeInByte', 0) for r in recordings if recording_key(r) not in planned)
+        for r in sorted(deletable, key=lambda r: r['startDate']):
+          if total <= rule['max_bytes']:
+            break
+          if recording_key(r) not in planned:
+            total -= r.get('sizeInByte', 0)
+            plan(r, f"{name}: over {rule['max_bytes']} bytes")
+  return sorted(planned.values(), key=lambda e: e['recording']['startDate'])
+
+
+def apply_plan(ctb, plan, workers=8):
+  """ Delete the recordings in a plan from plan_retention, `workers` at a time. The recordings are fetched again
+  first, so that recordings pinned, changed or deleted since the plan was made are skipped. Returns one result per
+  plan entry, in plan order, each being the entry with 'result', (one of 'ok', 'skipped', 'not_found' or 'failed'),
+  and 'reason' added. Raises CtbRecRequestFailed if the recordings can't be fetched. """
+  current = {recording_key(r): r for r in ctb.get_recordings(max_age=0)}
+  results = []
+  for e in plan:
+    r = dict(e, result='failed', reason=None)
+    results.append(r)
+    recording = current.get(recording_key(e['recording']))
+    if recording is None:
+      r.update(result='not_found', reason='Recording is no longer on the server.')
+    elif recording['pinned'] or recording['status'] != 'FINISHED':
+      r.update(result='skipped', reason=f"Recording is {'pinned' if recording['pinned'] else 'not finished'}.")
+    else:
+      r['recording'] = recording
+
+  def delete(r):
+    try:
+      ctb.delete_recording(r['recording'])
+      r['result'] = 'ok'
+    except CtbRecRequestFailed as error:
+      r['reason'] = str(error)
+
+  with ThreadPoolExecutor(max_workers=workers) as pool:
+    list(pool.map(delete, [r for r in results if r['result'] == 'failed']))
+  return results
+
+
+def load_rules(path):
+  """ Read a retention rules file, either a list of rules or a dict with 'rules' """
+  with open(path) as f:
+    rules = json.load(f)
+  return rules['rules'] if isinstance(rules, dict) else rules
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='Delete recordings according to retention rules per model, site and '
+                                               'model group. Prints the plan unless --apply is given.')
+  parser.add_argument('file', nargs='?', default=os.environ.get('RETENTION_RULES', '/app/config/retention.json'),
+                      help='json file of the retention rules, default is RETENTION_RULES or '
+                           '/app/config/retention.json')
+  parser.add_argument('--apply', action='store_true', help='delete the recordings, rather than only printing them')
+  parser.add_argument('--workers', type=int, default=4, help='maximum number of concurrent deletions')
+  args = parser.parse_args(argv)
+  try:
+    rules = load_rules(args.file)
+  except (OSError, ValueError, KeyError) as error:
+    print(f"Can't read retention rules from {args.file}: {error}")
+    return 1
+
+  srv_url=os.environ.get('SRVURL')
+  srv_usr=os.environ.get('SRVUSR')
+  srv_pss=os.environ.get('SRVPSS')
+  metrics = RequestMetrics.from_env('retention')
+  ctb = CtbRec(server_url=srv_url, username=srv_usr, password=srv_pss, snapshot=False, metrics=metrics)
+
+  try:
+    plan = plan_retention(ctb, rules)
+  except ValueError as error:
+    print(f"Invalid retention rules: {error}")
+    return 1
+  for entry in plan:
+    print(f"{entry['recording']['metaDataFile']} - {entry['bytes']} bytes - {'; '.join(entry['reasons'])}")
+  print(f"Planned:   {len(plan)} recordings, {sum(e['bytes'] for e in plan)} bytes")
+
+  failed = 0
+  if args.apply and plan:
+    results = apply_plan(ctb, plan, args.workers)
+    for r in results:
+      if r['result'] != 'ok':
+        failed += r['result'] == 'failed'
+        print(f"{r['recording']['metaDataFile']} - {r['result']}: {r['reason']}")
+    deleted = [r for r in results if r['result'] == 'ok']
+    print(f"Deleted:   {len(deleted)} recordings, {sum(r['bytes'] for r in deleted)} bytes, {failed} failed")
+
+  if metrics:
+    metrics.write()
+  return 1 if failed else 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,157 @@
+#!/bin/python3
+
+from ctbrec import CtbRec, CtbRecRequestFailed, CtbRecUnavailable, RequestMetrics, recording_key
+from reclaim import plan_reclaim
+import argparse
+import json
+import os
+import time
+
+
+class SpaceGuard:
+  """ Keeps at least `min_free` bytes free on the recordings drive by deleting the oldest
+  non-pinned finished recordings, polling the drive space more often as it gets closer
+  to the minimum. """
+
+  def __init__(self, ctb, min_free, headroom, min_interval=2.0, max_interval=300.0,
+               status_file=None, dry_run=False):
+    self.ctb = ctb
+    self.min_free = min_free
+    self.headroom = headroom
+    self.min_interval = min_interval
+    self.max_interval = max_interval
+    self.status_file = status_file
+    self.dry_run = dry_run
+    self.candidates = None
+    self.previous = None
+    self.last = {}
+
+  def refresh_candidates(self):
+    """ Update the view of deletable recordings, from the full list the first time and from
+    the changes since the last fetch after that """
+    if self.candidates is None:
+      self.candidates = {recording_key(r): r for r in self.ctb.get_recordings(max_age=-1)
+                         if not r['pinned'] and r['status'] == 'FINISHED'}
+      return
+    delta = self.ctb.get_recordings_delta(max_age=-1)
+    for r in delta['removed']:
+      self.candidates.pop(recording_key(r), None)
+    for r in delta['added'] + delta['changed']:
+      if not r['pinned'] and r['status'] == 'FINISHED':
+        self.candidates[recording_key(r)] = r
+      else:
+        self.candidates.pop(recording_key(r), None)
+
+  def interval(self, free, now):
+    """ Seconds until the next check, shorter as free space approaches the minimum or is used up faster """
+    headroom = (free - self.min_free) / self.min_free if self.min_free else 1.0
+    interval = self.max_interval * min(max(headroom, 0.0), 1.0)
+    if self.previous:
+      used, elapsed = self.previous[0] - free, now - self.previous[1]
+      if used > 0 and elapsed > 0:
+        # aim to check a few times before the minimum is reached at the current rate
+        interval = min(interval, (free - self.min_free) / (used / elapsed) / 4)
+    self.previous = (free, now)
+    return min(max(interval, self.min_interval), self.max_interval)
+
+  def check(self):
+    """ Check the drive space once and reclaim space if needed. Returns the decision made. """
+    timings = {}
+    start = time.perf_counter()
+    free = self.ctb.get_space()['spaceFree']
+    timings['space'] = time.perf_counter() - start
+    decision = {'time': time.time(), 'free': free, 'minimum': self.min_free, 'action': 'idle'}
+    if free < self.min_free * 2:
+      # keep the view of recordings warm as free space gets low
+      start = time.perf_counter()
+      self.refresh_candidates()
+      timings['recordings'] = time.perf_counter() - start
+    if free < self.min_free:
+      start = time.perf_counter()
+      plan, freed = plan_reclaim(list(self.candidates.values()), self.min_free + self.headroom - free)
+      timings['plan'] = time.perf_counter() - start
+      start = time.perf_counter()
+      deleted = 0
+      for record in plan:
+        if self.dry_run:
+          print(record['metaDataFile'] + " - Would delete")
+          continue
+        try:
+          self.ctb.delete_recording(record)
+          self.candidates.pop(recording_key(record), None)
+          deleted += 1
+          print(record['metaDataFile'] + " - Deleted")
+        except CtbRecRequestFailed as error:
+          print(record['metaDataFile'] + " - Delete failed: " + str(error))
+      timings['delete'] = time.perf_counter() - start
+      decision.update(action='dry-run' if self.dry_run else 'reclaim', planned=len(plan), deleted=deleted,
+                      projected=free + freed)
+    decision['interval'] = self.interval(free, time.monotonic())
+    decision['timings'] = timings
+    return decision
+
+  def record(self, decision):
+    """ Keep the last decision and write it to the status file """
+    self.last = decision
+    # errors are printed where they are caught
+    if decision['action'] not in ('idle', 'error'):
+      print(f"spaceguard.py {decision['action']}: free {decision['free']}, minimum {decision['minimum']}, "
+            f"next check in {decision['interval']:.1f}s, timings {decision['timings']}", flush=True)
+    if self.status_file:
+      tmp = self.status_file + '.tmp'
+      with open(tmp, 'w') as f:
+        json.dump(decision, f, indent=2)
+      os.replace(tmp, self.status_file)
+
+  def run(self):
+    while True:
+      # an unreachable server or a local file error is logged and retried rather than stopping the daemon
+      try:
+        decision = self.check()
+      except (CtbRecRequestFailed, OSError) as error:
+        decision = {'time': time.time(), 'action': 'error', 'error': str(error),
+                    'interval': max(self.min_interval, 10.0), 'timings': {}}
+        print(f"spaceguard.py error: {error}", flush=True)
+      try:
+        self.record(decision)
+      except OSError as error:
+        print(f"spaceguard.py can't write the status file: {error}", flush=True)
+      time.sleep(decision['interval'])
+
+
+def connect(srv_url, srv_usr, srv_pss, retry=30):
+  """ Create the client, waiting for the server to come up """
+  while True:
+    try:
+      return CtbRec(server_url=srv_url, username=srv_usr, password=srv_pss, snapshot=False,
+                    metrics=RequestMetrics.from_env('spaceguard'))
+    except CtbRecUnavailable as error:
+      print(f"spaceguard.py waiting for server: {error}", flush=True)
+      time.sleep(retry)
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='Keep free drive space above a minimum by deleting the oldest '
+                                               'non-pinned finished recordings.')
+  parser.add_argument('--free', type=int, default=os.environ.get('RECOVER'),
+                      help='minimum free space to keep in bytes, default is RECOVER')
+  parser.add_argument('--headroom', type=int, default=None,
+                      help='extra bytes to free when reclaiming, default is 10%% of --free')
+  parser.add_argument('--min-interval', type=float, default=2.0, help='shortest time between checks in seconds')
+  parser.add_argument('--max-interval', type=float, default=300.0, help='longest time between checks in seconds')
+  parser.add_argument('--status', default='/app/config/spaceguard.json',
+                      help='file the last decision is written to, empty to disable')
+  parser.add_argument('--dry-run', action='store_true', help='print what would be deleted without deleting anything')
+  args = parser.parse_args(argv)
+  if args.free is None:
+    parser.error('--free or RECOVER must be set')
+  min_free = int(args.free)
+  headroom = min_free // 10 if args.headroom is None else args.headroom
+
+  ctb = connect(os.environ.get('SRVURL'), os.environ.get('SRVUSR'), os.environ.get('SRVPSS'))
+  print(f"spaceguard.py started: minimum {min_free}, headroom {headroom}", flush=True)
+  SpaceGuard(ctb, min_free, headroom, args.min_interval, args.max_interval, args.status or None, args.dry_run).run()
+
+
+if __name__ == '__main__':
+  main()
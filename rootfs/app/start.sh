@@ -13,4 +13,14 @@ chmod 666 /app/config/server.json
 # Enable post-processing by default
 [ ! -f "/app/config/dopp" ] && touch "/app/config/dopp"
 
+# Start the drive space guard if enabled
+if [ -n "${SPACEGUARD}" ]; then
+  /app/spaceguard.py &
+fi
+
+# Start the notification daemon if enabled, so the send2*.sh scripts keep their connections
+if [ -n "${NOTIFY_DAEMON}" ]; then
+  /app/notify.py --daemon &
+fi
+
 $JAVA -Xms256m -Xmx768m -cp ctbrec-server-$CTBVER-final.jar -Dfile.encoding=utf-8 -Dctbrec.config.dir=/app/config -Dctbrec.config=server.json ctbrec.recorder.server.HttpServer
@@ -0,0 +1,290 @@
+#!/bin/python3
+
+from ctbrec import CtbRec, Model, RequestMetrics, model_site, recording_key
+from datetime import datetime
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+
+class StorageIndex:
+  """
+  Bytes, counts, oldest/newest start dates and pinned volume of the recordings per model and per site, optionally
+  persisted to a json file. The index keeps the few fields it needs of every recording, so each update only
+  applies the recordings that were added, removed or changed since the last one.
+  """
+  fields = ('bytes', 'count', 'pinned_bytes', 'pinned_count', 'oldest', 'newest')
+
+  def __init__(self, path=None):
+    """
+    Args:
+      path: optional file the index is loaded from and saved to
+    """
+    self.path = path
+    self.updated = None
+    # recording_key -> (model id, size, start date, pinned)
+    self.entries = {}
+    self.models = {}
+    self.sites = {}
+    self.lock = threading.Lock()
+    if path:
+      self.load()
+
+  def load(self):
+    """ Load the index file, leaving the index empty if it doesn't exist or can't be read """
+    try:
+      with open(self.path, 'rb') as f:
+        state = json.load(f)
+      entries = {k: (sys.intern(e[0]), e[1], e[2], e[3]) for k, e in state['recordings'].items()}
+      self.models, self.sites = state['models'], state['sites']
+      self.entries, self.updated = entries, state['updated']
+    except (OSError, ValueError, KeyError, IndexError, TypeError):
+      pass
+
+  def save(self):
+    """ Write the index file, replacing the previous one atomically """
+    if not self.path:
+      return
+    tmp = f'{self.path}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as f:
+      json.dump({'updated': self.updated, 'models': self.models, 'sites': self.sites,
+           'recordings': self.entries}, f, separators=(',', ':'))
+    os.replace(tmp, self.path)
+
+  def age(self):
+    """ Seconds since the index was updated, infinite if it never has been """
+    return float('inf') if self.updated is None else time.time() - self.updated
+
+  @staticmethod
+  def entry(recording):
+    """ The fields of a recording kept by the index """
+    model = recording['model']
+    model_id = model.id if isinstance(model, Model) else model_site(model['type']) + ':' + model['name']
+    return model_id, recording.get('sizeInByte', 0), recording['startDate'], bool(recording['pinned'])
+
+  def add(self, entry):
+    """ Add a recording to its model and site """
+    model_id, size, start, pinned = entry
+    for groups, key in ((self.models, model_id), (self.sites, model_id.split(':', 1)[0])):
+      stats = groups.get(key)
+      if stats is None:
+        groups[key] = {'bytes': size, 'count': 1, 'pinned_bytes': size if pinned else 0,
+               'pinned_count': int(pinned), 'oldest': start, 'newest': start}
+        continue
+      stats['bytes'] += size
+      stats['count'] += 1
+      if pinned:
+        stats['pinned_bytes'] += size
+        stats['pinned_count'] += 1
+      if start < stats['oldest']:
+        stats['oldest'] = start
+      if start > stats['newest']:
+        stats['newest'] = start
+
+  def subtract(self, entry, stale):
+    """ Take a recording out of its model and site, adding them to `stale` if their oldest or newest was it """
+    model_id, size, start, pinned = entry
+    for groups, key in ((self.models, model_id), (self.sites, model_id.split(':', 1)[0])):
+      stats = groups[key]
+      stats['count'] -= 1
+      if not stats['count']:
+        del groups[key]
+        continue
+      stats['bytes'] -= size
+      if pinned:
+        stats['pinned_bytes'] -= size
+        stats['pinned_count'] -= 1
+      if start in (stats['oldest'], stats['newest']):
+        stale.add((groups is self.sites, key))
+
+  def refresh(self, stale):
+    """ Work out the oldest and newest start dates of models and sites again after recordings were removed """
+    if not stale:
+      return
+    for is_site, key in list(stale):
+      groups = self.sites if is_site else self.models
+      if key in groups:
+        groups[key]['oldest'], groups[key]['newest'] = float('inf'), float('-inf')
+      else:
+        stale.discard((is_site, key))
+    for model_id, _, start, _ in self.entries.values():
+      for is_site, key in ((False, model_id), (True, model_id.split(':', 1)[0])):
+        if (is_site, key) in stale:
+          stats = (self.sites if is_site else self.models)[key]
+          stats['oldest'] = min(stats['oldest'], start)
+          stats['newest'] = max(stats['newest'], start)
+
+  def update(self, recordings):
+    """
+    Bring the index up to date with the full recording list, in a single pass so that the recordings can be
+    streamed from the server with CtbRec.iter_recordings(), see update_storage_index
+
+    Returns:
+      dict with the number of recordings 'added', 'removed' and 'changed' since the last update
+    """
+    with self.lock:
+      previous, entries, stale = self.entries, {}, set()
+      added = changed = 0
+      for r in recordings:
+        key = recording_key(r)
+        entry = entries[key] = self.entry(r)
+        old = previous.get(key)
+        if old == entry:
+          continue
+        if old is None:
+          added += 1
+        else:
+          changed += 1
+          self.subtract(old, stale)
+        self.add(entry)
+      removed = [e for k, e in previous.items() if k not in entries]
+      for entry in removed:
+        self.subtract(entry, stale)
+      self.entries = entries
+      self.refresh(stale)
+      self.updated = time.time()
+      self.save()
+    return {'added': added, 'removed': len(removed), 'changed': changed}
+
+  def apply_delta(self, delta):
+    """
+    Apply the changes to the recording list returned by CtbRec.get_recordings_delta() or diff_recordings. The
+    client's delta leaves out the recordings it deleted itself, so pass those in a delta with only 'removed'.
+
+    Returns:
+      dict with the number of recordings 'added', 'removed' and 'changed'
+    """
+    with self.lock:
+      stale = set()
+      counts = {'added': 0, 'removed': 0, 'changed': 0}
+      for r in delta.get('removed', ()):
+        old = self.entries.pop(recording_key(r), None)
+        if old is not None:
+          self.subtract(old, stale)
+          counts['removed'] += 1
+      for r in [*delta.get('added', ()), *delta.get('changed', ())]:
+        key = recording_key(r)
+        entry = self.entry(r)
+        old = self.entries.get(key)
+        if old == entry:
+          continue
+        if old is not None:
+          self.subtract(old, stale)
+        self.entries[key] = entry
+        self.add(entry)
+        counts['added' if old is None else 'changed'] += 1
+      self.refresh(stale)
+      self.updated = time.time()
+      self.save()
+    return counts
+
+  def totals(self):
+    """ Bytes, counts, oldest/newest start dates and pinned volume of all recordings """
+    result = dict.fromkeys(self.fields, 0)
+    for stats in self.sites.values():
+      for k in ('bytes', 'count', 'pinned_bytes', 'pinned_count'):
+        result[k] += stats[k]
+    if self.sites:
+      result['oldest'] = min(s['oldest'] for s in self.sites.values())
+      result['newest'] = max(s['newest'] for s in self.sites.values())
+    else:
+      result['oldest'] = result['newest'] = None
+    return result
+
+  def top(self, n=10, by='bytes', sites=False):
+    """
+    The models or sites using the most storage
+
+    Args:
+      n: number of entries to return, all of them if 0
+      by: one of `fields`; 'oldest' returns those with the oldest recordings first, the others the largest
+        values first
+      sites: rank sites rather than models
+    Returns:
+      list of (Site:ModelName or site, stats dict) tuples
+    """
+    if by not in self.fields:
+      raise ValueError(f'Unknown storage field {by}')
+    groups = self.sites if sites else self.models
+    items = sorted(groups.items(), key=lambda i: i[1][by], reverse=by != 'oldest')
+    return items[:n] if n else items
+
+
+def update_storage_index(ctb, index, max_age=None):
+  """
+  Bring a storage index up to date with the recordings on the server. The recordings are streamed from the
+  server unless the cached recording list of the client is recent enough to be used.
+
+  Args:
+    ctb: the client to get the recordings with
+    index: the StorageIndex to update
+    max_age: use the cached recording list if it is no older than this many seconds. Default is the client's
+             recordings_max_age.
+  Returns:
+    dict with the number of recordings 'added', 'removed' and 'changed', see StorageIndex.update
+  Raises:
+    CtbRecRequestFailed
+  """
+  max_age = ctb.recordings_max_age if max_age is None else max_age
+  recordings = ctb.get_recordings(max_age) if ctb.recording_cache.age() <= max_age else ctb.iter_recordings()
+  return index.update(recordings)
+
+
+def date(ms):
+  """ Recording start date, (milliseconds since the epoch), as text """
+  return datetime.fromtimestamp(ms / 1000).strftime('%Y-%m-%d %H:%M') if ms is not None else '-'
+
+
+def report(index, n, by, sites):
+  """ Lines of a table of the top `n` models or sites by `by`, followed by the totals """
+  lines = [f"{'Site' if sites else 'Model':<40} {'Size GB':>10} {'Count':>7} {'Pinned GB':>10} {'Pinned':>7}"
+           f" {'Oldest':>16} {'Newest':>16}"]
+  rows = index.top(n, by, sites) + [('Total', index.totals())]
+  for name, s in rows:
+    lines.append(f"{name:<40} {s['bytes']/1e9:>10.3f} {s['count']:>7} {s['pinned_bytes']/1e9:>10.3f} "
+                 f"{s['pinned_count']:>7} {date(s['oldest']):>16} {date(s['newest']):>16}")
+  return lines
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='Show which models and sites use the most storage. The index file is '
+                                               'updated with the recordings that changed since the last run.')
+  parser.add_argument('--index', default=os.environ.get('STORAGE_INDEX', '/app/config/storage.json'),
+                      help='file the storage index is kept in, default is STORAGE_INDEX or /app/config/storage.json')
+  parser.add_argument('--top', type=int, default=20, help='number of models or sites to show, 0 for all')
+  parser.add_argument('--by', choices=StorageIndex.fields, default='bytes', help='what to rank by, default bytes')
+  parser.add_argument('--sites', action='store_true', help='rank sites rather than models')
+  parser.add_argument('--no-update', action='store_true', help="report the index as it is, without asking the server")
+  parser.add_argument('--json', action='store_true', help='print the report as json')
+  args = parser.parse_args(argv)
+
+  index = StorageIndex(args.index or None)
+  metrics = None
+  if not args.no_update:
+    srv_url=os.environ.get('SRVURL')
+    srv_usr=os.environ.get('SRVUSR')
+    srv_pss=os.environ.get('SRVPSS')
+    metrics = RequestMetrics.from_env('storage')
+    ctb = CtbRec(server_url=srv_url, username=srv_usr, password=srv_pss, snapshot=False, metrics=metrics)
+    changes = update_storage_index(ctb, index)
+    print(f"Index updated: {changes['added']} added, {changes['removed']} removed, {changes['changed']} changed",
+          file=sys.stderr)
+  elif index.updated is None:
+    print(f"No storage index in {args.index}", file=sys.stderr)
+    return 1
+
+  if args.json:
+    print(json.dumps({'updated': index.updated, 'total': index.totals(),
+                      'sites' if args.sites else 'models': dict(index.top(args.top, args.by, args.sites))}, indent=2))
+  else:
+    print('\n'.join(report(index, args.top, args.by, args.sites)))
+  if metrics:
+    metrics.write()
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
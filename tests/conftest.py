@@ -0,0 +1,30 @@
+""" Makes the scripts in rootfs/app and the development tools importable by the tests, and runs the local server
+emulator for them """
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'rootfs', 'app'), os.path.join(ROOT, 'tools')]
+
+import ctbemu  # noqa: E402
+
+
+@pytest.fixture
+def emulator(request, tmp_path):
+    """
+    A local server emulator in a background thread, yielding its state and url. Tests choose the emulator's
+    options, (eg. models, recordings and captures), through indirect parametrisation, eg.
+    @pytest.mark.parametrize('emulator', [{'recordings': 300}], indirect=True). A relative captures directory is
+    taken to be under the test's tmp_path.
+    """
+    options = {'models': 20, 'recordings': 100}
+    options.update(getattr(request, 'param', {}))
+    if 'captures' in options and not os.path.isabs(options['captures']):
+        options['captures'] = str(tmp_path / options['captures'])
+    server, url = ctbemu.start_in_thread(**options)
+    yield server.state, url
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,232 @@
+""" The same scenarios run against CtbRec and the AsyncCtbRec asyncio client, using the local server emulator
+
+Scenarios are coroutines taking a client whose methods are awaited. CtbRec is given to them through SyncClient,
+which calls its methods directly, so both clients run exactly the same code.
+"""
+
+import asyncio
+import time
+
+import pytest
+
+import ctbemu
+from ctbrec import AsyncCtbRec, CtbRec
+
+
+class SyncClient:
+    """ Awaitable methods that call the blocking CtbRec methods directly, in the event loop thread """
+
+    def __init__(self, client: CtbRec):
+        self.client = client
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+        return call
+
+    async def close(self):
+        self.client.session.close()
+
+
+@pytest.fixture(params=['CtbRec', 'AsyncCtbRec'])
+def run(request, emulator):
+    """ Run a scenario against a new client of the parametrised type, returning its result """
+    state, url = emulator
+
+    def run_scenario(scenario):
+        async def main():
+            if request.param == 'CtbRec':
+                client = SyncClient(CtbRec(url, snapshot=False))
+            else:
+                client = await AsyncCtbRec.connect(url, snapshot=False)
+            try:
+                return await scenario(client, state)
+            finally:
+                await client.close()
+        return asyncio.run(main())
+    return run_scenario
+
+
+async def summary_and_status(client, state):
+    summary = await client.get_summary(max_age=-1)
+    status = await client.get_model_status()
+    assert summary['total_models'] == len(state.models)
+    assert summary['models_online'] == sum(m['online'] for m in state.models.values())
+    assert summary['total_recordings'] == len(state.recordings)
+    assert set(status) == set(state.models)
+    assert status == await client.get_model_status(max_age=-1)
+    # both come from one server state, which is only fetched again once it is older than max_age
+    requests = state.stats()['requests']
+    await client.get_summary(max_age=60)
+    await client.get_model_status(max_age=60)
+    assert state.stats()['requests'] == requests
+
+
+async def models(client, state):
+    results = await client.add_models_batch(['Chaturbate:alice', 'https://stripchat.com/bob/', 'Nowhere:carol'],
+                                            props={'priority': 80})
+    assert [r['result'] for r in results] == ['added', 'added', 'failed']
+    assert state.models['Chaturbate:alice']['priority'] == 80
+    alice = await client.find_model('Chaturbate:alice')
+    assert alice['url'] == 'https://chaturbate.com/alice/'
+    await client.update_model('Stripchat:bob', {'bookmarked': True})
+    assert state.models['Stripchat:bob']['bookmarked'] is True
+    # independent lookups can be awaited together
+    found = await asyncio.gather(*(client.find_model(m) for m in list(state.models)[:20]))
+    assert [client_id(m) for m in found] == list(state.models)[:20]
+    results = await client.remove_models_batch(['Chaturbate:alice', 'Chaturbate:nobody'])
+    assert [r['result'] for r in results] == ['removed', 'not_found']
+    assert 'Chaturbate:alice' not in state.models
+
+
+async def model_plan(client, state):
+    same, changed = list(state.models)[:2]
+    state.models[changed].update(priority=50, bookmarked=True)
+    desired = [same, {'model': changed, 'priority': 70, 'bookmarked': True}, state.models[changed]['url'],
+               {'model': 'Chaturbate:alice', 'priority': 80}, 'https://stripchat.com/bob/', 'Nowhere:carol']
+    plan = await client.plan_models(desired, remove_missing=True)
+    assert [(e['model'], e['action']) for e in plan[:6]] == [
+        (same, 'unchanged'), (changed, 'update'), (state.models[changed]['url'], 'duplicate'),
+        ('Chaturbate:alice', 'add'), ('https://stripchat.com/bob/', 'add'), ('Nowhere:carol', 'add')]
+    assert plan[1]['changes'] == {'priority': (50, 70)}
+    # every other model on the server is removed
+    assert {client_id(e['server_model']) for e in plan[6:]} == set(state.models) - {same, changed}
+    assert all(e['action'] == 'remove' for e in plan[6:])
+    assert len(state.models) == 20
+
+    results = await client.apply_model_plan(plan)
+    assert len(results) == len(plan) - 2
+    assert [r['result'] for r in results[:4]] == ['ok', 'ok', 'ok', 'failed']
+    assert 'Unknown site' in results[3]['reason']
+    assert all(r['result'] == 'ok' and r['server_model'] is None for r in results[4:])
+    assert set(state.models) == {same, changed, 'Chaturbate:alice', 'Stripchat:bob'}
+    assert state.models[changed]['priority'] == 70 and state.models[changed]['bookmarked'] is True
+    # models added by name get their properties once they are on the server
+    assert state.models['Chaturbate:alice']['priority'] == 80
+    assert results[1]['server_model']['priority'] == 80
+    assert all(e['action'] == 'unchanged' for e in await client.plan_models(desired[:2] + desired[3:5]))
+
+
+async def model_groups(client, state):
+    names = list(state.models)[:3]
+    group = await client.create_model_group('favourites', names[:2])
+    assert len(state.groups[group['id']]['modelUrls']) == 2
+    await client.add_models_to_group('favourites', names[2:])
+    assert len((await client.find_model_group('favourites'))['modelUrls']) == 3
+    await client.delete_model_group('favourites')
+    assert state.groups == {}
+
+
+async def sync_groups(client, state):
+    urls = [m['url'] for m in state.models.values()][:8]
+    state.groups = {g['id']: g for g in ({'id': '1', 'name': 'same', 'modelUrls': urls[:2]},
+                                         {'id': '2', 'name': 'changed', 'modelUrls': urls[2:5]},
+                                         {'id': '3', 'name': 'missing', 'modelUrls': urls[5:6]})}
+    # urls are compared by model, so a url without its trailing slash or a model dict is the same model
+    desired = {'same': [urls[1].rstrip('/'), urls[0]],
+               'changed': [urls[2], list(state.models.values())[3], urls[6], urls[6]],
+               'new': [urls[7]]}
+    report = await client.sync_model_groups(desired, delete_missing=True, dry_run=True)
+    assert [(r['name'], r['action'], r['added'], r['removed'], r['result']) for r in report] == [
+        ('same', 'unchanged', [], [], 'ok'),
+        ('changed', 'updated', [urls[6]], [urls[4]], 'dry_run'),
+        ('new', 'created', [urls[7]], [], 'dry_run'),
+        ('missing', 'deleted', [], [urls[5]], 'dry_run')]
+    assert {g['name'] for g in state.groups.values()} == {'same', 'changed', 'missing'}
+
+    state.reset()
+    report = await client.sync_model_groups(desired)
+    assert [(r['name'], r['action'], r['result']) for r in report] == [
+        ('same', 'unchanged', 'ok'), ('changed', 'updated', 'ok'), ('new', 'created', 'ok')]
+    assert state.stats()['actions']['saveModelGroup']['requests'] == 2
+    groups = {g['name']: g for g in state.groups.values()}
+    assert groups['same']['modelUrls'] == urls[:2]
+    # urls kept in a changed group keep their order and id, added ones follow
+    assert groups['changed'] == {'id': '2', 'name': 'changed', 'modelUrls': [urls[2], urls[3], urls[6]]}
+    assert groups['new']['modelUrls'] == [urls[7]]
+    assert groups['missing']['modelUrls'] == urls[5:6]
+
+    report = await client.sync_model_groups(desired, delete_missing=True)
+    assert [(r['name'], r['action'], r['result']) for r in report][-1] == ('missing', 'deleted', 'ok')
+    assert {g['name'] for g in state.groups.values()} == {'same', 'changed', 'new'}
+    assert all(r['action'] == 'unchanged' for r in await client.sync_model_groups(desired, dry_run=True))
+
+
+async def recordings(client, state):
+    recordings = await client.get_recordings()
+    assert len(recordings) == len(state.recordings)
+    first, second = recordings[:2]
+    await client.pin_recording(first)
+    await client.annotate_recording(first, 'kept')
+    assert state.recordings[first['id']]['pinned'] is True
+    assert state.recordings[first['id']]['note'] == 'kept'
+    await client.delete_recording(second)
+    assert second['id'] not in state.recordings
+    assert len(await client.get_recordings()) == len(state.recordings)
+
+
+async def settings(client, state):
+    await client.stage_settings({'defaultPriority': 70})
+    await client.stage_settings({'concurrentRecordings': 4})
+    state.reset()
+    await client.commit_settings()
+    # the settings are fetched again, so that only the staged settings are changed
+    assert state.stats()['actions']['config']['requests'] == 2
+    assert {s['key']: s['value'] for s in state.config}['defaultPriority'] == 70
+    assert {s['key']: s['value'] for s in state.config}['concurrentRecordings'] == 4
+    await client.restore_settings()
+    assert {s['key']: s['value'] for s in state.config}['defaultPriority'] == 50
+
+
+async def space_and_recorder(client, state):
+    space = await client.get_space()
+    assert space['spaceFree'] == state.space_free
+    await client.pause_recording()
+    assert state.paused
+    await client.resume_recording()
+    assert not state.paused
+
+
+def client_id(model):
+    return ctbemu.EmulatorState.model_id(model)
+
+
+@pytest.mark.parametrize('scenario', [summary_and_status, models, model_plan, model_groups, sync_groups,
+                                      recordings, settings, space_and_recorder])
+def test_scenario(run, scenario):
+    run(scenario)
+
+
+def test_server_state_requests_are_sent_concurrently(emulator):
+    state, url = emulator
+    state.latency = 0.2
+
+    async def main():
+        async with await AsyncCtbRec.connect(url, snapshot=False) as client:
+            start = time.monotonic()
+            summary = await client.get_summary()
+            # the four requests take 0.8s one after the other
+            assert time.monotonic() - start < 0.6
+            assert summary['total_recordings'] == len(state.recordings)
+            assert state.stats()['bad_hmac'] == 0
+
+    asyncio.run(main())
+
+
+def test_batches_send_at_most_max_workers_requests_at_once(emulator):
+    state, url = emulator
+    state.latency = 0.1
+    names = list(state.models)[:8]
+
+    async def main():
+        async with await AsyncCtbRec.connect(url, snapshot=False) as client:
+            await client.get_model_index()
+            start = time.monotonic()
+            results = await client.remove_models_batch(names, max_workers=4)
+            assert [r['result'] for r in results] == ['removed'] * 8
+            # two rounds of four stop requests, then the model list
+            assert 0.3 <= time.monotonic() - start < 0.6
+
+    asyncio.run(main())
@@ -0,0 +1,25 @@
+""" The JSON codecs CtbRec can encode requests and decode responses with, against the local server emulator """
+
+import json
+
+import pytest
+
+from ctbrec import CtbRec, JSON_CODECS, JsonCodec
+
+
+def test_default_codec_encodes_like_the_json_module():
+    data = {'action': 'setNote', 'recording': {'id': 'a', 'note': 'café'}}
+    assert JsonCodec.dumps(data) == json.dumps(data).encode('utf-8')
+
+
+@pytest.mark.parametrize('codec', list(JSON_CODECS))
+def test_codec_requests_are_accepted(emulator, codec):
+    state, url = emulator
+    kwargs = {} if codec == 'json' else {'codec': codec}
+    ctb = CtbRec(url, snapshot=False, **kwargs)
+    assert ctb.codec is JSON_CODECS[codec]
+    recording = ctb.get_recordings()[0]
+    ctb.annotate_recording(recording, 'café')
+    assert state.recordings[recording['id']]['note'] == 'café'
+    assert len(ctb.get_models()) == len(state.models)
+    assert state.stats()['bad_hmac'] == 0
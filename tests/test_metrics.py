@@ -0,0 +1,73 @@
+""" Request metrics of CtbRec, against the local server emulator """
+
+import re
+
+import pytest
+
+from ctbrec import CtbRec, CtbRecRequestFailed, RequestMetrics
+
+SAMPLE = re.compile(r'^(\w+)\{([^}]*)\} (\S+)$')
+
+
+def samples(text):
+    """ Parse the samples of the Prometheus text format into (name, labels, value) tuples """
+    result = []
+    for line in text.splitlines():
+        if line.startswith('#'):
+            continue
+        name, labels, value = SAMPLE.match(line).groups()
+        result.append((name, dict(re.findall(r'(\w+)="((?:[^"\\]|\\.)*)"', labels)), float(value)))
+    return result
+
+
+@pytest.mark.parametrize('emulator', [{'latency': 0.03}], indirect=True)
+def test_prometheus_text_format(emulator):
+    state, url = emulator
+    metrics = RequestMetrics(labels={'script': 'test "quoted"'})
+    ctb = CtbRec(url, snapshot=False, metrics=metrics)
+    for _ in range(3):
+        ctb.get_space()
+    ctb.get_recordings()
+    with pytest.raises(CtbRecRequestFailed):
+        ctb.send_request('/rec', {'action': 'unknown'})
+    text = metrics.prometheus()
+    assert '# TYPE ctbrec_request_duration_seconds histogram' in text
+    for name in ('ctbrec_request_sign_seconds_total', 'ctbrec_response_parse_seconds_total',
+                 'ctbrec_request_sent_bytes_total', 'ctbrec_response_received_bytes_total',
+                 'ctbrec_request_errors_total'):
+        assert f'# TYPE {name} counter' in text
+
+    parsed = samples(text)
+    assert all(labels['script'] == 'test \\"quoted\\"' for _, labels, _ in parsed)
+    values = {(name, labels['action'], labels.get('le'), labels.get('kind')): value for name, labels, value in parsed}
+    assert {action for _, action, _, _ in values} == {'hmac', 'space', 'recordings', 'unknown'}
+
+    # cumulative buckets, every request slower than the 30ms latency
+    buckets = [(le, value) for (name, action, le, _), value in values.items()
+               if name == 'ctbrec_request_duration_seconds_bucket' and action == 'space']
+    assert [le for le, _ in buckets] == [str(b) for b in RequestMetrics.buckets] + ['+Inf']
+    assert [value for _, value in buckets] == sorted(value for _, value in buckets)
+    assert dict(buckets)['0.025'] == 0 and dict(buckets)['+Inf'] == 3
+    assert values[('ctbrec_request_duration_seconds_count', 'space', None, None)] == 3
+    assert values[('ctbrec_request_duration_seconds_sum', 'space', None, None)] >= 0.09
+
+    assert values[('ctbrec_response_received_bytes_total', 'recordings', None, None)] > 0
+    assert values[('ctbrec_request_sent_bytes_total', 'space', None, None)] > 0
+    assert values[('ctbrec_request_errors_total', 'unknown', None, 'failed')] == 1
+    assert not any(name == 'ctbrec_request_errors_total' and action != 'unknown'
+                   for name, action, _, _ in values)
+
+
+def test_write_replaces_the_textfile(emulator, tmp_path):
+    state, url = emulator
+    textfile = tmp_path / 'test.prom'
+    metrics = RequestMetrics(str(textfile), write_interval=3600)
+    # written on the first request, which fetches the hmac key, then no more often than the interval
+    ctb = CtbRec(url, snapshot=False, metrics=metrics)
+    assert 'ctbrec_request_duration_seconds_count{action="hmac"} 1' in textfile.read_text()
+    ctb.get_space()
+    ctb.get_space()
+    assert 'action="space"' not in textfile.read_text()
+    metrics.write()
+    assert 'ctbrec_request_duration_seconds_count{action="space"} 2' in textfile.read_text()
+    assert [p.name for p in tmp_path.iterdir()] == ['test.prom']
@@ -0,0 +1,83 @@
+""" notify.py and the notifyd daemon, against the stand-in endpoints of sinkemu.py """
+
+import base64
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+import notify
+import notifyd
+import sinkemu
+
+APP = os.path.dirname(notify.__file__)
+
+
+@pytest.fixture
+def daemon(tmp_path):
+    state, url, _ = sinkemu.start_in_thread()
+    sinks = notifyd.configured_sinks(['ntfy'], {'NTFY_URL': url + '/topic'}, window=0)
+    dispatcher = notifyd.Dispatcher(sinks)
+    path = str(tmp_path / 'notify.sock')
+    server = notifyd.NotifyDaemon(path, dispatcher)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield state, path
+    server.shutdown()
+    server.server_close()
+    dispatcher.close(10)
+
+
+def test_client_only_imports_what_the_socket_needs():
+    code = 'import sys, notify; print(sorted({"ctbrec", "notifyd", "requests", "smtplib"} & set(sys.modules)))'
+    result = subprocess.run([sys.executable, '-c', code], cwd=APP, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == '[]'
+
+
+@pytest.mark.parametrize('request_', [['not', 'an', 'object'], {'action': 'restart'}, {'args': ['no file']},
+                                      {'file': 7}, {'file': 'a.mp4', 'args': 'a - b'},
+                                      {'file': 'a.mp4', 'sinks': 'ntfy'}, {'action': 'flush', 'timeout': 'soon'}])
+def test_daemon_refuses_invalid_requests(daemon, request_):
+    state, path = daemon
+    reply = notify.ask_daemon(path, request_)
+    assert reply['status'] == 'error' and reply['error']
+    # the daemon keeps serving after refusing a request
+    assert notify.ask_daemon(path, {'action': 'stats'})['status'] == 'ok'
+
+
+def test_daemon_sends_valid_notifications(daemon, tmp_path):
+    state, path = daemon
+    recording = tmp_path / 'rec.mp4'
+    recording.touch()
+    reply = notify.ask_daemon(path, {'file': str(recording), 'args': ['Site', 'model'], 'sinks': ['ntfy', 'email']})
+    assert reply == {'status': 'queued', 'sinks': ['ntfy']}
+    # the daemon queues the notification once it has answered
+    deadline = time.monotonic() + 10
+    while notify.ask_daemon(path, {'action': 'stats'})['stats']['ntfy']['queued'] == 0:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    assert notify.ask_daemon(path, {'action': 'flush', 'timeout': 10})['status'] == 'ok'
+    assert [r['path'] for r in state.stats()['http']] == ['/topic']
+
+
+def test_http_sink_sends_the_curl_args_headers_and_credentials(tmp_path, capsys):
+    state, url, _ = sinkemu.start_in_thread()
+    env = {'HTTP_URL': url + '/hook', 'CURL_ARGS': "-s -H 'X-Api-Key: secret key' -u user:pass -A ctbrec --max-time 10"}
+    sinks = notifyd.configured_sinks(['http'], env, window=0)
+    assert 'CURL_ARGS --max-time 10 ignored' in capsys.readouterr().out
+    recording = tmp_path / 'rec.mp4'
+    recording.touch()
+    sinks['http'].submit(notifyd.make_event(str(recording), ['Site', 'model'], duration='00:00:01'))
+    assert sinks['http'].close(10)
+    request, = state.stats()['http']
+    assert request['path'] == '/hook' and request['fields'] == ['file', 'duration', 'argv', 'sheet']
+    headers = request['headers']
+    assert headers['X-Api-Key'] == 'secret key' and headers['User-Agent'] == 'ctbrec'
+    assert headers['Authorization'] == 'Basic ' + base64.b64encode(b'user:pass').decode()
+
+
+def test_sinks_must_implement_send():
+    with pytest.raises(TypeError):
+        notifyd.Sink()
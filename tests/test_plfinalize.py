@@ -0,0 +1,107 @@
+""" Finalizing playlists with plfinalize.py, against the local server emulator """
+
+import json
+import os
+import time
+
+import pytest
+
+import plfinalize
+
+EMULATOR = {'models': 10, 'recordings': 50, 'captures': 'captures', 'post_processing': 0.1,
+            'post_processing_threads': 100}
+SEGMENTS = b'#EXTM3U\n#EXT-X-TARGETDURATION:6\n#EXTINF:6.0,\nsegment_0.ts\n#EXTINF:6.0,\nsegment_1.ts'
+
+
+def capture(state, folder, recording=None, status='FINISHED', age=3600, content=SEGMENTS):
+    """ A capture directory with a playlist last written `age` seconds ago, made the recording's if one is given """
+    path = os.path.join(state.captures, folder)
+    os.makedirs(path)
+    playlist = os.path.join(path, 'playlist.m3u8')
+    with open(playlist, 'wb') as f:
+        f.write(content)
+    written = time.time() - age
+    os.utime(playlist, (written, written))
+    if recording is not None:
+        recording.update({'absoluteFile': playlist, 'singleFile': False, 'status': status})
+    return playlist
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def finished(state, n):
+    return [r for r in state.recordings.values() if r['status'] == 'FINISHED'][:n]
+
+
+@pytest.fixture
+def captures(emulator, monkeypatch):
+    """ Capture directories of every kind plfinalize.py tells apart, keyed by what is expected of them """
+    state, url = emulator
+    monkeypatch.setenv('SRVURL', url)
+    old, recent, ended, recording = finished(state, 4)
+    return state, {
+        'old': capture(state, 'a/old', old),
+        'orphan': capture(state, 'a/b/orphan', content=SEGMENTS + b'\n'),
+        'recording': capture(state, 'b/recording', recording, status='RECORDING'),
+        'recent': capture(state, 'b/recent', recent, age=60),
+        'ended': capture(state, 'c/ended', ended, content=SEGMENTS + b'\n#EXT-X-ENDLIST\n\n'),
+    }
+
+
+@pytest.mark.parametrize('emulator', [EMULATOR], indirect=True)
+def test_main_finalizes_old_playlists_and_skips_the_rest(captures, capsys):
+    state, playlists = captures
+    contents = {name: read(path) for name, path in playlists.items()}
+    assert plfinalize.main([state.captures]) == 0
+    out = capsys.readouterr().out
+    assert 'found 5 playlists, 4 missing the end tag' in out
+    assert 'finalized 2 playlists' in out
+    assert f"{os.path.dirname(playlists['recording'])} - skipped, RECORDING" in out
+    assert f"{os.path.dirname(playlists['recent'])} - skipped, written" in out
+
+    # the end tag goes on a line of its own, whether or not the playlist ended with a newline
+    assert read(playlists['old']) == SEGMENTS + b'\n#EXT-X-ENDLIST\n'
+    assert read(playlists['orphan']) == SEGMENTS + b'\n#EXT-X-ENDLIST\n'
+    for name in ('recording', 'recent', 'ended'):
+        assert read(playlists[name]) == contents[name]
+
+    # finalized playlists are found again, with the end tag
+    assert plfinalize.main([state.captures]) == 0
+    assert 'found 5 playlists, 2 missing the end tag' in capsys.readouterr().out
+
+
+@pytest.mark.parametrize('emulator', [EMULATOR], indirect=True)
+def test_dry_run_and_offline(captures, capsys):
+    state, playlists = captures
+    contents = {name: read(path) for name, path in playlists.items()}
+    assert plfinalize.main([state.captures, '--dry-run']) == 0
+    out = capsys.readouterr().out
+    assert out.count('missing the end tag\n') == 2
+    assert {name: read(path) for name, path in playlists.items()} == contents
+
+    # without the server, recordings in progress are only told apart by the age of their playlists
+    state.reset()
+    assert plfinalize.main([state.captures, '--offline']) == 0
+    assert 'finalized 3 playlists' in capsys.readouterr().out
+    assert read(playlists['recording']).endswith(b'\n#EXT-X-ENDLIST\n')
+    assert state.stats()['requests'] == 0
+
+
+@pytest.mark.parametrize('emulator', [EMULATOR], indirect=True)
+def test_rerun_post_processes_the_finalized_recordings(captures, tmp_path, capsys):
+    state, playlists = captures
+    checkpoint = str(tmp_path / 'plfinalize.json')
+    assert plfinalize.main([state.captures, '--rerun', '--limit', '1000', '--interval', '0.02',
+                            '--checkpoint', checkpoint]) == 0
+    out = capsys.readouterr().out
+    # the orphaned playlist has no recording to rerun
+    assert 'rerunning post-processing for 1 recordings' in out
+    assert 'post-processed 1, 0 failed, 0 missing' in out
+    with open(checkpoint) as f:
+        assert json.load(f)['done'] == 1
+    old, = [r for r in state.recordings.values() if r['absoluteFile'] == playlists['old']]
+    assert old['status'] == 'FINISHED'
+    assert state.stats()['actions']['rerunPostProcessing']['requests'] == 1
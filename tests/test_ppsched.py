@@ -0,0 +1,109 @@
+""" The post-processing scheduler of ppsched.py, against the local server emulator """
+
+import json
+import time
+
+import pytest
+
+from ctbrec import CtbRec
+from ppsched import PostProcessScheduler
+
+EMULATOR = {'models': 10, 'recordings': 100, 'post_processing': 0.1, 'post_processing_threads': 100}
+
+
+def finished_keys(state, n):
+    return [r['id'] for r in state.recordings.values() if r['status'] == 'FINISHED'][:n]
+
+
+def deferred_reruns(ctb, monkeypatch):
+    """ Hold back the reruns the scheduler submits, as a server that hasn't picked them up yet """
+    held = []
+    monkeypatch.setattr(ctb, 'rerun_post_process', held.append)
+    return held
+
+
+@pytest.mark.parametrize('emulator', [EMULATOR], indirect=True)
+def test_poll_keeps_only_the_recordings_being_scheduled(emulator):
+    state, url = emulator
+    ctb = CtbRec(url, snapshot=False)
+    pending, submitted = finished_keys(state, 3), finished_keys(state, 4)[3]
+    scheduler = PostProcessScheduler(ctb, pending, limit=1000)
+    scheduler.track(submitted, 'FINISHED')
+    depth, statuses, current = scheduler.poll()
+    assert depth == sum(r['status'] in PostProcessScheduler.busy for r in state.recordings.values())
+    assert statuses == {submitted: 'FINISHED'}
+    assert set(current) == set(pending)
+
+
+@pytest.mark.parametrize('emulator', [EMULATOR], indirect=True)
+def test_a_submitted_recording_is_not_finished_before_the_server_picks_it_up(emulator, monkeypatch):
+    state, url = emulator
+    ctb = CtbRec(url, snapshot=False)
+    key, = finished_keys(state, 1)
+    held = deferred_reruns(ctb, monkeypatch)
+    scheduler = PostProcessScheduler(ctb, [key], limit=1000, interval=0)
+    assert scheduler.step()['submitted'] == 1
+    assert scheduler.submitted[key]['status'] == 'FINISHED' and not scheduler.submitted[key]['busy']
+
+    # still FINISHED from before, so it is waited for
+    assert scheduler.step()['in_progress'] == 1
+    assert scheduler.done == 0
+
+    monkeypatch.undo()
+    ctb.rerun_post_process(held[0])
+    scheduler.step()
+    assert scheduler.submitted[key]['busy']
+    deadline = time.monotonic() + 5
+    while not scheduler.finished() and time.monotonic() < deadline:
+        time.sleep(0.05)
+        scheduler.step()
+    assert (scheduler.done, scheduler.failed, scheduler.missing) == (1, {}, [])
+
+
+@pytest.mark.parametrize('emulator', [EMULATOR], indirect=True)
+def test_a_submitted_recording_settles_when_its_status_changes_or_in_time(emulator, monkeypatch):
+    state, url = emulator
+    ctb = CtbRec(url, snapshot=False)
+    changed, failed = finished_keys(state, 2)
+    state.recordings[failed]['status'] = 'FAILED'
+    deferred_reruns(ctb, monkeypatch)
+    scheduler = PostProcessScheduler(ctb, [changed, failed], limit=1000, interval=0, settle=0.3)
+    assert scheduler.step()['submitted'] == 2
+
+    # a status other than the one it was submitted with is the outcome, even if it was never seen busy
+    state.recordings[changed]['status'] = 'FAILED'
+    scheduler.step()
+    assert scheduler.failed == {changed: 'Post-processing failed'}
+    assert list(scheduler.submitted) == [failed]
+
+    # the same status is only taken as the outcome once the settle time has passed
+    time.sleep(0.3)
+    scheduler.step()
+    assert scheduler.failed == {changed: 'Post-processing failed', failed: 'Post-processing failed'}
+    assert scheduler.finished()
+
+
+@pytest.mark.parametrize('emulator', [EMULATOR], indirect=True)
+def test_run_post_processes_every_recording(emulator, tmp_path):
+    state, url = emulator
+    ctb = CtbRec(url, snapshot=False)
+    keys = finished_keys(state, 6)
+    checkpoint = str(tmp_path / 'ppsched.json')
+    scheduler = PostProcessScheduler(ctb, keys, limit=2 + len(state.pp_running) + len(state.pp_queue),
+                                     interval=0.02, checkpoint=checkpoint)
+    scheduler.run()
+    assert (scheduler.done, scheduler.failed, scheduler.missing) == (6, {}, [])
+    assert all(state.recordings[k]['status'] == 'FINISHED' for k in keys)
+    with open(checkpoint) as f:
+        assert json.load(f)['done'] == 6
+
+
+def test_resume_reads_earlier_checkpoints(tmp_path):
+    checkpoint = tmp_path / 'ppsched.json'
+    checkpoint.write_text(json.dumps({'started': 1.0, 'pending': ['a'], 'submitted': {'b': 2.0}, 'done': 3,
+                                      'failed': {}, 'missing': [], 'last': {}}))
+    scheduler = PostProcessScheduler.resume(None, str(checkpoint))
+    assert scheduler.pending == ['a'] and scheduler.done == 3
+    assert scheduler.submitted == {'b': {'time': 2.0, 'status': None, 'busy': False}}
+    # with no status from before, whatever it is now is the outcome
+    assert scheduler.settled(scheduler.submitted['b'], 'FINISHED')
@@ -0,0 +1,54 @@
+""" Reclaim planning of reclaim.py, against the local server emulator """
+
+import pytest
+
+import reclaim
+
+
+def recording(rid, start, size, pinned=False, status='FINISHED'):
+    return {'id': rid, 'metaDataFile': f'{rid}.json', 'startDate': start, 'sizeInByte': size, 'pinned': pinned,
+            'status': status}
+
+
+def test_plan_reclaim_deletes_oldest_first_until_enough_is_freed():
+    recordings = [recording('c', 30, 100), recording('a', 10, 100), recording('d', 40, 100), recording('b', 20, 100)]
+    plan, freed = reclaim.plan_reclaim(recordings, 150)
+    assert [r['id'] for r in plan] == ['a', 'b']
+    assert freed == 200
+    assert reclaim.plan_reclaim(recordings, 0) == ([], 0)
+
+
+def test_plan_reclaim_skips_pinned_and_unfinished_recordings():
+    recordings = [recording('a', 10, 100, pinned=True), recording('b', 20, 100, status='RECORDING'),
+                  recording('c', 30, 100, status='POST_PROCESSING'), recording('d', 40, 100), recording('e', 50, 100)]
+    plan, freed = reclaim.plan_reclaim(recordings, 150)
+    assert [r['id'] for r in plan] == ['d', 'e']
+    assert freed == 200
+
+    # not enough candidates: everything deletable is planned and the shortfall shows in freed
+    plan, freed = reclaim.plan_reclaim(recordings, 1000)
+    assert [r['id'] for r in plan] == ['d', 'e']
+    assert freed == 200
+
+
+@pytest.mark.parametrize('emulator', [{'models': 10, 'recordings': 200}], indirect=True)
+def test_main_deletes_the_planned_recordings(emulator, monkeypatch, capsys):
+    state, url = emulator
+    recover = 10 ** 10
+    monkeypatch.setenv('SRVURL', url)
+    monkeypatch.setenv('RECOVER', str(recover))
+    candidates = sorted((r for r in state.recordings.values() if not r['pinned'] and r['status'] == 'FINISHED'),
+                        key=lambda r: r['startDate'])
+    expected, freed = reclaim.plan_reclaim(list(state.recordings.values()), recover)
+    assert expected == candidates[:len(expected)]
+    pinned = {r['id'] for r in state.recordings.values() if r['pinned']}
+
+    reclaim.main(['--dry-run'])
+    assert 'Would delete' in capsys.readouterr().out
+    assert all(r['id'] in state.recordings for r in expected)
+
+    free = state.space_free
+    reclaim.main([])
+    assert not {r['id'] for r in expected} & set(state.recordings)
+    assert pinned <= set(state.recordings)
+    assert state.space_free == free + freed >= free + recover
@@ -0,0 +1,31 @@
+""" Media file checks of reclean.py """
+
+import reclean
+
+
+def test_existing_files_lists_each_directory_once(tmp_path, monkeypatch):
+    for folder in ('a', 'b'):
+        (tmp_path / folder).mkdir()
+        (tmp_path / folder / '1.mp4').touch()
+    paths = {str(tmp_path / folder / name) for folder in ('a', 'b', 'gone') for name in ('1.mp4', '2.mp4')}
+    paths.add(str(tmp_path / 'a' / '.' / '1.mp4'))
+    listed = []
+    list_dir = reclean.list_dir
+    monkeypatch.setattr(reclean, 'list_dir', lambda path: listed.append(path) or list_dir(path))
+    listings = {}
+    found = reclean.existing_files(paths, listings=listings)
+    assert found == {str(tmp_path / 'a' / '1.mp4'), str(tmp_path / 'a' / '.' / '1.mp4'), str(tmp_path / 'b' / '1.mp4')}
+    assert sorted(listed) == [str(tmp_path / folder) for folder in ('a', 'b', 'gone')]
+    assert listings[str(tmp_path / 'gone')] == set()
+
+    # listings kept from an earlier call are used again
+    (tmp_path / 'b' / '2.mp4').touch()
+    assert reclean.existing_files(paths, listings=listings) == found
+    assert len(listed) == 3
+
+
+def test_existing_files_checks_files_in_unlisted_directories(tmp_path, monkeypatch):
+    (tmp_path / '1.mp4').touch()
+    monkeypatch.setattr(reclean, 'list_dir', lambda path: None)
+    paths = [str(tmp_path / '1.mp4'), str(tmp_path / '2.mp4')]
+    assert reclean.existing_files(paths) == {str(tmp_path / '1.mp4')}
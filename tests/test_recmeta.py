@@ -0,0 +1,72 @@
+""" The recording metadata index of recmeta.py, against the local server emulator """
+
+import os
+import sqlite3
+
+import pytest
+
+import ctbemu
+from ctbrec import CtbRec
+from recmeta import RecordingIndex, update_recording_index
+
+
+@pytest.fixture
+def ffmpeg(tmp_path, monkeypatch):
+    """ A stand-in for ffmpeg that only prints a duration, counting how often it is run """
+    calls = tmp_path / 'probes'
+    path = tmp_path / 'ffmpeg'
+    path.write_text(f'#!/bin/sh\necho >> {calls}\necho "  Duration: 00:42:00.00, start: 0.000000" >&2\n')
+    path.chmod(0o755)
+    monkeypatch.setenv('FFMPEG', str(path))
+    return lambda: len(calls.read_text()) if calls.exists() else 0
+
+
+def test_schema_is_only_set_up_for_new_files(tmp_path):
+    path = str(tmp_path / 'recindex.db')
+    RecordingIndex(path).close()
+    db = sqlite3.connect(path)
+    assert db.execute('PRAGMA user_version').fetchone()[0] == RecordingIndex.schema_version
+    assert db.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    with db:
+        db.execute('DROP INDEX recordings_file')
+    RecordingIndex(path).close()
+    assert db.execute("SELECT 1 FROM sqlite_master WHERE name = 'recordings_file'").fetchone() is None
+    # files from before the schema had a version are set up again
+    db.execute('PRAGMA user_version = 0')
+    RecordingIndex(path).close()
+    assert db.execute("SELECT 1 FROM sqlite_master WHERE name = 'recordings_file'").fetchone() is not None
+    db.close()
+
+
+@pytest.mark.parametrize('emulator', [{'models': 10, 'recordings': 50, 'captures': 'captures'}], indirect=True)
+def test_update_probes_each_settled_file_once(emulator, ffmpeg, tmp_path):
+    state, url = emulator
+    settled = [r for r in state.recordings.values() if r['status'] not in RecordingIndex.unsettled]
+    for r in settled:
+        os.makedirs(os.path.dirname(r['absoluteFile']), exist_ok=True)
+        open(r['absoluteFile'], 'w').close()
+    ctb = CtbRec(url, snapshot=False)
+    with RecordingIndex(str(tmp_path / 'recindex.db')) as index:
+        changes = update_recording_index(ctb, index)
+        assert changes == {'added': len(state.recordings), 'removed': 0, 'changed': 0, 'examined': len(settled)}
+        assert ffmpeg() == len(settled)
+        assert update_recording_index(ctb, index)['examined'] == 0
+        assert index.duration(settled[0]['absoluteFile']) == 42 * 60
+        assert ffmpeg() == len(settled)
+        model = ctbemu.EmulatorState.model_id(settled[0]['model'])
+        found = index.query(model=model)
+        assert [r['key'] for r in found] == sorted((r['id'] for r in state.recordings.values()
+                                                   if ctbemu.EmulatorState.model_id(r['model']) == model),
+                                                  key=lambda i: state.recordings[i]['startDate'])
+
+
+def test_update_uses_a_recent_cached_recording_list(emulator, tmp_path):
+    state, url = emulator
+    ctb = CtbRec(url, snapshot=False)
+    ctb.get_recordings()
+    del state.recordings[next(iter(state.recordings))]
+    state.reset()
+    with RecordingIndex(str(tmp_path / 'recindex.db')) as index:
+        assert update_recording_index(ctb, index, max_age=60, probe=False)['added'] == len(state.recordings) + 1
+        assert state.stats()['requests'] == 0
+        assert update_recording_index(ctb, index, max_age=0, probe=False)['removed'] == 1
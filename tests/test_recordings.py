@@ -0,0 +1,60 @@
+""" The recording list cache of CtbRec, against the local server emulator """
+
+from ctbrec import CtbRec, Model, Record, Recording, recording_key
+
+
+def test_changing_returned_recordings_leaves_the_cache_unchanged(emulator):
+    state, url = emulator
+    ctb = CtbRec(url, snapshot=False, recordings_max_age=60)
+    recording = ctb.get_recordings()[0]
+    recording['status'] = 'CHANGED'
+    ctb.get_recordings_delta()['added'][0]['status'] = 'CHANGED'
+    state.reset()
+    assert all(r['status'] != 'CHANGED' for r in ctb.get_recordings())
+    assert all(r['status'] != 'CHANGED' for r in ctb.get_recordings_delta()['added'])
+    assert state.stats()['requests'] == 0
+
+
+def test_annotate_recording_does_not_change_the_cache(emulator):
+    state, url = emulator
+    ctb = CtbRec(url, snapshot=False, recordings_max_age=60)
+    recording = ctb.get_recordings()[0]
+    ctb.annotate_recording(recording, 'kept')
+    assert recording['note'] == 'kept'
+    assert state.recordings[recording['id']]['note'] == 'kept'
+    assert ctb.recording_cache.recordings[recording_key(recording)]['note'] == ''
+
+
+def test_typed_lists_equal_the_dict_lists(emulator):
+    state, url = emulator
+    ctb = CtbRec(url, snapshot=False)
+    typed = CtbRec(url, snapshot=False, typed=True)
+    assert all(isinstance(r, Recording) for r in typed.get_recordings())
+    assert typed.get_recordings() == ctb.get_recordings()
+    assert list(typed.iter_recordings()) == list(ctb.iter_recordings())
+    assert typed.get_models() == ctb.get_models()
+
+
+def test_records_convert_values_that_become_dicts_or_lists():
+    first = Record({'test_nested': None, 'test_value': 'a'})
+    second = Record({'test_nested': {'tags': ['x', 'y']}, 'test_value': 'b'})
+    third = Record({'test_nested': None, 'test_value': 'c'})
+    assert first.layout is second.layout is third.layout
+    assert isinstance(second['test_nested'], Record) and second['test_nested']['tags'] == ('x', 'y')
+    assert second.to_dict() == {'test_nested': {'tags': ['x', 'y']}, 'test_value': 'b'}
+    assert third['test_nested'] is None
+    assert first != third and first == Record({'test_nested': None, 'test_value': 'a'})
+
+
+def test_recordings_of_an_unchanged_model_share_one_model_record(emulator):
+    state, url = emulator
+    recording = next(iter(state.recordings.values()))
+    changed = dict(recording['model'], priority=recording['model']['priority'] + 1)
+    models = {}
+    records = [Recording(dict(recording, model=dict(recording['model'])), models) for _ in range(3)]
+    records.append(Recording(dict(recording, model=changed), models))
+    assert all(isinstance(r['model'], Model) for r in records)
+    assert records[0]['model'] is records[1]['model'] is records[2]['model']
+    assert records[3]['model'] is not records[0]['model'] and records[3]['model'] == changed
+    assert records[0] == recording and records[0] != records[3]
+    assert records[0].key == recording_key(recording) == recording['id']
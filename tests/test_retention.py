@@ -0,0 +1,51 @@
+""" Retention rules of retention.py, against the local server emulator """
+
+import pytest
+
+import ctbemu
+import retention
+from ctbrec import CtbRec
+
+
+def test_parse_rule_rejects_invalid_rules():
+    with pytest.raises(ValueError, match='Unknown'):
+        retention.parse_rule({'keep_last': 1, 'keep_first': 1}, 1)
+    with pytest.raises(ValueError, match='none of'):
+        retention.parse_rule({'site': 'Chaturbate'}, 1)
+    with pytest.raises(ValueError, match="'per'"):
+        retention.parse_rule({'keep_last': 1, 'per': 'site'}, 1)
+    rule = retention.parse_rule({'model': 'https://chaturbate.com/alice/', 'site': 'Chaturbate', 'max_bytes': 1}, 2)
+    assert rule['name'] == 'rule 2'
+    assert rule['models'] == {('chaturbate.com', 'alice')}
+    assert rule['sites'] == {'chaturbate'}
+
+
+@pytest.mark.parametrize('emulator', [{'models': 10, 'recordings': 200}], indirect=True)
+def test_plan_and_apply_keep_last(emulator):
+    state, url = emulator
+    ctb = CtbRec(url, snapshot=False)
+    plan = retention.plan_retention(ctb, [{'name': 'latest', 'keep_last': 2}])
+    by_model = {}
+    for r in state.recordings.values():
+        by_model.setdefault(emulator_id(r), []).append(r)
+    expected = set()
+    for recordings in by_model.values():
+        newest = {r['id'] for r in sorted(recordings, key=lambda r: r['startDate'], reverse=True)[:2]}
+        expected |= {r['id'] for r in recordings
+                     if r['id'] not in newest and not r['pinned'] and r['status'] == 'FINISHED'}
+    assert {e['recording']['id'] for e in plan} == expected
+    assert all(e['reasons'] == ['latest: not one of the last 2'] for e in plan)
+
+    # a recording pinned after planning is skipped
+    pinned = plan[0]['recording']
+    ctb.pin_recording(pinned)
+    results = retention.apply_plan(ctb, plan, workers=4)
+    assert [r['result'] for r in results].count('skipped') == 1
+    assert all(r['result'] == 'ok' for r in results if r['recording']['id'] != pinned['id'])
+    assert pinned['id'] in state.recordings
+    assert not (expected - {pinned['id']}) & set(state.recordings)
+    assert len(expected) > 100
+
+
+def emulator_id(recording):
+    return ctbemu.EmulatorState.model_id(recording['model'])
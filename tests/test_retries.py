@@ -0,0 +1,101 @@
+""" Retries, backoff and the circuit breaker of CtbRec, against the errors mode of the local server emulator """
+
+import time
+
+import pytest
+
+from ctbrec import CtbRec, CtbRecCircuitOpen, CtbRecUnavailable, RequestMetrics
+
+
+def requests_for(state, action):
+    return state.stats()['actions'].get(action, {}).get('requests', 0)
+
+
+def test_safe_requests_are_retried(emulator):
+    state, url = emulator
+    ctb = CtbRec(url, snapshot=False, retries=2, backoff=0.01, breaker_threshold=0)
+    state.errors = 1.0
+    with pytest.raises(CtbRecUnavailable, match='503'):
+        ctb.get_space()
+    assert requests_for(state, 'space') == 3
+    with pytest.raises(CtbRecUnavailable):
+        ctb.get_recordings()
+    assert requests_for(state, 'recordings') == 3
+
+    # with some of the requests failing every call gets through, some after a retry
+    ctb = CtbRec(url, snapshot=False, retries=10, backoff=0.001, breaker_threshold=0)
+    state.errors = 0.3
+    state.reset()
+    for _ in range(40):
+        ctb.get_space()
+    assert requests_for(state, 'space') > 40
+
+
+def test_requests_that_change_the_server_are_not_retried(emulator):
+    state, url = emulator
+    ctb = CtbRec(url, snapshot=False, retries=3, backoff=0.01, breaker_threshold=0)
+    recording = ctb.get_recordings()[0]
+    model = next(iter(state.models.values()))
+    state.errors = 1.0
+    state.reset()
+    with pytest.raises(CtbRecUnavailable):
+        ctb.delete_recording(recording)
+    with pytest.raises(CtbRecUnavailable):
+        ctb.send_request(url='/rec', data={'action': 'stop', 'model': model})
+    assert requests_for(state, 'delete') == 1
+    assert requests_for(state, 'stop') == 1
+    assert recording['id'] in state.recordings
+
+
+def test_backoff_doubles_between_attempts(emulator, monkeypatch):
+    state, url = emulator
+    ctb = CtbRec(url, snapshot=False, retries=3, backoff=0.1, breaker_threshold=0)
+    for attempt in (1, 2, 3):
+        assert all(0 <= ctb.retry_delay(attempt) <= 0.1 * 2 ** (attempt - 1) for _ in range(100))
+
+    # wait the longest delay, without jitter, to check the client sleeps between attempts
+    attempts = []
+    monkeypatch.setattr(ctb, 'retry_delay', lambda attempt: attempts.append(attempt) or 0.1 * 2 ** (attempt - 1))
+    state.errors = 1.0
+    start = time.monotonic()
+    with pytest.raises(CtbRecUnavailable):
+        ctb.get_space()
+    elapsed = time.monotonic() - start
+    assert attempts == [1, 2, 3]
+    assert 0.7 <= elapsed < 1.2
+
+
+def test_breaker_opens_half_opens_and_closes(emulator):
+    state, url = emulator
+    metrics = RequestMetrics()
+    ctb = CtbRec(url, snapshot=False, retries=0, breaker_threshold=2, breaker_reset=0.3, metrics=metrics)
+    state.errors = 1.0
+    for _ in range(2):
+        assert ctb.breaker.state == 'closed'
+        with pytest.raises(CtbRecUnavailable):
+            ctb.get_space()
+    assert ctb.breaker.state == 'open'
+
+    # requests fail fast without reaching the server while the breaker is open
+    state.reset()
+    with pytest.raises(CtbRecCircuitOpen):
+        ctb.get_space()
+    assert state.stats()['requests'] == 0
+    assert metrics.snapshot()['space']['errors'] == {'network': 2, 'unavailable': 1}
+
+    # a failed trial request opens the breaker again
+    time.sleep(0.3)
+    assert ctb.breaker.state == 'half-open'
+    with pytest.raises(CtbRecUnavailable):
+        ctb.get_space()
+    assert ctb.breaker.state == 'open'
+    assert state.stats()['requests'] == 1
+
+    # a successful one closes it
+    time.sleep(0.3)
+    state.errors = 0.0
+    assert ctb.breaker.state == 'half-open'
+    assert ctb.get_space()['status'] == 'success'
+    assert ctb.breaker.state == 'closed'
+    ctb.get_space()
+    assert state.stats()['requests'] == 3
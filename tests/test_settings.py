@@ -0,0 +1,53 @@
+""" Settings written by CtbRec, against the local server emulator """
+
+from ctbrec import CtbRec
+
+
+def server_settings(state):
+    return {s['key']: s['value'] for s in state.config}
+
+
+def change_on_server(state, key, value):
+    """ Change a setting the way the web interface would, without the client knowing """
+    with state.lock:
+        next(s for s in state.config if s['key'] == key)['value'] = value
+
+
+def test_commit_keeps_settings_changed_elsewhere(emulator):
+    state, url = emulator
+    ctb = CtbRec(url, snapshot=False)
+    ctb.get_settings()
+    change_on_server(state, 'concurrentRecordings', 3)
+    ctb.update_settings({'defaultPriority': 70})
+    assert server_settings(state)['concurrentRecordings'] == 3
+    assert server_settings(state)['defaultPriority'] == 70
+    # a change back to the value the client last saw is still written
+    change_on_server(state, 'defaultPriority', 10)
+    ctb.update_settings({'defaultPriority': 70})
+    assert server_settings(state)['defaultPriority'] == 70
+
+
+def test_commit_uses_a_recent_local_copy(emulator):
+    state, url = emulator
+    ctb = CtbRec(url, snapshot=False, settings_max_age=60)
+    state.reset()
+    ctb.update_settings({'defaultPriority': 70})
+    ctb.update_settings({'defaultPriority': 60})
+    assert state.stats()['actions']['config']['requests'] == 3
+    # nothing is sent when there is nothing to change
+    ctb.update_settings({'defaultPriority': 60})
+    assert state.stats()['actions']['config']['requests'] == 3
+
+
+def test_lazy_snapshot_is_taken_before_the_first_write(emulator):
+    state, url = emulator
+    ctb = CtbRec(url, snapshot=False)
+    settings = [dict(s) for s in state.config]
+    for s in settings:
+        if s['key'] == 'defaultPriority':
+            s['value'] = 90
+    ctb.update_settings(settings)
+    assert server_settings(state)['defaultPriority'] == 90
+    assert {s['key']: s['value'] for s in ctb.initial_config}['defaultPriority'] == 50
+    ctb.restore_settings()
+    assert server_settings(state)['defaultPriority'] == 50
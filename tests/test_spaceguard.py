@@ -0,0 +1,50 @@
+""" The spaceguard.py daemon loop, against the local server emulator """
+
+import pytest
+
+import spaceguard
+from ctbrec import CtbRec
+
+
+class Stop(Exception):
+    pass
+
+
+def run_checks(guard, monkeypatch, checks):
+    """ Run the daemon loop for a number of checks, returning the intervals it slept for """
+    slept = []
+
+    def sleep(seconds):
+        slept.append(seconds)
+        if len(slept) == checks:
+            raise Stop()
+    monkeypatch.setattr(spaceguard.time, 'sleep', sleep)
+    with pytest.raises(Stop):
+        guard.run()
+    return slept
+
+
+def test_os_errors_do_not_stop_the_daemon(emulator, tmp_path, monkeypatch, capsys):
+    state, url = emulator
+    ctb = CtbRec(url, snapshot=False)
+    guard = spaceguard.SpaceGuard(ctb, min_free=1, headroom=0, status_file=str(tmp_path / 'missing' / 'status.json'))
+    get_space = ctb.get_space
+    calls = []
+
+    def failing_get_space():
+        calls.append(1)
+        if len(calls) == 1:
+            raise OSError('Too many open files')
+        return get_space()
+    monkeypatch.setattr(ctb, 'get_space', failing_get_space)
+
+    assert run_checks(guard, monkeypatch, 2) == [10.0, guard.max_interval]
+    out = capsys.readouterr().out
+    assert 'spaceguard.py error: Too many open files' in out
+    assert out.count("spaceguard.py can't write the status file") == 2
+    assert guard.last['action'] == 'idle'
+
+    # the status file is written once its directory exists
+    (tmp_path / 'missing').mkdir()
+    run_checks(guard, monkeypatch, 1)
+    assert (tmp_path / 'missing' / 'status.json').exists()
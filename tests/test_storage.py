@@ -0,0 +1,88 @@
+""" The storage index of storage.py, against the local server emulator """
+
+import pytest
+
+from ctbrec import CtbRec
+from storage import StorageIndex, update_storage_index
+
+
+def rebuilt(ctb):
+    """ An index built from scratch from the current recordings """
+    index = StorageIndex()
+    index.update(ctb.get_recordings(max_age=-1))
+    return index
+
+
+def assert_same(index, expected):
+    assert index.entries == expected.entries
+    assert index.models == expected.models
+    assert index.sites == expected.sites
+
+
+def change_recordings(ctb, state):
+    """ Delete the oldest recordings, pin and unpin some and change the size of others """
+    recordings = sorted(ctb.get_recordings(max_age=-1), key=lambda r: r['startDate'])
+    for r in recordings[:5]:
+        ctb.delete_recording(r)
+    for r in recordings[5:10]:
+        ctb.unpin_recording(r) if r['pinned'] else ctb.pin_recording(r)
+    for r in recordings[-5:]:
+        state.recordings[r['id']]['sizeInByte'] += 1000
+
+
+@pytest.mark.parametrize('emulator', [{'models': 10, 'recordings': 300}], indirect=True)
+def test_update_counts_the_recordings_per_model_and_site(emulator, tmp_path):
+    state, url = emulator
+    ctb = CtbRec(url, snapshot=False)
+    index = StorageIndex(str(tmp_path / 'storage.json'))
+    assert update_storage_index(ctb, index) == {'added': 300, 'removed': 0, 'changed': 0}
+    recordings = list(state.recordings.values())
+    totals = index.totals()
+    assert totals['count'] == 300
+    assert totals['bytes'] == sum(r['sizeInByte'] for r in recordings)
+    assert totals['pinned_count'] == sum(r['pinned'] for r in recordings)
+    assert totals['oldest'] == min(r['startDate'] for r in recordings)
+    assert sum(s['count'] for s in index.models.values()) == 300
+    (name, top), = index.top(1)
+    assert top['bytes'] == max(s['bytes'] for s in index.models.values())
+    assert_same(StorageIndex(str(tmp_path / 'storage.json')), index)
+
+
+@pytest.mark.parametrize('emulator', [{'models': 10, 'recordings': 300}], indirect=True)
+def test_incremental_update_matches_a_rebuild(emulator, tmp_path):
+    state, url = emulator
+    ctb = CtbRec(url, snapshot=False)
+    index = StorageIndex(str(tmp_path / 'storage.json'))
+    update_storage_index(ctb, index)
+    assert update_storage_index(ctb, index) == {'added': 0, 'removed': 0, 'changed': 0}
+    change_recordings(ctb, state)
+    assert update_storage_index(ctb, StorageIndex(str(tmp_path / 'storage.json'))) == \
+        {'added': 0, 'removed': 5, 'changed': 10}
+    assert_same(StorageIndex(str(tmp_path / 'storage.json')), rebuilt(ctb))
+
+    # a recent cached recording list is used rather than asking the server again
+    ctb.get_recordings(max_age=-1)
+    state.reset()
+    update_storage_index(ctb, index, max_age=60)
+    assert state.stats()['requests'] == 0
+
+
+@pytest.mark.parametrize('emulator', [{'models': 10, 'recordings': 300}], indirect=True)
+def test_apply_delta_matches_a_rebuild(emulator):
+    state, url = emulator
+    ctb = CtbRec(url, snapshot=False)
+    index = StorageIndex()
+    index.update(ctb.get_recordings(max_age=-1))
+    # changed by another client, as the delta leaves out recordings this one deleted itself
+    change_recordings(CtbRec(url, snapshot=False), state)
+    assert index.apply_delta(ctb.get_recordings_delta(max_age=-1)) == {'added': 0, 'removed': 5, 'changed': 10}
+    assert_same(index, rebuilt(ctb))
+    # recordings that are already up to date aren't counted again
+    delta = {'added': ctb.get_recordings()[:3], 'removed': [], 'changed': []}
+    assert index.apply_delta(delta) == {'added': 0, 'removed': 0, 'changed': 0}
+    # recordings deleted through this client are applied on their own
+    deleted = ctb.get_recordings()[0]
+    ctb.delete_recording(deleted)
+    assert ctb.get_recordings_delta(max_age=-1)['removed'] == []
+    assert index.apply_delta({'removed': [deleted]}) == {'added': 0, 'removed': 1, 'changed': 0}
+    assert_same(index, rebuilt(ctb))
@@ -0,0 +1,67 @@
+""" Incremental parsing of JsonArrayStream and the streaming requests of CtbRec, against the local server emulator """
+
+import itertools
+import json
+
+import pytest
+
+from ctbrec import CtbRec, CtbRecRequestFailed, JsonArrayStream, RequestMetrics
+
+
+def chunked(data: bytes, size: int):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 7, 4096])
+def test_elements_are_the_same_for_any_chunk_size(size):
+    document = {'status': 'success', 'models': [{'name': 'zoë', 'site': '日本', 'count': 123456789},
+                                                {'name': 'emoji 🎥', 'size': 1.5e10, 'pinned': True}, [], 0, -12],
+                'msg': 'OK', 'total': 98765}
+    data = json.dumps(document, ensure_ascii=False, indent=1).encode('utf-8')
+    stream = JsonArrayStream(chunked(data, size), 'models')
+    assert list(stream) == document['models']
+    assert stream.envelope == {'status': 'success', 'msg': 'OK', 'total': 98765}
+    assert stream.found
+
+
+def test_empty_arrays_and_objects():
+    stream = JsonArrayStream([b'{"recordings": [ ], "status": "success"}'], 'recordings')
+    assert list(stream) == [] and stream.found
+    stream = JsonArrayStream([b' { } '], 'recordings')
+    assert list(stream) == [] and not stream.found
+
+
+def test_invalid_json_raises_value_error():
+    with pytest.raises(ValueError):
+        list(JsonArrayStream(chunked(b'{"models": [1, 2', 1), 'models'))
+    with pytest.raises(ValueError):
+        list(JsonArrayStream([b'[1, 2]'], 'models'))
+
+
+def test_iter_recordings_equals_get_recordings(emulator):
+    state, url = emulator
+    ctb = CtbRec(url, snapshot=False)
+    assert list(ctb.iter_recordings()) == ctb.get_recordings()
+    assert list(ctb.iter_models()) == list(ctb.get_models().values())
+
+
+def test_failed_status_in_the_envelope_raises(emulator):
+    state, url = emulator
+    metrics = RequestMetrics()
+    ctb = CtbRec(url, snapshot=False, metrics=metrics)
+    with pytest.raises(CtbRecRequestFailed, match='Unknown action'):
+        list(ctb.stream_request('/rec', {'action': 'unknown'}, 'recordings'))
+    assert metrics.snapshot()['unknown']['errors'] == {'failed': 1}
+
+
+def test_stopping_early_closes_the_request(emulator):
+    state, url = emulator
+    metrics = RequestMetrics()
+    ctb = CtbRec(url, snapshot=False, metrics=metrics)
+    recordings = ctb.iter_recordings()
+    first = list(itertools.islice(recordings, 5))
+    recordings.close()
+    assert first == ctb.get_recordings()[:5]
+    stats = metrics.snapshot()['recordings']
+    assert stats['count'] == 2
+    assert stats['errors'] == {}
@@ -0,0 +1,31 @@
+""" A CtbRec instance shared between threads, against the local server emulator """
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from ctbrec import CtbRec
+
+THREADS = 32
+
+
+@pytest.mark.parametrize('emulator', [{'models': 50, 'recordings': 200}], indirect=True)
+def test_concurrent_requests_are_signed_correctly(emulator):
+    state, url = emulator
+    ctb = CtbRec(url, snapshot=False, pool_size=THREADS, retries=0)
+    recordings = ctb.get_recordings()
+    state.reset()
+
+    def annotate(i):
+        # every request has a different body, so a signature sent with the wrong request is always refused
+        ctb.annotate_recording(dict(recordings[i % len(recordings)]), f'note {i} ' + 'x' * (i % 97))
+        ctb.add_model(f'Chaturbate:model_{i}')
+
+    with ThreadPoolExecutor(max_workers=THREADS) as pool:
+        list(pool.map(annotate, range(1000)))
+
+    stats = state.stats()
+    assert stats['bad_hmac'] == 0
+    assert stats['actions']['setNote']['requests'] == 1000
+    assert stats['actions']['startByName']['requests'] == 1000
+    assert all(f'Chaturbate:model_{i}' in state.models for i in range(1000))
@@ -0,0 +1,571 @@
+#!/usr/bin/env python3
+""" Benchmarks for ctbrec.py and the scripts built on it, run against the local emulator in ctbemu.py
+
+For each scale the emulator is started in its own process, seeded with `scale` recordings and `scale // 10` models,
+and every benchmark reports wall time along with the number of requests and body bytes the emulator received and
+sent. Request counts are deterministic, so a run saved with --json can be used with --check to catch changes that
+make a method send more requests (N+1 regressions).
+
+Benchmarks:
+    methods      every public CtbRec method and the retention.py planner, run in order on one client
+    startup      client construction with an eager and with a lazy snapshot
+    memory       peak memory of get_recordings() and iter_recordings()
+    concurrency  signed requests from many threads sharing one client, checking every signature
+    async        the AsyncCtbRec asyncio client against CtbRec, checking both return the same results
+    scripts      reclean.py and reclaim.py
+    codec        encoding and decoding with each JSON codec, and recordings fetched with and without gzip
+    records      time and memory of models and recordings as dicts and as typed records
+    storage      building the storage index, updating it after 1% of the recordings changed, and storage.py
+    recindex     building the recording metadata index with a probe per file, updating and querying it
+    postprocess  rerunning post-processing for failed recordings with ppsched.py at several limits
+    playlists    finding and finalizing unterminated playlists in up to 50k capture directories with plfinalize.py,
+                 against plcheck.sh and reading every playlist in full
+    notify       notifications sent by a process per notification, through the notify.py daemon and in process,
+                 against the stand-in endpoints in sinkemu.py
+
+Usage:
+    python3 tools/ctbbench.py --scales 1000 10000 100000
+    python3 tools/ctbbench.py --scales 1000 --json bench.json
+    python3 tools/ctbbench.py --scales 1000 --check bench.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+TOOLS = os.path.dirname(os.path.abspath(__file__))
+APP = os.path.join(os.path.dirname(TOOLS), 'rootfs', 'app')
+sys.path.insert(0, APP)
+
+import requests  # noqa: E402
+import retention  # noqa: E402
+from ctbrec import AsyncCtbRec, CtbRec, JSON_CODECS, ServerState  # noqa: E402
+from recmeta import RecordingIndex, update_recording_index  # noqa: E402
+from storage import StorageIndex, update_storage_index  # noqa: E402
+
+BENCHMARKS = ['methods', 'startup', 'memory', 'concurrency', 'async', 'scripts', 'codec', 'records', 'storage',
+              'recindex', 'postprocess', 'playlists', 'notify']
+# number of models used by the batch methods
+BATCH = 100
+
+
+class Emulator:
+    """ ctbemu.py running in a separate process, so it doesn't share the interpreter or memory with the client """
+
+    def __init__(self, models: int, recordings: int, latency: float = 0.0, captures: str = '/app/captures',
+                 gzip: bool = False, post_processing: float = 0.0, post_processing_threads: int = 2):
+        self.proc = subprocess.Popen([sys.executable, os.path.join(TOOLS, 'ctbemu.py'), '--port', '0',
+                                      '--models', str(models), '--recordings', str(recordings),
+                                      '--latency', str(latency), '--captures', captures,
+                                      '--post-processing', str(post_processing),
+                                      '--post-processing-threads', str(post_processing_threads)] + ['--gzip'] * gzip,
+                                     stdout=subprocess.PIPE, text=True)
+        self.url = self.proc.stdout.readline().split()[-1]
+        self.session = requests.Session()
+
+    def stats(self) -> dict:
+        return self.session.get(self.url + '/_emulator/stats').json()
+
+    def reset(self):
+        self.session.post(self.url + '/_emulator/reset')
+
+    def close(self):
+        self.session.close()
+        self.proc.terminate()
+        self.proc.wait()
+
+    def __enter__(self) -> 'Emulator':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def measure(emu: Emulator, func, *args, **kwargs) -> tuple[dict, object]:
+    """ Run a function and return its wall time and the requests it sent, along with its result """
+    emu.reset()
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    wall = time.perf_counter() - start
+    stats = emu.stats()
+    return {'wall': wall, 'requests': stats['requests'], 'sent': stats['bytes_in'],
+            'received': stats['bytes_out'], 'bad_hmac': stats['bad_hmac']}, result
+
+
+def bench_methods(emu: Emulator, scale: int, latency: float) -> dict:
+    ctb = CtbRec(emu.url, snapshot=False)
+    models = list(ctb.get_models().values())
+    sample = models[:BATCH]
+    new = [f'Chaturbate:bench{i:04d}' for i in range(BATCH)]
+    urls = [f'https://stripchat.com/bench{i:04d}' for i in range(BATCH)]
+    recording = ctb.get_recordings()[0]
+    results = {}
+
+    def run(name, func, *args, **kwargs):
+        results[name], _ = measure(emu, func, *args, **kwargs)
+
+    run('take_snapshot', ctb.take_snapshot)
+    run('get_models', ctb.get_models)
+    run('get_models(online)', ctb.get_models, online=True)
+    run('iter_models', lambda: sum(1 for _ in ctb.iter_models()))
+    run('get_model_index', ctb.get_model_index)
+    run(f'find_model x{BATCH}', lambda: [ctb.find_model(m['url']) for m in sample])
+    run('add_model', ctb.add_model, 'Chaturbate:benchsingle')
+    run('update_model', ctb.update_model, 'Chaturbate:benchsingle', {'priority': 10})
+    run('remove_model', ctb.remove_model, 'Chaturbate:benchsingle')
+    run(f'add_models x{BATCH}', ctb.add_models, new)
+    run(f'remove_models x{BATCH}', ctb.remove_models, new)
+    run(f'add_models_batch x{BATCH}', ctb.add_models_batch, urls)
+    run(f'remove_models_batch x{BATCH}', ctb.remove_models_batch, urls)
+    desired = [{'model': m['url'], 'priority': (m['priority'] + 1) % 100} for m in models[:BATCH]] + new
+    plan = ctb.plan_models(desired)
+    run('plan_models', ctb.plan_models, desired)
+    run(f'apply_model_plan x{BATCH * 2}', ctb.apply_model_plan, plan)
+    run(f'remove_models x{BATCH} planned', ctb.remove_models, new)
+    run(f'create_model_group x{BATCH}', ctb.create_model_group, 'bench', [m['url'] for m in sample[:BATCH // 2]])
+    run('get_model_groups', ctb.get_model_groups)
+    run('find_model_group', ctb.find_model_group, 'bench')
+    run(f'add_models_to_group x{BATCH // 2}', ctb.add_models_to_group, 'bench',
+        [m['url'] for m in sample[BATCH // 2:]])
+    run(f'remove_models_from_group x{BATCH // 2}', ctb.remove_models_from_group, 'bench',
+        [m['url'] for m in sample[:BATCH // 2]])
+    run('save_model_group', lambda: ctb.save_model_group(ctb.find_model_group('bench')))
+    run('delete_model_group', ctb.delete_model_group, 'bench')
+    groups = {f'bench{i}': [m['url'] for m in sample[i::10]] for i in range(10)}
+    run('sync_model_groups x10 new', ctb.sync_model_groups, groups)
+    run('sync_model_groups x10 same', ctb.sync_model_groups, groups)
+    run('get_recordings', ctb.get_recordings)
+    run('iter_recordings', lambda: sum(1 for _ in ctb.iter_recordings()))
+    run('get_recordings_delta', ctb.get_recordings_delta, max_age=-1)
+    run('pin_recording', ctb.pin_recording, recording)
+    run('unpin_recording', ctb.unpin_recording, recording)
+    run('annotate_recording', ctb.annotate_recording, recording, 'bench')
+    run('rerun_post_process', ctb.rerun_post_process, recording)
+    run('delete_recording', ctb.delete_recording, recording)
+    rules = [{'group': 'bench0', 'keep_last': 1}, {'site': 'Chaturbate', 'max_age_days': 30},
+             {'model': sample[0]['url'], 'max_bytes': 10**10}]
+    run('retention.plan_retention', retention.plan_retention, ctb, rules)
+    plan = retention.plan_retention(ctb, rules)[:BATCH]
+    run(f'retention.apply_plan x{len(plan)}', retention.apply_plan, ctb, plan)
+    run('get_settings', ctb.get_settings)
+    run('cached_settings', ctb.cached_settings)
+    run('snapshot_settings', ctb.snapshot_settings)
+    run('update_settings', ctb.update_settings, {'defaultPriority': 40})
+    run('stage_settings+commit_settings', lambda: (ctb.stage_settings({'defaultPriority': 30}),
+                                                   ctb.commit_settings()))
+    run('restore_settings', ctb.restore_settings)
+    run('get_space', ctb.get_space)
+    run('get_server_state', ctb.get_server_state, max_age=-1)
+    run('get_summary', ctb.get_summary, max_age=-1)
+    run('get_model_status', ctb.get_model_status, max_age=-1)
+    run('pause_recording', ctb.pause_recording)
+    run('resume_recording', ctb.resume_recording)
+    ctb.session.close()
+    return results
+
+
+def bench_startup(emu: Emulator, scale: int, latency: float) -> dict:
+    results = {}
+    for name, snapshot in (('CtbRec(snapshot=True)', True), ('CtbRec(snapshot=False)', False)):
+        results[name], ctb = measure(emu, CtbRec, emu.url, snapshot=snapshot)
+        ctb.session.close()
+    return results
+
+
+def bench_memory(emu: Emulator, scale: int, latency: float) -> dict:
+    ctb = CtbRec(emu.url, snapshot=False)
+    results = {}
+    for name, func in (('get_recordings', ctb.get_recordings),
+                       ('iter_recordings', lambda: sum(1 for _ in ctb.iter_recordings()))):
+        tracemalloc.start()
+        results[name], _ = measure(emu, func)
+        results[name]['peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 2**20, 1)
+        tracemalloc.stop()
+        ctb.recording_cache.invalidate()
+    ctb.session.close()
+    return results
+
+
+def bench_concurrency(emu: Emulator, scale: int, latency: float, threads: int = 32, calls: int = 20) -> dict:
+    ctb = CtbRec(emu.url, snapshot=False, pool_size=threads)
+    recording = next(ctb.iter_recordings())
+
+    def worker(i):
+        for _ in range(calls):
+            ctb.get_space()
+            ctb.annotate_recording(recording, f'thread {i}')
+        return True
+
+    def run():
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            return all(pool.map(worker, range(threads)))
+
+    result, ok = measure(emu, run)
+    result['failed'] = not ok or result['bad_hmac'] > 0
+    ctb.session.close()
+    return {f'{threads} threads x{calls * 2}': result}
+
+
+def bench_async(emu: Emulator, scale: int, latency: float) -> dict:
+    ctb = CtbRec(emu.url, snapshot=False)
+    results = {}
+    results['CtbRec.get_summary'], summary = measure(emu, ctb.get_summary, max_age=-1)
+    results['CtbRec.get_model_status'], status = measure(emu, ctb.get_model_status, max_age=-1)
+
+    def spaces():
+        with ThreadPoolExecutor(max_workers=ctb.pool_size) as pool:
+            return list(pool.map(lambda _: ctb.get_space(), range(BATCH)))
+    results[f'CtbRec.get_space x{BATCH} threads'], _ = measure(emu, spaces)
+
+    async def scenario():
+        async with await AsyncCtbRec.connect(emu.url, snapshot=False) as actb:
+            a_summary = await actb.get_summary(max_age=-1)
+            a_status = await actb.get_model_status(max_age=-1)
+            await asyncio.gather(*(actb.find_model(m) for m in list(status)[:BATCH]))
+            return a_summary, a_status
+
+    async def concurrent_spaces():
+        async with await AsyncCtbRec.connect(emu.url, snapshot=False) as actb:
+            return await asyncio.gather(*(actb.get_space() for _ in range(BATCH)))
+
+    results['AsyncCtbRec scenario'], (a_summary, a_status) = measure(emu, asyncio.run, scenario())
+    results['AsyncCtbRec scenario']['failed'] = a_summary != summary or a_status != status
+    results[f'AsyncCtbRec.get_space x{BATCH} gathered'], _ = measure(emu, asyncio.run, concurrent_spaces())
+    ctb.session.close()
+    return results
+
+
+def bench_scripts(emu: Emulator, scale: int, latency: float, captures: str = None) -> dict:
+    ctb = CtbRec(emu.url, snapshot=False)
+    recordings = ctb.get_recordings()
+    ctb.session.close()
+    # create the media files of all but every 100th recording, so reclean.py has something to delete
+    for i, r in enumerate(recordings):
+        if i % 100:
+            os.makedirs(os.path.dirname(r['absoluteFile']), exist_ok=True)
+            open(r['absoluteFile'], 'w').close()
+    env = dict(os.environ, SRVURL=emu.url, PYTHONPATH=APP,
+               RECOVER=str(sum(r['sizeInByte'] for r in recordings) // 100))
+    results = {}
+    for name, args in (('reclean.py', []), ('reclean.py --stream', ['--stream']),
+                       ('reclaim.py --dry-run', ['--dry-run']), ('reclaim.py', [])):
+        script = os.path.join(APP, name.split()[0])
+        results[name], proc = measure(emu, subprocess.run, [sys.executable, script] + args, env=env,
+                                      stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        results[name]['failed'] = proc.returncode != 0
+        if proc.returncode:
+            print(proc.stderr, file=sys.stderr)
+    return results
+
+
+def bench_codec(emu: Emulator, scale: int, latency: float, repeat: int = 3) -> dict:
+    ctb = CtbRec(emu.url, snapshot=False)
+    payloads = {'recordings': {'status': 'success', 'msg': 'OK', 'recordings': ctb.get_recordings()},
+                'list': {'status': 'success', 'msg': 'OK', 'models': list(ctb.get_models().values())}}
+    ctb.session.close()
+    results = {}
+    for codec in JSON_CODECS.values():
+        for name, payload in payloads.items():
+            # best of several runs, as these are short and CPU bound
+            encode = min((measure(emu, codec.dumps, payload) for _ in range(repeat)), key=lambda r: r[0]['wall'])
+            results[f'{codec.name} dumps {name}'] = dict(encode[0], bytes=len(encode[1]))
+            results[f'{codec.name} loads {name}'] = min((measure(emu, codec.loads, encode[1])[0]
+                                                         for _ in range(repeat)), key=lambda r: r['wall'])
+    ctb = CtbRec(emu.url, snapshot=False)
+    results['get_recordings'], _ = measure(emu, ctb.get_recordings)
+    ctb.session.close()
+    with Emulator(max(scale // 10, BATCH * 2), scale, latency, gzip=True) as gzip_emu:
+        ctb = CtbRec(gzip_emu.url, snapshot=False)
+        results['get_recordings gzip'], _ = measure(gzip_emu, ctb.get_recordings)
+        ctb.session.close()
+    return results
+
+
+def bench_records(emu: Emulator, scale: int, latency: float) -> dict:
+    results = {}
+    for typed in (False, True):
+        ctb = CtbRec(emu.url, snapshot=False, typed=typed)
+        kind = 'typed' if typed else 'dicts'
+        for name, func in (('get_models', ctb.get_models), ('get_recordings', ctb.get_recordings)):
+            results[f'{name} {kind}'], _ = measure(emu, func)
+            # memory is measured on a second call, as tracing allocations slows the call down several times
+            tracemalloc.start()
+            data = func()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            del data
+            results[f'{name} {kind}'].update(kept_mb=round(current / 2**20, 1), peak_mb=round(peak / 2**20, 1))
+        models, recordings = ctb.get_models(), ctb.get_recordings(max_age=60)
+        # work derived from the lists: ids, url keys and status counts
+        results[f'model index {kind}'], _ = measure(emu, lambda: (ctb.invalidate_model_cache(),
+                                                                  type(ctb.get_model_index())(models)))
+        results[f'server state {kind}'], _ = measure(emu, ServerState, models, {}, recordings,
+                                                     {'spaceTotal': 1, 'spaceFree': 1}, ctb.model_id)
+        ctb.session.close()
+    return results
+
+
+def bench_storage(emu: Emulator, scale: int, latency: float) -> dict:
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'storage.json')
+        ctb = CtbRec(emu.url, snapshot=False)
+        results['build'], _ = measure(emu, update_storage_index, ctb, StorageIndex(path))
+        results['load'], index = measure(emu, StorageIndex, path)
+        results['update unchanged'], _ = measure(emu, update_storage_index, ctb, index)
+        # delete the oldest 1% of the recordings and pin as many more, so the oldest dates need working out again
+        recordings = sorted(ctb.get_recordings(), key=lambda r: r['startDate'])
+        changes = max(scale // 100, 1)
+        for r in recordings[:changes]:
+            ctb.delete_recording(r)
+        for r in recordings[changes:changes * 2]:
+            ctb.pin_recording(r)
+        results['update 1% changed'], _ = measure(emu, update_storage_index, ctb, index)
+        results['top 20 models'], _ = measure(emu, index.top, 20)
+        env = dict(os.environ, SRVURL=emu.url, PYTHONPATH=APP)
+        results['storage.py'], proc = measure(emu, subprocess.run, [sys.executable, os.path.join(APP, 'storage.py'),
+                                                                    '--index', path], env=env,
+                                              stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        results['storage.py']['failed'] = proc.returncode != 0
+        if proc.returncode:
+            print(proc.stderr, file=sys.stderr)
+        ctb.session.close()
+    return results
+
+
+def bench_recindex(emu: Emulator, scale: int, latency: float, files: int = 1000) -> dict:
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        ctb = CtbRec(emu.url, snapshot=False)
+        recordings = sorted(ctb.get_recordings(), key=lambda r: r['startDate'])
+        # media files for the newest recordings, probed by a stand-in for ffmpeg that only prints a duration
+        for r in recordings[-files:]:
+            os.makedirs(os.path.dirname(r['absoluteFile']), exist_ok=True)
+            open(r['absoluteFile'], 'w').close()
+        ffmpeg = os.path.join(tmp, 'ffmpeg')
+        with open(ffmpeg, 'w') as f:
+            f.write('#!/bin/sh\necho "  Duration: 00:42:00.00, start: 0.000000" >&2\n')
+        os.chmod(ffmpeg, 0o755)
+        os.environ['FFMPEG'] = ffmpeg
+        path = os.path.join(tmp, 'recindex.db')
+        index = RecordingIndex(path)
+        for name in ('build', 'update unchanged'):
+            results[name], counts = measure(emu, update_recording_index, ctb, index, max_age=0)
+            results[name]['examined'] = counts['examined']
+        # delete the oldest 1% of the recordings and pin as many more
+        changes = max(scale // 100, 1)
+        for r in recordings[:changes]:
+            ctb.delete_recording(r)
+        for r in recordings[changes:changes * 2]:
+            ctb.pin_recording(r)
+        results['update 1% changed'], counts = measure(emu, update_recording_index, ctb, index, max_age=0)
+        results['update 1% changed']['examined'] = counts['examined']
+        model = ctb.model_id(recordings[-1]['model'])
+        results['query model'], found = measure(emu, index.query, model=model)
+        results['query text'], _ = measure(emu, index.query, text='no such note')
+        paths = [r['absoluteFile'] for r in recordings[-files:]]
+        results[f'duration x{len(paths)} cached'], durations = measure(emu, lambda: [index.duration(p) for p in paths])
+        results[f'duration x{len(paths)} cached']['failed'] = None in durations or not found
+        index.close()
+        del os.environ['FFMPEG']
+        ctb.session.close()
+    return results
+
+
+def bench_postprocess(emu: Emulator, scale: int, latency: float, count: int = 100) -> dict:
+    from ppsched import PostProcessScheduler, select
+    results = {}
+    # a server of its own where post-processing takes 50ms and 4 recordings are post-processed at once
+    with Emulator(scale // 10, scale, latency, post_processing=0.05, post_processing_threads=4) as pp_emu:
+        ctb = CtbRec(pp_emu.url, snapshot=False)
+        while any(r['status'] in PostProcessScheduler.busy for r in ctb.iter_recordings()):
+            time.sleep(0.1)
+        keys = select(ctb, {'FAILED'}, [], None)
+        limits = (2, 4, 16)
+        count = min(count, len(keys) // len(limits))
+        for i, limit in enumerate(limits):
+            # different failed recordings for each limit, as the earlier ones have been post-processed
+            scheduler = PostProcessScheduler(ctb, keys[i * count:(i + 1) * count], limit=limit, interval=0.02)
+            depths = []
+
+            def run():
+                while not scheduler.finished():
+                    depths.append(scheduler.step()['depth'])
+                    time.sleep(scheduler.interval)
+
+            name = f'ppsched x{count} limit {limit}'
+            results[name], _ = measure(pp_emu, run)
+            results[name].update(max_depth=max(depths, default=0), per_hour=scheduler.last.get('per_hour'))
+        ctb.session.close()
+    return results
+
+
+def bench_playlists(emu: Emulator, scale: int, latency: float, segments: int = 200) -> dict:
+    from plfinalize import ACTIVE, ENDLIST, scan
+    results = {}
+    with tempfile.TemporaryDirectory() as captures:
+        # a server of its own whose recordings are kept as directories of segments under this tree
+        with Emulator(scale // 10, scale, latency, captures) as pl_emu:
+            ctb = CtbRec(pl_emu.url, snapshot=False)
+            recordings = ctb.get_recordings()[:min(scale // 2, 50000)]
+            folders = [r['absoluteFile'] for r in recordings]
+            ctb.session.close()
+            body = '#EXTM3U\n#EXT-X-TARGETDURATION:6\n' + ''.join(f'#EXTINF:6.000,\nsegment_{i:05d}.ts\n'
+                                                                   for i in range(segments))
+            old = time.time() - 3600
+            for i, folder in enumerate(folders):
+                os.makedirs(folder)
+                for n in range(3):
+                    open(os.path.join(folder, f'segment_{n:05d}.ts'), 'w').close()
+                playlist = os.path.join(folder, 'playlist.m3u8')
+                with open(playlist, 'w') as f:
+                    # every tenth playlist was left unterminated by a crash
+                    f.write(body if i % 10 == 0 else body + ENDLIST.decode() + '\n')
+                os.utime(playlist, (old, old))
+            missing = len(range(0, len(folders), 10))
+            # plfinalize.py leaves the playlists of recordings in progress alone
+            finished = sum(r['status'] not in ACTIVE for r in recordings[::10])
+            n = len(folders)
+
+            def read_all():
+                # every directory listed and every playlist read in full, one at a time
+                found = 0
+                for folder, _, files in os.walk(captures):
+                    if 'playlist.m3u8' in files:
+                        with open(os.path.join(folder, 'playlist.m3u8'), 'rb') as f:
+                            found += not f.read().rstrip().endswith(ENDLIST)
+                return found
+
+            results[f'walk and read x{n}'], found = measure(pl_emu, read_all)
+            results[f'walk and read x{n}']['failed'] = found != missing
+            for workers in (1, 16):
+                results[f'scan x{n} {workers} workers'], found = measure(pl_emu, scan, captures, workers)
+                results[f'scan x{n} {workers} workers']['failed'] = sum(not p['ended'] for p in found) != missing
+            # the check of the post-processing step, on terminated playlists so it leaves them as they are
+            checks = [f for i, f in enumerate(folders) if i % 10][:1000]
+            results[f'plcheck.sh x{len(checks)}'], procs = measure(pl_emu, lambda: [
+                subprocess.run(['bash', os.path.join(APP, 'plcheck.sh'), f]) for f in checks])
+            results[f'plcheck.sh x{len(checks)}']['failed'] = any(p.returncode for p in procs)
+            env = dict(os.environ, SRVURL=pl_emu.url, PYTHONPATH=APP)
+            for name, args in (('plfinalize.py --dry-run', ['--dry-run']), ('plfinalize.py', []),
+                               ('plfinalize.py again', [])):
+                script = [sys.executable, os.path.join(APP, 'plfinalize.py'), captures]
+                results[name], proc = measure(pl_emu, subprocess.run, script + args, env=env,
+                                              stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+                finalized = int(proc.stdout.split('finalized ')[-1].split()[0]) if 'finalized ' in proc.stdout else 0
+                results[name].update(failed=proc.returncode != 0, finalized=finalized)
+            results['plfinalize.py']['failed'] |= results['plfinalize.py']['finalized'] != finished
+            results['plfinalize.py again']['failed'] |= results['plfinalize.py again']['finalized'] != 0
+    return results
+
+
+def bench_notify(emu: Emulator, scale: int, latency: float, count: int = 50) -> dict:
+    import notify
+    import notifyd
+    import sinkemu
+    results = {}
+    # the stand-ins keep the same counters as the emulator, so they are measured the same way
+    state, url, _ = sinkemu.start_in_thread()
+    with tempfile.TemporaryDirectory() as tmp:
+        files = []
+        for i in range(count):
+            files.append(os.path.join(tmp, f'rec{i}.mp4'))
+            open(files[-1], 'w').close()
+            with open(os.path.join(tmp, f'rec{i}.jpg'), 'wb') as f:
+                f.write(os.urandom(20000))
+        sock = os.path.join(tmp, 'notify.sock')
+        # no ffmpeg, so the duration probe fails at once and only sending is measured
+        env = dict(os.environ, DISCORDHOOK=url + '/api/webhooks/1/token', NTFY_URL=url + '/topic',
+                   NOTIFY_SOCKET=sock, FFMPEG=os.path.join(tmp, 'ffmpeg'))
+        script = [sys.executable, os.path.join(APP, 'notify.py')]
+        sinks = ['--sink', 'discord', '--sink', 'ntfy']
+
+        def clients(*args):
+            return sum(subprocess.run(script + sinks + list(args) + [f, 'Site', 'model'], env=env).returncode
+                       for f in files)
+
+        results[f'process per notification x{count}'], failed = measure(state, clients, '--direct')
+        connections = [state.stats()['connections']]
+        daemon = subprocess.Popen(script + sinks + ['--daemon', '--window', '0.2'], env=env, stdout=subprocess.PIPE)
+        daemon.stdout.readline()
+
+        def through_daemon():
+            failed = clients()
+            return failed if notify.ask_daemon(sock, {'action': 'flush', 'timeout': 60}) else 1
+
+        results[f'daemon x{count}'], daemon_failed = measure(state, through_daemon)
+        connections.append(state.stats()['connections'])
+        daemon.terminate()
+        daemon.wait()
+        dispatcher = notifyd.Dispatcher(notifyd.configured_sinks(['discord', 'ntfy'], env, window=0.2))
+
+        def in_process():
+            for f in files:
+                dispatcher.dispatch(notifyd.make_event(f, ['Site', 'model'], duration=''))
+            return dispatcher.close(60)
+
+        results[f'Dispatcher x{count}'], done = measure(state, in_process)
+        connections.append(state.stats()['connections'])
+        for r, bad, n in zip(results.values(), (failed, daemon_failed, not done), connections):
+            r.update(failed=bool(bad), connections=n, per_event_ms=round(r['wall'] * 1000 / count, 1))
+    return results
+
+
+def run_benchmarks(scales: list[int], benchmarks: list[str], latency: float) -> dict:
+    """ Run the benchmarks at each scale and print the results as they come in """
+    report = {}
+    print(f"{'benchmark':<12} {'scale':>7} {'name':<34} {'wall ms':>10} {'requests':>8} {'sent':>10} "
+          f"{'received':>12}  extra", flush=True)
+    for scale in scales:
+        with tempfile.TemporaryDirectory() as captures:
+            for benchmark in benchmarks:
+                # start a fresh emulator per benchmark so earlier changes don't affect the numbers
+                with Emulator(max(scale // 10, BATCH * 2), scale, latency, captures) as emu:
+                    results = globals()['bench_' + benchmark](emu, scale, latency)
+                for name, r in results.items():
+                    report[f'{benchmark}/{scale}/{name}'] = r
+                    extra = {k: v for k, v in r.items() if k not in ('wall', 'requests', 'sent', 'received')
+                             and (v or k == 'peak_mb')}
+                    print(f"{benchmark:<12} {scale:>7} {name:<34} {r['wall'] * 1000:>10.1f} {r['requests']:>8} "
+                          f"{r['sent']:>10} {r['received']:>12}  {extra or ''}", flush=True)
+    return report
+
+
+def check(report: dict, baseline: dict) -> list[str]:
+    """ Compare request counts against a previous report, returning a message for each regression """
+    problems = [f'{name}: failed' for name, r in report.items() if r.get('failed')]
+    for name, r in report.items():
+        if name in baseline and r['requests'] > baseline[name]['requests']:
+            problems.append(f"{name}: {r['requests']} requests, was {baseline[name]['requests']}")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark ctbrec.py and its scripts against the local emulator.')
+    parser.add_argument('--scales', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='numbers of recordings to seed the emulator with, models are a tenth of that')
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS, default=BENCHMARKS, help='benchmarks to run')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds the emulator adds to every request')
+    parser.add_argument('--json', help='file to write the results to')
+    parser.add_argument('--check', help='results file to compare request counts against')
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(args.scales, args.only, args.latency)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    problems = check(report, json.load(open(args.check)) if args.check else {})
+    for problem in problems:
+        print('REGRESSION ' + problem)
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,414 @@
+#!/usr/bin/env python3
+""" Local emulator of the ctbrec server API used by ctbrec.py
+
+Implements the /secured/hmac, /rec and /config endpoints closely enough to exercise the CtbRec client and the
+scripts built on it without a live server:
+* every POST is checked against its CTBREC-HMAC signature
+* the server can be seeded with any number of synthetic models and recordings
+* a fixed latency can be added to every request, and a fraction of requests can fail with HTTP 503
+* rerun post-processing can take a set time, with a limited number of recordings post-processed at once
+* requests, request body bytes and response body bytes are counted per action
+
+The counters are available unsigned from GET /_emulator/stats and are reset by POST /_emulator/reset.
+
+Usage:
+    python3 tools/ctbemu.py --models 1000 --recordings 10000 --latency 0.01 --port 8080
+"""
+
+import argparse
+import base64
+import gzip
+import hashlib
+import hmac
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Optional
+
+# site name -> (ctbrec package, domain)
+SITES = {
+    'Chaturbate': ('chaturbate', 'chaturbate.com'),
+    'Stripchat': ('stripchat', 'stripchat.com'),
+    'Camsoda': ('camsoda', 'camsoda.com'),
+    'BongaCams': ('bonga', 'bongacams.com'),
+    'Cam4': ('cam4', 'cam4.com'),
+    'MyFreeCams': ('mfc', 'myfreecams.com'),
+}
+
+STATUSES = ['FINISHED'] * 90 + ['RECORDING'] * 4 + ['POST_PROCESSING'] * 2 + ['FAILED'] * 2 + ['WAITING'] * 2
+
+
+class EmulatorState:
+    """ Models, model groups, recordings, settings and request counters of the emulated server """
+
+    def __init__(self, models: int = 0, recordings: int = 0, latency: float = 0.0, hmac_key: str = 'emulator',
+                 username: Optional[str] = None, password: Optional[str] = None, captures: str = '/app/captures',
+                 seed: int = 1, errors: float = 0.0, post_processing: float = 0.0,
+                 post_processing_threads: int = 2):
+        """
+        Args:
+            models: number of synthetic models to create
+            recordings: number of synthetic recordings to create, spread over the models
+            latency: seconds added to every request
+            hmac_key: key used to sign requests
+            username: optional username required for basic authentication
+            password: optional password required for basic authentication
+            captures: directory the synthetic recording files are placed in
+            seed: random seed, so that the same arguments always produce the same data
+            errors: fraction of requests, other than for the hmac key, answered with HTTP 503
+            post_processing: seconds post-processing a recording takes, 0 to leave recordings post-processing for
+                             ever
+            post_processing_threads: number of recordings post-processed at once, the rest wait in a queue
+        """
+        self.lock = threading.Lock()
+        self.latency = latency
+        self.errors = errors
+        self.post_processing = post_processing
+        self.post_processing_threads = post_processing_threads
+        # recording ids waiting to be post-processed, and being post-processed with the time they finish
+        self.pp_queue = deque()
+        self.pp_running = {}
+        self.hmac_key = hmac_key
+        self.auth = None
+        if username is not None or password is not None:
+            self.auth = 'Basic ' + base64.b64encode(f'{username}:{password}'.encode()).decode()
+        self.captures = captures
+        self.paused = False
+        self.models = {}
+        self.groups = {}
+        self.recordings = {}
+        self.config = [
+            {'key': 'concurrentRecordings', 'name': 'Concurrent Recordings', 'type': 'INTEGER', 'value': 0},
+            {'key': 'defaultPriority', 'name': 'Default Priority', 'type': 'INTEGER', 'value': 50},
+            {'key': 'minimumSpaceLeftInBytes', 'name': 'Minimum Space Left', 'type': 'LONG', 'value': 0},
+            {'key': 'recordingsDir', 'name': 'Recordings Directory', 'type': 'STRING', 'value': captures},
+            {'key': 'transportLayerSecurity', 'name': 'TLS', 'type': 'BOOLEAN', 'value': True},
+            {'key': 'webinterface', 'name': 'Web Interface', 'type': 'BOOLEAN', 'value': True},
+        ]
+        self.space_total = 16 * 10**12
+        rnd = random.Random(seed)
+        sites = list(SITES)
+        for i in range(models):
+            m = self.make_model(sites[i % len(sites)], f'model{i:06d}')
+            m['suspended'] = rnd.random() < 0.05
+            m['bookmarked'] = rnd.random() < 0.05
+            m['online'] = rnd.random() < 0.1
+            m['priority'] = rnd.randint(0, 100)
+            self.models[self.model_id(m)] = m
+        model_list = list(self.models.values()) or [self.make_model('Chaturbate', 'model000000')]
+        start = 1600000000000
+        for i in range(recordings):
+            m = model_list[rnd.randrange(len(model_list))]
+            rid = str(uuid.UUID(int=rnd.getrandbits(128)))
+            start += rnd.randint(1000, 600000)
+            self.recordings[rid] = {
+                'id': rid, 'model': m, 'startDate': start, 'status': rnd.choice(STATUSES),
+                'pinned': rnd.random() < 0.02, 'note': '', 'progress': -1, 'singleFile': True,
+                'sizeInByte': rnd.randint(10**8, 5 * 10**9),
+                'absoluteFile': f'{captures}/{m["name"]}/{m["name"]}_{start}.mkv',
+                'metaDataFile': f'/app/config/recordings/{rid}.json'}
+        used = sum(r['sizeInByte'] for r in self.recordings.values())
+        self.space_free = max(self.space_total - used, 0)
+        if post_processing:
+            for r in self.recordings.values():
+                if r['status'] == 'POST_PROCESSING':
+                    self.pp_running[r['id']] = time.monotonic() + post_processing
+                elif r['status'] == 'WAITING':
+                    self.pp_queue.append(r['id'])
+        self.reset()
+
+    def reset(self):
+        """ Reset the request counters """
+        with self.lock:
+            self.requests = 0
+            self.bytes_in = 0
+            self.bytes_out = 0
+            self.bad_hmac = 0
+            self.actions = {}
+
+    def count(self, action: str, bytes_in: int, bytes_out: int):
+        """ Count a request """
+        with self.lock:
+            self.requests += 1
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+            a = self.actions.setdefault(action, {'requests': 0, 'bytes_in': 0, 'bytes_out': 0})
+            a['requests'] += 1
+            a['bytes_in'] += bytes_in
+            a['bytes_out'] += bytes_out
+
+    def stats(self) -> dict:
+        """ Request counters since the last reset """
+        with self.lock:
+            return {'requests': self.requests, 'bytes_in': self.bytes_in, 'bytes_out': self.bytes_out,
+                    'bad_hmac': self.bad_hmac, 'actions': json.loads(json.dumps(self.actions))}
+
+    @staticmethod
+    def make_model(site: str, name: str) -> dict:
+        """ Create a model dict like the ones the ctbrec server returns """
+        package, domain = SITES[site]
+        return {'type': f'ctbrec.sites.{package}.{site}Model', 'name': name, 'displayName': name,
+                'url': f'https://{domain}/{name}/', 'description': '', 'preview': '', 'tags': [],
+                'suspended': False, 'bookmarked': False, 'online': False, 'priority': 50, 'recordUntil': 0,
+                'recordUntilSubsequentAction': 'PAUSE', 'lastSeen': 0, 'lastRecorded': 0}
+
+    @staticmethod
+    def model_id(model: dict) -> str:
+        return model['type'].rsplit('.', 1)[1][:-len('Model')] + ':' + model['name']
+
+    def advance_post_processing(self):
+        """ Finish the recordings whose post-processing time is up and start the next ones in the queue """
+        now = time.monotonic()
+        for rid, end in list(self.pp_running.items()):
+            if end <= now:
+                del self.pp_running[rid]
+                if rid in self.recordings:
+                    self.recordings[rid]['status'] = 'FINISHED'
+        while self.pp_queue and len(self.pp_running) < self.post_processing_threads:
+            rid = self.pp_queue.popleft()
+            if rid in self.recordings and rid not in self.pp_running:
+                self.recordings[rid]['status'] = 'POST_PROCESSING'
+                self.pp_running[rid] = now + self.post_processing
+
+    def handle(self, data: dict) -> dict:
+        """ Handle a /rec action and return the result """
+        action = data.get('action')
+        ok = {'status': 'success', 'msg': 'OK'}
+        with self.lock:
+            if self.post_processing:
+                self.advance_post_processing()
+            if action in ('list', 'listOnline'):
+                models = [m for m in self.models.values() if action == 'list' or m['online']]
+                return {'status': 'success', 'msg': 'OK', 'models': models}
+            if action == 'recordings':
+                return {'status': 'success', 'msg': 'OK', 'recordings': list(self.recordings.values())}
+            if action == 'space':
+                return {'status': 'success', 'spaceTotal': self.space_total, 'spaceFree': self.space_free,
+                        'throttled': False, 'minimumSpaceLeftInBytes': self.config[2]['value']}
+            if action == 'start':
+                m = data['model']
+                self.models[self.model_id(m)] = dict(self.models.get(self.model_id(m), {}), **m)
+                return ok
+            if action == 'startByName':
+                site, _, name = data['model']['url'].partition(':')
+                if site not in SITES or not name:
+                    return {'status': 'fail', 'msg': f'Unknown site {site}'}
+                m = self.make_model(site, name)
+                self.models.setdefault(self.model_id(m), m)
+                return ok
+            if action == 'startByUrl':
+                url = data['model']['url'].strip().rstrip('/')
+                for site, (_, domain) in SITES.items():
+                    if f'{domain}/' in url:
+                        m = self.make_model(site, url.rsplit('/', 1)[1])
+                        self.models.setdefault(self.model_id(m), m)
+                        return ok
+                return {'status': 'fail', 'msg': f'Unknown site for {url}'}
+            if action == 'stop':
+                if self.models.pop(self.model_id(data['model']), None) is None:
+                    return {'status': 'fail', 'msg': 'Model not found'}
+                return ok
+            if action == 'listModelGroups':
+                return {'status': 'success', 'msg': 'OK', 'groups': list(self.groups.values())}
+            if action == 'saveModelGroup':
+                g = data['modelGroup']
+                self.groups[g['id']] = g
+                return ok
+            if action == 'deleteModelGroup':
+                self.groups.pop(data['modelGroup']['id'], None)
+                return ok
+            if action in ('delete', 'pin', 'unpin', 'setNote', 'rerunPostProcessing'):
+                r = self.recordings.get(data['recording']['id'])
+                if r is None:
+                    return {'status': 'fail', 'msg': 'Recording not found'}
+                if action == 'delete':
+                    del self.recordings[r['id']]
+                    self.space_free += r['sizeInByte']
+                elif action in ('pin', 'unpin'):
+                    r['pinned'] = action == 'pin'
+                elif action == 'setNote':
+                    r['note'] = data['recording'].get('note', '')
+                elif self.post_processing:
+                    if r['id'] not in self.pp_running and r['id'] not in self.pp_queue:
+                        r['status'] = 'WAITING'
+                        self.pp_queue.append(r['id'])
+                        self.advance_post_processing()
+                else:
+                    r['status'] = 'POST_PROCESSING'
+                return ok
+            if action in ('pauseRecorder', 'resumeRecorder'):
+                self.paused = action == 'pauseRecorder'
+                return ok
+        return {'status': 'fail', 'msg': f'Unknown action {action}'}
+
+    def update_config(self, settings: list) -> dict:
+        """ Handle a /config POST """
+        with self.lock:
+            keyed = {s['key']: s for s in self.config}
+            for s in settings:
+                if s['key'] in keyed:
+                    keyed[s['key']]['value'] = s['value']
+        return {'status': 'success', 'msg': 'OK'}
+
+
+class EmulatorHandler(BaseHTTPRequestHandler):
+    """ Request handler for the emulated server, the state is the server's `state` attribute """
+    protocol_version = 'HTTP/1.1'
+    # buffer the response so that headers and body go out together
+    wbufsize = 65536
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, code: int, result, action: str, bytes_in: int):
+        body = json.dumps(result).encode('utf-8')
+        if 'gzip' in self.headers.get('Accept-Encoding', '') and self.server.gzip and len(body) > 1024:
+            body = gzip.compress(body, compresslevel=1)
+            encoding = 'gzip'
+        else:
+            encoding = None
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.end_headers()
+        # count before replying, so a client that has its reply always sees the request counted
+        if action != 'emulator':
+            self.server.state.count(action, bytes_in, len(body))
+        self.wfile.write(body)
+
+    def authorised(self) -> bool:
+        state = self.server.state
+        if state.auth is None or self.headers.get('Authorization') == state.auth:
+            return True
+        self.send_response(401)
+        self.send_header('WWW-Authenticate', 'Basic realm="ctbrec"')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+        return False
+
+    def unavailable(self, action: str, bytes_in: int) -> bool:
+        """ Answer with HTTP 503 for the configured fraction of requests """
+        if self.server.state.errors and random.random() < self.server.state.errors:
+            self.reply(503, {'status': 'fail', 'msg': 'Service unavailable'}, action, bytes_in)
+            return True
+        return False
+
+    def do_GET(self):
+        state = self.server.state
+        if self.path == '/_emulator/stats':
+            return self.reply(200, state.stats(), 'emulator', 0)
+        if not self.authorised():
+            return
+        if state.latency:
+            time.sleep(state.latency)
+        if self.path == '/secured/hmac':
+            return self.reply(200, {'hmac': state.hmac_key}, 'hmac', 0)
+        if self.path == '/config':
+            if self.unavailable('config', 0):
+                return
+            with state.lock:
+                config = json.loads(json.dumps(state.config))
+            return self.reply(200, config, 'config', 0)
+        self.reply(404, {'status': 'fail', 'msg': 'Not found'}, 'unknown', 0)
+
+    def do_POST(self):
+        state = self.server.state
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path == '/_emulator/reset':
+            state.reset()
+            return self.reply(200, {'status': 'success'}, 'emulator', 0)
+        if not self.authorised():
+            return
+        if state.latency:
+            time.sleep(state.latency)
+        expected = hmac.new(state.hmac_key.encode('utf-8'), body, hashlib.sha256).hexdigest()
+        if not hmac.compare_digest(expected, self.headers.get('CTBREC-HMAC', '')):
+            with state.lock:
+                state.bad_hmac += 1
+            return self.reply(401, {'status': 'fail', 'msg': 'HMAC does not match'}, 'bad_hmac', len(body))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        data = json.loads(body)
+        if self.unavailable(data.get('action', 'config') if isinstance(data, dict) else 'config', len(body)):
+            return
+        if self.path == '/config':
+            return self.reply(200, state.update_config(data), 'config', len(body))
+        if self.path == '/rec':
+            return self.reply(200, state.handle(data), data.get('action', 'unknown'), len(body))
+        self.reply(404, {'status': 'fail', 'msg': 'Not found'}, 'unknown', len(body))
+
+
+class EmulatorServer(ThreadingHTTPServer):
+    """ Threaded http server that ignores clients dropping their connections """
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+
+def create_server(host: str = '127.0.0.1', port: int = 0, gzip_responses: bool = False,
+                  **kwargs) -> EmulatorServer:
+    """
+    Create an emulated server, not yet serving
+
+    Args:
+        host: address to listen on. Default is 127.0.0.1
+        port: port to listen on, 0 picks a free port. Default is 0
+        gzip_responses: compress larger responses when the client accepts gzip. Default is False
+        kwargs: passed to EmulatorState
+    """
+    server = EmulatorServer((host, port), EmulatorHandler)
+    server.gzip = gzip_responses
+    server.state = EmulatorState(**kwargs)
+    return server
+
+
+def start_in_thread(**kwargs) -> tuple[EmulatorServer, str]:
+    """ Start an emulated server in a background thread and return it along with its url """
+    server = create_server(**kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://{server.server_address[0]}:{server.server_address[1]}'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Emulate the ctbrec server API.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--models', type=int, default=100, help='number of synthetic models')
+    parser.add_argument('--recordings', type=int, default=1000, help='number of synthetic recordings')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every request')
+    parser.add_argument('--hmac-key', default='emulator')
+    parser.add_argument('--username')
+    parser.add_argument('--password')
+    parser.add_argument('--captures', default='/app/captures', help='directory of the synthetic recording files')
+    parser.add_argument('--gzip', action='store_true', help='compress responses when the client accepts gzip')
+    parser.add_argument('--errors', type=float, default=0.0, help='fraction of requests to fail with HTTP 503')
+    parser.add_argument('--post-processing', type=float, default=0.0,
+                        help='seconds post-processing a recording takes, 0 to never finish')
+    parser.add_argument('--post-processing-threads', type=int, default=2,
+                        help='number of recordings post-processed at once')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+    server = create_server(args.host, args.port, args.gzip, models=args.models, recordings=args.recordings,
+                           latency=args.latency, hmac_key=args.hmac_key, username=args.username,
+                           password=args.password, captures=os.path.abspath(args.captures), seed=args.seed,
+                           errors=args.errors, post_processing=args.post_processing,
+                           post_processing_threads=args.post_processing_threads)
+    print(f'ctbemu listening on http://{server.server_address[0]}:{server.server_address[1]}', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+""" Local stand-ins for the services notifications are sent to, so notify.py can be tested without real accounts
+
+An http server answers every request, (Discord webhooks, the Telegram bot api, ntfy topics and send2http urls all
+look the same to it), and an optional SMTP server accepts email, with STARTTLS when given a certificate:
+* requests, their headers, connections, request body bytes and multipart field names are recorded per path
+* emails are recorded with their subject and attachment count
+* a fraction of http requests can be answered with HTTP 429 and a short Retry-After, to exercise retries
+
+Recorded requests are returned by GET /_sinkemu/stats and cleared by POST /_sinkemu/reset.
+
+Usage:
+    python3 tools/sinkemu.py --port 8090 --smtp-port 8025 --cert cert.pem --key key.pem
+"""
+
+import argparse
+import base64
+import json
+import random
+import re
+import socketserver
+import ssl
+import sys
+import threading
+from email import message_from_bytes
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Optional
+
+
+class SinkState:
+    """ What the stand-ins have received since the last reset """
+
+    def __init__(self, throttle: float = 0.0):
+        """
+        Args:
+            throttle: fraction of http requests answered with HTTP 429
+        """
+        self.lock = threading.Lock()
+        self.throttle = throttle
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.requests = []
+            self.emails = []
+            self.connections = 0
+            self.smtp_connections = 0
+            self.bytes_in = 0
+            self.throttled = 0
+
+    def stats(self) -> dict:
+        """ Everything received, with the counters in the form ctbbench.measure expects """
+        with self.lock:
+            return {'requests': len(self.requests) + len(self.emails), 'bytes_in': self.bytes_in, 'bytes_out': 0,
+                    'bad_hmac': 0, 'connections': self.connections, 'smtp_connections': self.smtp_connections,
+                    'throttled': self.throttled, 'http': list(self.requests), 'emails': list(self.emails)}
+
+
+class SinkHandler(BaseHTTPRequestHandler):
+    """ Records every request and answers it like a successful api call """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        # a handler lives as long as its connection, so this counts connections rather than requests
+        if not self.server.control:
+            with self.server.state.lock:
+                self.server.state.connections += 1
+
+    def reply(self, code: int, result, headers: Optional[dict] = None):
+        body = json.dumps(result).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def record(self):
+        state = self.server.state
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if random.random() < state.throttle:
+            with state.lock:
+                state.throttled += 1
+            return self.reply(429, {'ok': False, 'retry_after': 0.01}, {'Retry-After': '0.01'})
+        with state.lock:
+            state.bytes_in += len(body)
+            state.requests.append({'method': self.command, 'path': self.path.split('?')[0], 'length': len(body),
+                                   'fields': re.findall(r'\bname="([^"]+)"', body[:65536].decode('latin-1')),
+                                   'title': self.headers.get('Title'), 'query': '?' in self.path,
+                                   'headers': dict(self.headers)})
+        self.reply(200, {'ok': True})
+
+    def do_GET(self):
+        if self.path == '/_sinkemu/stats':
+            return self.reply(200, self.server.state.stats())
+        self.record()
+
+    def do_POST(self):
+        if self.path == '/_sinkemu/reset':
+            self.server.state.reset()
+            return self.reply(200, {'ok': True})
+        self.record()
+
+    do_PUT = do_POST
+
+
+class SinkServer(ThreadingHTTPServer):
+    daemon_threads = True
+    control = False
+
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+
+class SmtpHandler(socketserver.StreamRequestHandler):
+    """ Just enough SMTP for smtplib: EHLO, STARTTLS, AUTH PLAIN/LOGIN, MAIL, RCPT, DATA, RSET, NOOP and QUIT """
+
+    def send(self, line: str):
+        self.wfile.write(line.encode() + b'\r\n')
+        self.wfile.flush()
+
+    def handle(self):
+        state = self.server.state
+        with state.lock:
+            state.smtp_connections += 1
+        self.send('220 sinkemu ESMTP')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command, _, arg = line.decode().strip().partition(' ')
+            command = command.upper()
+            if command in ('EHLO', 'HELO'):
+                extensions = ['sinkemu', 'AUTH PLAIN LOGIN']
+                if self.server.context and not self.tls:
+                    extensions.append('STARTTLS')
+                for ext in extensions:
+                    self.send(f'250-{ext}')
+                self.send('250 OK')
+            elif command == 'STARTTLS' and self.server.context:
+                self.send('220 Ready to start TLS')
+                self.request = self.server.context.wrap_socket(self.request, server_side=True)
+                self.rfile = self.request.makefile('rb')
+                self.wfile = self.request.makefile('wb')
+                self.tls = True
+            elif command == 'AUTH':
+                # the password 'wrong' is refused, to test failed logins
+                mechanism, _, initial = arg.partition(' ')
+                if mechanism.upper() == 'LOGIN':
+                    if not initial:
+                        self.send('334 VXNlcm5hbWU6')
+                        self.rfile.readline()
+                    self.send('334 UGFzc3dvcmQ6')
+                    password = base64.b64decode(self.rfile.readline().strip())
+                else:
+                    if not initial:
+                        self.send('334 ')
+                        initial = self.rfile.readline().decode().strip()
+                    password = base64.b64decode(initial).split(b'\0')[-1]
+                if password == b'wrong':
+                    self.send('535 Authentication failed')
+                else:
+                    self.send('235 Authentication successful')
+            elif command == 'DATA':
+                self.send('354 End data with <CR><LF>.<CR><LF>')
+                data = []
+                for line in iter(self.rfile.readline, b''):
+                    if line == b'.\r\n':
+                        break
+                    data.append(line[1:] if line.startswith(b'..') else line)
+                msg = message_from_bytes(b''.join(data))
+                with state.lock:
+                    state.bytes_in += sum(map(len, data))
+                    state.emails.append({'subject': msg['Subject'], 'to': msg['To'],
+                                         'attachments': sum(1 for p in msg.walk() if p.get_filename())})
+                self.send('250 OK')
+            elif command == 'QUIT':
+                self.send('221 Bye')
+                return
+            elif command in ('MAIL', 'RCPT', 'RSET', 'NOOP'):
+                self.send('250 OK')
+            else:
+                self.send('502 Command not implemented')
+
+    tls = False
+
+
+class SmtpServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def start_in_thread(throttle: float = 0.0, smtp: bool = False, cert: Optional[str] = None,
+                    key: Optional[str] = None) -> tuple[SinkState, str, Optional[int]]:
+    """
+    Start the stand-ins on free ports in background threads
+
+    Args:
+        throttle: fraction of http requests answered with HTTP 429
+        smtp: also start the SMTP stand-in
+        cert: certificate file for STARTTLS, which is only offered with a certificate
+        key: key file of the certificate
+    Returns:
+        the shared state, the base url of the http stand-in and the port of the SMTP stand-in or None
+    """
+    state = SinkState(throttle)
+    http = SinkServer(('127.0.0.1', 0), SinkHandler)
+    http.state = state
+    threading.Thread(target=http.serve_forever, daemon=True).start()
+    # stats and reset requests go to a second server, so they aren't counted as connections
+    control = SinkServer(('127.0.0.1', 0), SinkHandler)
+    control.state = state
+    control.control = True
+    threading.Thread(target=control.serve_forever, daemon=True).start()
+    state.control_url = f'http://127.0.0.1:{control.server_address[1]}'
+    smtp_port = None
+    if smtp:
+        server = SmtpServer(('127.0.0.1', 0), SmtpHandler)
+        server.state = state
+        server.context = None
+        if cert:
+            server.context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+            server.context.load_cert_chain(cert, key)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        smtp_port = server.server_address[1]
+    return state, f'http://127.0.0.1:{http.server_address[1]}', smtp_port
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Stand-in http and SMTP endpoints for notify.py.')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--smtp-port', type=int, help='also accept email on this port')
+    parser.add_argument('--cert', help='certificate file, to offer STARTTLS')
+    parser.add_argument('--key', help='key file of the certificate')
+    parser.add_argument('--throttle', type=float, default=0.0, help='fraction of requests to answer with HTTP 429')
+    args = parser.parse_args(argv)
+    state = SinkState(args.throttle)
+    http = SinkServer(('127.0.0.1', args.port), SinkHandler)
+    http.state = state
+    if args.smtp_port:
+        server = SmtpServer(('127.0.0.1', args.smtp_port), SmtpHandler)
+        server.state = state
+        server.context = None
+        if args.cert:
+            server.context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+            server.context.load_cert_chain(args.cert, args.key)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f'sinkemu listening on http://127.0.0.1:{http.server_address[1]}', flush=True)
+    try:
+        http.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()